@@ -33,6 +33,7 @@ from scipy.optimize import bisect
 
 from decimal import Decimal, ROUND_DOWN
 from tickspread_api import TickSpreadAPI
+from auction_sequencer import AuctionSequencer
 # from python_loopring.tickspread_dex import TickSpreadDex
 from outside_api import ByBitAPI, BinanceAPI, BitMEXAPI, HuobiAPI, PythXauAPI
 
@@ -357,6 +358,8 @@ class MarketMaker:
 
         # Market State
         self.last_auction_id = 0
+        self.auction_sequencer = AuctionSequencer(self.apply_update, self.request_market_data,
+                                                  logger=logger, clock=time.time)
         
         self.has_execution_band = False
         self.execution_band_low = None
@@ -536,6 +539,22 @@ class MarketMaker:
         self.logger.info("Canc: %d, Received: %d",
                          order.auction_id_cancel, self.last_auction_id)
 
+    def receive_batch_result(self, operation, result):
+        """Handles a failed or netted batched operation right away, without waiting for the websocket."""
+        if (not TickSpreadAPI.batch_result_failed(result) or operation.get("market") != self.symbol):
+            return
+        order = self.find_order_by_clordid(int(operation["client_order_id"]))
+        if (not order):
+            return
+        if (result.get("status") == "netted"):
+            # Created and deleted in the same flush, neither was sent
+            if (operation["operation"] == "delete"):
+                self.exec_remove(order)
+        elif (operation["operation"] == "create" and order.state == OrderState.PENDING):
+            self.exec_reject(order)
+        elif (operation["operation"] == "delete" and order.cancel == CancelState.PENDING):
+            self.exec_cancel_reject(order)
+
     def find_order_by_clordid(self, clordid):
         for order in self.bids.orders:
             if (order.clordid == clordid):
@@ -681,6 +700,28 @@ class MarketMaker:
                 
         return Decimal(p * float(self.max_price))
     
+    def apply_update(self, payload):
+        """Applies an 'update' payload, called by the auction sequencer in auction order."""
+        self.last_auction_id = int(payload['auction_id'])
+
+        if ('execution_band' in payload):
+            execution_band = payload['execution_band']
+            print("New execution bands: " + str(execution_band))
+            
+            if (not 'high' in execution_band):
+                self.logger.warning("No high in execution_band")
+                return
+            if (not 'low' in execution_band):
+                self.logger.warning("No low in execution_band")
+                return
+            self.execution_band_high = Decimal(execution_band['high'])
+            self.execution_band_low = Decimal(execution_band['low'])
+            self.update_orders()
+
+    def request_market_data(self):
+        """Subscribes to market_data again, for a new partial after an auction gap."""
+        asyncio.get_event_loop().create_task(self.api.subscribe("market_data", {"symbol": self.symbol}))
+
     def tickspread_market_data_partial(self, payload):
         print("MARKET DATA PARTIAL: ", payload)
         if (not 'execution_band' in payload or payload['execution_band'] == None):
@@ -698,7 +739,6 @@ class MarketMaker:
             return
         
         print(execution_band)
-        time.sleep(5.0)
         
         self.execution_band_high = Decimal(execution_band['high'])
         self.execution_band_low = Decimal(execution_band['low'])
@@ -854,6 +894,8 @@ class MarketMaker:
             
             if (topic == "market_data"):
                 self.tickspread_market_data_partial(payload)
+                self.auction_sequencer.on_snapshot(payload.get('auction_id'))
+                self.last_auction_id = self.auction_sequencer.last_auction_id
         
         if (event == "update"):
             if (not 'auction_id' in payload):
@@ -861,27 +903,8 @@ class MarketMaker:
                     "No 'auction_id' in TickSpread %s payload", event)
                 return 0
 
-            auction_id = int(payload['auction_id'])
-            if (self.last_auction_id and auction_id != self.last_auction_id + 1):
-                self.logger.warning(
-                    "Received auction_id = %d, last was %d", auction_id, self.last_auction_id)
-                return 0
-            self.last_auction_id = auction_id
-            #self.logger.info("AUCTION: %d" % auction_id)
-            
-            if ('execution_band' in payload):
-                execution_band = payload['execution_band']
-                print("New execution bands: " + str(execution_band))
-                
-                if (not 'high' in execution_band):
-                    self.logger.warning("No high in execution_band")
-                    return 0
-                if (not 'low' in execution_band):
-                    self.logger.warning("No low in execution_band")
-                    return 0
-                self.execution_band_high = Decimal(execution_band['high'])
-                self.execution_band_low = Decimal(execution_band['low'])
-                self.update_orders()
+            # Applied in auction order, gaps are buffered or resynchronized
+            self.auction_sequencer.on_update(int(payload['auction_id']), payload)
         elif (event == "acknowledge_order" or event == "maker_order"
               or event == "delete_order" or event == "abort_create"
               or event == "active_order" or event == "reject_order"
@@ -977,6 +1000,7 @@ async def main():
     await api.subscribe("market_data", {"symbol": args.market})
     await api.subscribe("user_data", {"symbol": args.market})
     api.on_message(mmaker.callback)
+    api.on_batch_result(mmaker.receive_batch_result)
     
     # These variables are not referred to anywhere, but an object is being created
     # We're passing the mmaker callbacks
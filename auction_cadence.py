@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""Auction period estimation for dispatch timing
+
+TickSpread matches orders in discrete auctions, and every market_data
+"update" carries the auction_id it closed. AuctionCadence learns the
+auction period from the arrival times of those updates (an exponential
+moving average of the time per auction_id, so gaps do not skew it) and
+projects the next auction of each market from the last one seen.
+
+TickSpreadAPI asks it for delay() on dispatch: the queued operations are
+held until `lead` seconds before the next auction, then flushed together,
+so they land in that auction in one request instead of trickling in
+after every external price tick. Inside the lead window, or while the
+period is not known yet, nothing is held.
+
+"""
+
+import math
+import time
+
+
+class AuctionCadence:
+    def __init__(self, *, lead=0.02, alpha=0.2, min_samples=3, clock=time.monotonic):
+        """
+        Args:
+            lead (float): Seconds before the expected auction to flush, covers the request latency.
+            alpha (float): Weight of a new sample in the period average.
+            min_samples (int): Samples needed before operations are held.
+            clock (callable): Time source in seconds.
+        """
+        self.lead = lead
+        self.alpha = alpha
+        self.min_samples = min_samples
+        self.clock = clock
+
+        self.period = None
+        self.samples = 0
+        self.last = {}			# market -> (auction_id, arrival time)
+
+    def on_auction(self, market, auction_id):
+        """Records the arrival of the update of `auction_id` in `market`."""
+        now = self.clock()
+        last = self.last.get(market)
+        if (last is not None):
+            last_id, last_time = last
+            if (auction_id <= last_id):
+                return
+            sample = (now - last_time) / (auction_id - last_id)
+            if (self.period is None):
+                self.period = sample
+            else:
+                self.period += self.alpha * (sample - self.period)
+            self.samples += 1
+        self.last[market] = (auction_id, now)
+
+    def delay(self):
+        """Seconds to hold operations so they go out `lead` before the next auction; None while unknown."""
+        if (self.samples < self.min_samples or not self.period or not self.last):
+            return None
+        now = self.clock()
+        cutoff = None
+        for auction_id, last_time in self.last.values():
+            next_auction = last_time + self.period * (math.floor((now - last_time) / self.period) + 1)
+            if (cutoff is None or next_auction - self.lead < cutoff):
+                cutoff = next_auction - self.lead
+        return max(cutoff - now, 0.0)
+
+    def stats(self):
+        return {
+            "period": self.period,
+            "samples": self.samples,
+            "markets": len(self.last),
+        }
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""In-order delivery of TickSpread auction updates
+
+market_data "update" messages carry consecutive auction_ids. The bots used
+to drop any update that did not follow the last one, and as the last
+auction_id was never advanced past a gap, every later update (and with it
+every execution band change) was dropped until a restart.
+
+AuctionSequencer sits in front of the update handler instead:
+
+    - in-order updates are applied right away
+    - updates after a gap are buffered, and applied in order as soon as
+      the missing ones arrive
+    - if the gap is still open after `gap_timeout` seconds or
+      `max_buffered` updates, `resync()` is called once to request a new
+      market_data partial; the partial's auction_id (on_snapshot) closes
+      the gap and the buffered updates after it are applied
+    - duplicates and updates older than the last applied one are ignored
+
+The counters (gaps, resyncs, ...) are kept for stats.
+
+"""
+
+import logging
+import time
+
+
+class AuctionSequencer:
+    def __init__(self, apply, resync, *, max_buffered=64, gap_timeout=0.5,
+                 logger=logging.getLogger(), clock=time.monotonic):
+        """
+        Args:
+            apply (callable): `apply(payload)`, called for every update in auction order.
+            resync (callable): `resync()`, requests a new market_data partial.
+            max_buffered (int): Buffered updates that force a resync.
+            gap_timeout (float): Seconds a gap may stay open before a resync.
+        """
+        self.apply = apply
+        self.resync = resync
+        self.max_buffered = max_buffered
+        self.gap_timeout = gap_timeout
+        self.logger = logger
+        self.clock = clock
+
+        self.last_auction_id = 0		# 0 until the first update or partial
+        self.buffer = {}			# auction_id -> payload
+        self.gap_since = None
+        self.resync_pending = False
+
+        self.gaps = 0
+        self.recovered = 0
+        self.resyncs = 0
+        self.skipped = 0
+        self.duplicates = 0
+
+    def on_update(self, auction_id, payload):
+        if (self.last_auction_id and auction_id <= self.last_auction_id):
+            self.duplicates += 1
+            return
+        if (not self.last_auction_id or auction_id == self.last_auction_id + 1):
+            self.deliver(auction_id, payload)
+            self.drain()
+            return
+
+        if (self.gap_since is None):
+            self.gaps += 1
+            self.gap_since = self.clock()
+            self.logger.warning("Auction gap: received %d, last was %d", auction_id, self.last_auction_id)
+        self.buffer[auction_id] = payload
+        self.check()
+
+    def check(self):
+        """Requests a resync if the open gap is too old or too long."""
+        if (self.gap_since is None or self.resync_pending):
+            return
+        if (len(self.buffer) > self.max_buffered or self.clock() - self.gap_since > self.gap_timeout):
+            self.resync_pending = True
+            self.resyncs += 1
+            self.logger.warning("Auction gap after %d not filled, requesting a market_data partial",
+                                self.last_auction_id)
+            self.resync()
+
+    def on_snapshot(self, auction_id):
+        """Takes the auction_id of a market_data partial, already applied by the caller."""
+        self.resync_pending = False
+        if (auction_id is None):
+            return
+        auction_id = int(auction_id)
+        if (self.gap_since is not None and auction_id > self.last_auction_id):
+            self.skipped += auction_id - self.last_auction_id - len(
+                [buffered for buffered in self.buffer if buffered <= auction_id])
+        if (auction_id > self.last_auction_id):
+            self.last_auction_id = auction_id
+        for buffered in [buffered for buffered in self.buffer if buffered <= auction_id]:
+            del self.buffer[buffered]
+        self.drain()
+        if (self.buffer):
+            # Still a gap between the partial and the buffered updates
+            self.gap_since = self.clock()
+
+    def deliver(self, auction_id, payload):
+        self.last_auction_id = auction_id
+        self.apply(payload)
+
+    def drain(self):
+        while (self.last_auction_id + 1 in self.buffer):
+            auction_id = self.last_auction_id + 1
+            self.deliver(auction_id, self.buffer.pop(auction_id))
+        if (self.gap_since is not None and not self.buffer):
+            self.recovered += 1
+            self.gap_since = None
+            self.logger.info("Auction gap closed at %d", self.last_auction_id)
+
+    def stats(self):
+        return {
+            "last_auction_id": self.last_auction_id,
+            "buffered": len(self.buffer),
+            "gaps": self.gaps,
+            "recovered": self.recovered,
+            "resyncs": self.resyncs,
+            "skipped": self.skipped,
+            "duplicates": self.duplicates,
+        }
@@ -0,0 +1,521 @@
+# -*- coding: utf-8 -*-
+"""Backtester for bot2 with queue-aware fill simulation
+
+Drives bot2's MarketMaker with historical external trades and simulates the
+TickSpread side of the market:
+
+    - order operations reach the exchange after `latency` and take effect at
+      the next auction boundary; exchange events reach the bot after
+      `latency` as well
+    - creates outside the execution band (reference price +- band) are rejected
+    - resting orders keep a queue position: external volume traded at their
+      price level first consumes the queue ahead of them, then fills them;
+      volume traded through their price fills them completely
+    - fills are maker fills charged with `maker_fee`
+
+The engine is event-driven: trades are aggregated per auction window, only
+auctions with pending operations or trades are simulated, only the price
+levels that were crossed are visited, and the bot is called at most once per
+`quote_interval` with the latest price.
+
+The report uses the bot's own gross_profit/fees_paid bookkeeping and adds
+inventory path, fill rate and order churn.
+
+Input is either Binance trade CSV dumps (trades or aggTrades, as published on
+data.binance.vision) or captures written by feed_recorder.py.
+
+Example:
+    $ python3 backtest.py --market BTC BTCUSDT-trades-2024-06-01.csv
+
+"""
+
+import argparse
+import bisect
+import contextlib
+import csv
+import heapq
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+from decimal import Decimal, ROUND_DOWN
+
+from feed_recorder import read_frames
+from replay import ReplayAPI, ReplayClock, load_bot_module, build_market_maker
+
+
+# Historical data
+
+def read_binance_csv(path):
+    """
+    Yields (time_seconds, price, qty, is_buyer_maker) from Binance trade or aggTrade CSV dumps.
+    """
+    with open(path, newline="") as f:
+        for row in csv.reader(f):
+            if (not row or not row[0][:1].isdigit()):
+                continue	# header
+            if (len(row) >= 8):
+                # aggTrades: agg_id, price, qty, first_id, last_id, time, is_buyer_maker, is_best_match
+                timestamp = int(row[5])
+                is_buyer_maker = row[6]
+            else:
+                # trades: id, price, qty, quote_qty, time, is_buyer_maker, is_best_match
+                timestamp = int(row[4])
+                is_buyer_maker = row[5]
+            # Newer dumps are in microseconds
+            seconds = timestamp / 1e6 if timestamp > 1e14 else timestamp / 1e3
+            yield seconds, float(row[1]), float(row[2]), is_buyer_maker.lower() == "true"
+
+
+def read_capture_trades(path, source="binance-s"):
+    for _, wall_ns, frame_source, payload in read_frames(path):
+        if (frame_source != source):
+            continue
+        data = json.loads(payload)
+        if ("p" not in data):
+            continue
+        yield wall_ns / 1e9, float(data["p"]), float(data.get("q", 0.0)), bool(data.get("m", False))
+
+
+def read_trades(paths):
+    streams = []
+    for path in paths:
+        if (".frames" in path):
+            streams.append(read_capture_trades(path))
+        else:
+            streams.append(read_binance_csv(path))
+    return heapq.merge(*streams, key=lambda trade: trade[0])
+
+
+# Exchange simulation
+
+class SimQuote:
+    __slots__ = ('clordid', 'side', 'price', 'price_f', 'amount_left', 'queue_ahead', 'cancel_requested')
+
+    def __init__(self, clordid, side, price, amount, queue_ahead):
+        self.clordid = clordid
+        self.side = side
+        self.price = price
+        self.price_f = float(price)
+        self.amount_left = amount
+        self.queue_ahead = queue_ahead
+        self.cancel_requested = False
+
+
+class PriceLevels:
+    """Resting quotes of one side, by price, with a sorted index of the prices."""
+
+    def __init__(self):
+        self.levels = {}
+        self.prices = []
+
+    def add(self, quote):
+        level = self.levels.get(quote.price_f)
+        if (level is None):
+            level = self.levels[quote.price_f] = []
+            bisect.insort(self.prices, quote.price_f)
+        level.append(quote)
+
+    def remove(self, quote):
+        level = self.levels.get(quote.price_f)
+        if (level is None or quote not in level):
+            return False
+        level.remove(quote)
+        if (not level):
+            del self.levels[quote.price_f]
+            del self.prices[bisect.bisect_left(self.prices, quote.price_f)]
+        return True
+
+    def at_or_above(self, price):
+        return self.prices[bisect.bisect_left(self.prices, price):]
+
+    def at_or_below(self, price):
+        return self.prices[:bisect.bisect_right(self.prices, price)]
+
+
+class AuctionWindow:
+    __slots__ = ('low', 'high', 'sell_volume', 'buy_volume', 'trades')
+
+    def __init__(self):
+        self.low = float("inf")
+        self.high = float("-inf")
+        self.sell_volume = {}	# price -> volume of seller-initiated trades
+        self.buy_volume = {}	# price -> volume of buyer-initiated trades
+        self.trades = 0
+
+    def add(self, price, qty, is_buyer_maker):
+        self.trades += 1
+        if (price < self.low):
+            self.low = price
+        if (price > self.high):
+            self.high = price
+        volume = self.sell_volume if is_buyer_maker else self.buy_volume
+        volume[price] = volume.get(price, 0.0) + qty
+
+
+class BacktestExchange:
+    def __init__(self, *, symbol, auction_interval, latency, band_fraction,
+                 maker_fee, queue_ahead, flow_fraction):
+        self.symbol = symbol
+        self.auction_interval = auction_interval
+        self.latency = latency
+        self.band_fraction = band_fraction
+        self.maker_fee = Decimal(maker_fee)
+        self.queue_ahead = queue_ahead
+        self.flow_fraction = flow_fraction
+
+        self.auction_id = 0
+        self.reference_price = None
+        self.quotes = {}
+        self.bids = PriceLevels()
+        self.asks = PriceLevels()
+
+        self.arrivals = []		# heap of (time, seq, operation)
+        self.deliveries = []	# heap of (time, seq, message)
+        self.sequence = itertools.count()
+
+        # Statistics
+        self.creates = 0
+        self.cancels = 0
+        self.rejects = 0
+        self.cancel_rejects = 0
+        self.fills = 0
+        self.submitted_volume = Decimal(0)
+        self.filled_volume = Decimal(0)
+
+    def submit(self, operations, now):
+        arrival = now + self.latency
+        for operation in operations:
+            heapq.heappush(self.arrivals, (arrival, next(self.sequence), operation))
+
+    def deliver(self, now, event, payload):
+        payload["market"] = self.symbol
+        message = {"topic": "market_data" if event == "update" else "user_data", "event": event, "payload": payload}
+        heapq.heappush(self.deliveries, (now + self.latency, next(self.sequence), message))
+
+    def execution_band(self):
+        return {"high": str(Decimal(self.reference_price * (1 + self.band_fraction)).quantize(Decimal("0.01"))),
+                "low": str(Decimal(self.reference_price * (1 - self.band_fraction)).quantize(Decimal("0.01")))}
+
+    def next_arrival_time(self):
+        return self.arrivals[0][0] if self.arrivals else None
+
+    def run_auction(self, auction_time, window):
+        self.auction_id += 1
+        if (window and window.trades):
+            self.fill_from_window(auction_time, window)
+
+        while self.arrivals and self.arrivals[0][0] <= auction_time:
+            _, _, operation = heapq.heappop(self.arrivals)
+            if (operation["operation"] == "create"):
+                self.create(auction_time, operation)
+            else:
+                self.cancel(auction_time, operation)
+
+        self.deliver(auction_time, "update", {"auction_id": self.auction_id, "execution_band": self.execution_band()})
+
+    def create(self, now, operation):
+        self.creates += 1
+        clordid = operation["client_order_id"]
+        price = Decimal(operation["price"])
+        amount = Decimal(operation["amount"])
+        self.submitted_volume += amount
+        low = self.reference_price * (1 - self.band_fraction)
+        high = self.reference_price * (1 + self.band_fraction)
+        if (not low <= float(price) <= high):
+            self.rejects += 1
+            self.deliver(now, "reject_order", {"client_order_id": clordid})
+            return
+        quote = SimQuote(clordid, operation["side"], price, amount, self.queue_ahead)
+        self.quotes[clordid] = quote
+        (self.bids if quote.side == "bid" else self.asks).add(quote)
+        self.deliver(now, "acknowledge_order", {"client_order_id": clordid})
+        self.deliver(now, "maker_order", {"client_order_id": clordid})
+
+    def cancel(self, now, operation):
+        self.cancels += 1
+        clordid = operation["client_order_id"]
+        quote = self.quotes.pop(clordid, None)
+        if (quote is None):
+            self.cancel_rejects += 1
+            self.deliver(now, "reject_cancel", {"client_order_id": clordid})
+            return
+        (self.bids if quote.side == "bid" else self.asks).remove(quote)
+        self.deliver(now, "delete_order", {"client_order_id": clordid})
+
+    def fill_from_window(self, now, window):
+        # Bids are hit by prices at or below them, asks lifted by prices at or above them
+        for price_f in reversed(self.bids.at_or_above(window.low)):
+            self.fill_level(now, self.bids, price_f, through=price_f > window.low,
+                            volume=window.sell_volume.get(price_f, 0.0))
+        for price_f in self.asks.at_or_below(window.high):
+            self.fill_level(now, self.asks, price_f, through=price_f < window.high,
+                            volume=window.buy_volume.get(price_f, 0.0))
+
+    def fill_level(self, now, levels, price_f, *, through, volume):
+        volume *= self.flow_fraction
+        for quote in list(levels.levels[price_f]):
+            if (through):
+                amount = quote.amount_left
+            else:
+                consumed = min(volume, quote.queue_ahead)
+                quote.queue_ahead -= consumed
+                volume -= consumed
+                if (volume <= 0):
+                    break
+                amount = min(quote.amount_left, Decimal(repr(volume)).quantize(quote.amount_left, rounding=ROUND_DOWN))
+                volume -= float(amount)
+            if (amount <= 0):
+                continue
+            self.execute(now, levels, quote, amount)
+
+    def execute(self, now, levels, quote, amount):
+        quote.amount_left -= amount
+        fee = amount * quote.price * self.maker_fee
+        self.fills += 1
+        self.filled_volume += amount
+        self.deliver(now, "active_order", {"client_order_id": quote.clordid})
+        self.deliver(now, "maker_trade", {"client_order_id": quote.clordid, "execution_amount": amount,
+                                          "side": quote.side, "price": quote.price, "fee": fee})
+        if (quote.amount_left <= 0):
+            levels.remove(quote)
+            del self.quotes[quote.clordid]
+        else:
+            self.deliver(now, "maker_order", {"client_order_id": quote.clordid})
+
+
+class BacktestAPI(ReplayAPI):
+    """Routes the bot's batches into the simulated exchange instead of capturing them."""
+
+    def __init__(self, clock, exchange):
+        super().__init__(clock)
+        self.exchange = exchange
+        self.batch_count = 0
+
+    def send_batch(self, operations):
+        self.batch_count += 1
+        self.exchange.submit(operations, self.clock.time())
+
+
+# Driver
+
+class Backtest:
+    def __init__(self, mmaker, api, clock, exchange, *, quote_interval, sample_interval=60.0):
+        self.mmaker = mmaker
+        self.api = api
+        self.clock = clock
+        self.exchange = exchange
+        self.quote_interval = quote_interval
+        self.sample_interval = sample_interval
+
+        self.inventory_path = []
+        self.bot_calls = 0
+        self.trades = 0
+        self.last_price = None
+        self.start_time = None
+        self.end_time = None
+
+    def deliver_until(self, now):
+        deliveries = self.exchange.deliveries
+        while deliveries and deliveries[0][0] <= now:
+            delivery_time, _, message = heapq.heappop(deliveries)
+            self.clock.advance_to(delivery_time)
+            self.mmaker.callback("tickspread", message)
+
+    def start(self, timestamp, price):
+        self.clock.advance_to(timestamp)
+        self.exchange.reference_price = price
+        band = self.exchange.execution_band()
+        self.mmaker.callback("tickspread", {"topic": "market_data", "event": "partial",
+                                            "payload": {"execution_band": band}})
+        self.mmaker.callback("tickspread", {"topic": "user_data", "event": "partial", "payload": {
+            "balance": [{"asset": self.mmaker.money, "available": "1000000", "frozen": "0"}],
+            "orders": [],
+            "positions": [{"market": self.mmaker.symbol, "amount": "0", "funding": "0", "entry_price": "0",
+                           "liquidation_price": "0", "total_margin": "0"}]}})
+
+    def run_auctions_until(self, now, window):
+        """Runs the auction closing `window` and any later auction with pending arrivals, up to `now`."""
+        interval = self.exchange.auction_interval
+        boundary = (int(window.start_time / interval) + 1) * interval if window else None
+        if (boundary is not None and boundary <= now):
+            self.exchange.run_auction(boundary, window.stats)
+            self.deliver_until(boundary)
+        while True:
+            arrival = self.exchange.next_arrival_time()
+            if (arrival is None):
+                break
+            boundary = (int(arrival / interval) + 1) * interval
+            if (boundary > now):
+                break
+            self.exchange.run_auction(boundary, None)
+            self.deliver_until(boundary)
+
+    def run(self, trades):
+        window = None
+        last_quote_time = float("-inf")
+        quoted_price = None
+        next_sample = 0.0
+        interval = self.exchange.auction_interval
+
+        for timestamp, price, qty, is_buyer_maker in trades:
+            if (self.start_time is None):
+                self.start_time = timestamp
+                next_sample = timestamp
+                self.start(timestamp, price)
+            self.trades += 1
+
+            # Close the auction window this trade does not belong to
+            if (window and timestamp >= window.end_time):
+                self.run_auctions_until(timestamp, window)
+                window = None
+            else:
+                self.run_auctions_until(timestamp, None)
+            self.deliver_until(timestamp)
+            self.clock.advance_to(timestamp)
+
+            if (window is None):
+                window = OpenWindow(timestamp, interval)
+            window.stats.add(price, qty, is_buyer_maker)
+            self.exchange.reference_price = price
+            self.last_price = price
+
+            if (timestamp - last_quote_time >= self.quote_interval and price != quoted_price):
+                self.mmaker.callback("binance-s", {"p": repr(price)})
+                self.bot_calls += 1
+                last_quote_time = timestamp
+                quoted_price = price
+
+            if (timestamp >= next_sample):
+                self.inventory_path.append((timestamp, float(self.mmaker.position), price))
+                next_sample = timestamp + self.sample_interval
+
+        if (window):
+            self.run_auctions_until(window.end_time, window)
+            self.deliver_until(window.end_time + self.exchange.latency)
+        self.end_time = self.clock.time()
+
+    def report(self):
+        mmaker = self.mmaker
+        exchange = self.exchange
+        mark = Decimal(repr(self.last_price)) if self.last_price else Decimal(0)
+        unrealized = mmaker.position * (mark - Decimal(mmaker.position_entry_price))
+        hours = max((self.end_time or 0) - (self.start_time or 0), 1e-9) / 3600.0
+        return {
+            "market": mmaker.symbol,
+            "trades": self.trades,
+            "bot_calls": self.bot_calls,
+            "hours": hours,
+            "gross_profit": float(mmaker.gross_profit),
+            "fees_paid": float(mmaker.fees_paid),
+            "unrealized_pnl": float(unrealized),
+            "pnl": float(mmaker.gross_profit - mmaker.fees_paid + unrealized),
+            "final_position": float(mmaker.position),
+            "max_abs_position": max((abs(p) for _, p, _ in self.inventory_path), default=0.0),
+            "creates": exchange.creates,
+            "cancels": exchange.cancels,
+            "rejects": exchange.rejects,
+            "cancel_rejects": exchange.cancel_rejects,
+            "fills": exchange.fills,
+            "filled_volume": float(exchange.filled_volume),
+            "fill_rate": float(exchange.filled_volume / exchange.submitted_volume) if exchange.submitted_volume else 0.0,
+            "order_churn_per_hour": (exchange.creates + exchange.cancels) / hours,
+            "batches": self.api.batch_count,
+        }
+
+
+class OpenWindow:
+    __slots__ = ('start_time', 'end_time', 'stats')
+
+    def __init__(self, timestamp, interval):
+        self.start_time = timestamp
+        self.end_time = (int(timestamp / interval) + 1) * interval
+        self.stats = AuctionWindow()
+
+
+def run_backtest(trades, *, market, config_path="config.json", params=None, auction_interval=0.1,
+                 latency=0.02, band_fraction=0.05, maker_fee="0", queue_ahead=0.0, flow_fraction=1.0,
+                 quote_interval=None, sample_interval=60.0):
+    """
+    Runs one backtest of bot2 on `trades` and returns the Backtest (use .report()).
+    """
+    # Start at the first trade, as replay.py does: client_order_ids are
+    # time based, and an id of 0 reads as "no order" to the bots
+    trades = iter(trades)
+    first = next(trades, None)
+    if (first is not None):
+        trades = itertools.chain([first], trades)
+    clock = ReplayClock(first[0] if first is not None else 0.0)
+    load_bot_module("bot2", clock=clock)
+    exchange = BacktestExchange(symbol=market, auction_interval=auction_interval, latency=latency,
+                                band_fraction=band_fraction, maker_fee=maker_fee,
+                                queue_ahead=queue_ahead, flow_fraction=flow_fraction)
+    api = BacktestAPI(clock, exchange)
+    mmaker = build_market_maker("bot2", api, market=market, config_path=config_path, params=params)
+    backtest = Backtest(mmaker, api, clock, exchange,
+                        quote_interval=auction_interval if quote_interval is None else quote_interval,
+                        sample_interval=sample_interval)
+    # bot2 prints on its hot path
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        backtest.run(trades)
+    return backtest
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Backtest bot2 on historical external trades.')
+    parser.add_argument('trades', nargs='+',
+                        help='Binance trade/aggTrade CSV files or feed_recorder captures')
+    parser.add_argument('--market', dest='market', default="BTC",
+                        help='market from config.json (default: BTC)')
+    parser.add_argument('--param', dest='params', action='append', default=[],
+                        help='override a MarketMaker keyword argument, e.g. --param spread_bps=0.4')
+    parser.add_argument('--auction_ms', dest='auction_ms', type=float, default=100.0,
+                        help='auction period in milliseconds (default: 100)')
+    parser.add_argument('--latency_ms', dest='latency_ms', type=float, default=20.0,
+                        help='one-way latency in milliseconds (default: 20)')
+    parser.add_argument('--quote_ms', dest='quote_ms', type=float, default=None,
+                        help='minimum interval between bot price updates (default: auction period)')
+    parser.add_argument('--band', dest='band', type=float, default=0.05,
+                        help='execution band as a fraction of the price (default: 0.05)')
+    parser.add_argument('--maker_fee', dest='maker_fee', default="0",
+                        help='maker fee rate, negative for rebates (default: 0)')
+    parser.add_argument('--queue_ahead', dest='queue_ahead', type=float, default=0.0,
+                        help='volume queued ahead of each new order (default: 0)')
+    parser.add_argument('--flow_fraction', dest='flow_fraction', type=float, default=1.0,
+                        help='fraction of external volume assumed to reach TickSpread (default: 1)')
+    parser.add_argument('--inventory_csv', dest='inventory_csv', default=None,
+                        help='write the inventory path to this CSV file')
+    return parser.parse_args()
+
+
+def main():
+    from replay import parse_param
+
+    args = parse_arguments()
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(levelname)-8s %(message)s')
+
+    start = time.perf_counter()
+    backtest = run_backtest(read_trades(args.trades), market=args.market,
+                            params=dict(parse_param(param) for param in args.params),
+                            auction_interval=args.auction_ms / 1000.0, latency=args.latency_ms / 1000.0,
+                            band_fraction=args.band, maker_fee=args.maker_fee, queue_ahead=args.queue_ahead,
+                            flow_fraction=args.flow_fraction,
+                            quote_interval=args.quote_ms / 1000.0 if args.quote_ms is not None else None)
+    elapsed = time.perf_counter() - start
+
+    report = backtest.report()
+    report["wall_seconds"] = elapsed
+    print(json.dumps(report, indent=2))
+
+    if (args.inventory_csv):
+        with open(args.inventory_csv, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["time", "position", "price"])
+            writer.writerows(backtest.inventory_path)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
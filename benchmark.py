@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+"""Throughput benchmarks for the bot callbacks
+
+Measures messages/second, per-call latency percentiles and allocations per
+call of `MarketMaker.callback` (bot.py, bot2.py, amm.py) and
+`Sweeper.callback` (sweeper.py) on synthetic inputs:
+
+    trades    Binance trade stream (random walk around a reference price)
+    updates   flood of TickSpread auction `update` events
+    execs     bursts of acknowledge_order/maker_order/maker_trade events for
+              the orders the bot has just sent
+
+each across several `orders_per_side` values. Bots run against the replay
+harness (replay.py): an injected clock and an API that captures operations;
+the sweeper's FTX hedge goes to BenchmarkFTXAPI, which only keeps the orders.
+
+Results can be stored as a baseline JSON file and later runs compared
+against it; the process exits with status 1 when a scenario's throughput
+drops by more than `--tolerance`.
+
+Example:
+    $ python3 benchmark.py --save-baseline benchmark_baseline.json
+    $ python3 benchmark.py --baseline benchmark_baseline.json
+
+"""
+
+import argparse
+import contextlib
+import gc
+import json
+import logging
+import os
+import random
+import sys
+import time
+import tracemalloc
+from decimal import Decimal
+
+from replay import ReplayAPI, ReplayClock, load_bot_module, build_market_maker
+
+DEFAULT_ORDERS_PER_SIDE = [10, 35, 50, 100]
+DEFAULT_BOTS = ["bot", "bot2", "amm", "sweeper"]
+
+REFERENCE_PRICE = 2500.0
+MARKET = "ETH"
+MONEY_ASSET = "USD"
+
+BOT_ARGV = {
+    "bot": ["--market", MARKET, "--external_market", "ETHUSDT", "--money_asset", MONEY_ASSET],
+    "amm": ["--market", MARKET, "--money_asset", MONEY_ASSET, "--liquidity", "100",
+            "--neutral_price", "2500", "--max_position", "200", "--tick_jump", "0.5",
+            "--max_price", "5000", "--amount_precision", "3"],
+    "sweeper": ["--market", MARKET, "--ftx_market", "ETH-PERP", "--money_asset", MONEY_ASSET],
+}
+
+# Scenarios each bot understands (amm and the sweeper do not read external prices,
+# and the sweeper has no resting orders to execute)
+BOT_SCENARIOS = {
+    "bot": ["trades", "updates", "execs"],
+    "bot2": ["trades", "updates", "execs"],
+    "amm": ["updates", "execs"],
+    "sweeper": ["updates"],
+}
+
+
+def tickspread_message(topic, event, payload):
+    return json.dumps({"topic": topic, "event": event, "payload": payload})
+
+
+def execution_band(price):
+    return {"high": "%.2f" % (price * 1.05), "low": "%.2f" % (price * 0.95)}
+
+
+def market_data_partial(price):
+    return tickspread_message("market_data", "partial", {"market": MARKET, "execution_band": execution_band(price)})
+
+
+def user_data_partial():
+    return tickspread_message("user_data", "partial", {
+        "balance": [{"asset": MONEY_ASSET, "available": "1000000", "frozen": "0"}],
+        "orders": [],
+        "positions": [{"market": MARKET, "amount": "0", "funding": "0", "entry_price": "0",
+                       "liquidation_price": "0", "total_margin": "0"}]})
+
+
+def trade_stream(n, rng, price=REFERENCE_PRICE):
+    messages = []
+    for i in range(n):
+        price *= 1.0 + rng.gauss(0.0, 0.0001)
+        messages.append(("binance-s", {"e": "trade", "E": i, "s": "ETHUSDT", "t": i,
+                                       "p": "%.2f" % price, "q": "%.4f" % rng.uniform(0.001, 2.0)}))
+    return messages
+
+
+def update_flood(n, first_auction_id=1, price=REFERENCE_PRICE):
+    band = execution_band(price)
+    return [("tickspread", tickspread_message("market_data", "update",
+                                              {"market": MARKET, "auction_id": first_auction_id + i,
+                                               "execution_band": band}))
+            for i in range(n)]
+
+
+def exec_burst(operations, n):
+    """Lifecycle events for the orders the bot sent, at most `n` messages."""
+    creates = [op for op in operations if op.get("operation") == "create"]
+    messages = []
+    for op in creates:
+        clordid = op["client_order_id"]
+        messages.append(("tickspread", tickspread_message("user_data", "acknowledge_order", {"client_order_id": clordid})))
+        messages.append(("tickspread", tickspread_message("user_data", "maker_order", {"client_order_id": clordid})))
+        messages.append(("tickspread", tickspread_message("user_data", "maker_trade", {
+            "client_order_id": clordid, "execution_amount": op["amount"], "side": op["side"]})))
+        if (len(messages) >= n):
+            break
+    return messages[:n]
+
+
+def percentile(sorted_values, fraction):
+    if (not sorted_values):
+        return 0.0
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+class BenchmarkFTXAPI:
+    """Hedge venue of the sweeper: flat, and keeps the IOC orders instead of sending them."""
+
+    def __init__(self):
+        self.orders = []
+
+    def get_positions(self):
+        return []
+
+    def place_order(self, **order):
+        self.orders.append(order)
+
+
+def make_bot(name, orders_per_side):
+    clock = ReplayClock(1700000000.0)
+    module = load_bot_module(name, BOT_ARGV.get(name), clock=clock)
+    api = ReplayAPI(clock)
+    if (name == "bot2"):
+        bot = build_market_maker(name, api, market=MARKET, money_asset=MONEY_ASSET,
+                                 params={"orders_per_side": orders_per_side})
+    elif (name == "bot"):
+        bot = module.MarketMaker(api, tick_jump=Decimal("0.5"), orders_per_side=orders_per_side,
+                                 order_size=Decimal("0.5"), max_position=Decimal("200.0"))
+    elif (name == "amm"):
+        bot = build_market_maker(name, api, params={"orders_per_side": orders_per_side})
+    else:
+        bot = module.Sweeper(api, ftx_api=BenchmarkFTXAPI())
+    return bot, api, clock
+
+
+def prime(bot, api, clock, rng):
+    """Brings the bot to its quoting state and returns the operations it sent."""
+    bot.callback("tickspread", market_data_partial(REFERENCE_PRICE))
+    bot.callback("tickspread", user_data_partial())
+    if (hasattr(bot, "common_callback")):
+        for source, message in trade_stream(5, rng):
+            clock.now += 0.001
+            bot.callback(source, message)
+    api.dispatch_batch()
+    return [op for _, op in api.operations_log]
+
+
+def measure(bot, clock, messages, track_allocations):
+    callback = bot.callback
+    timings = []
+    alloc_peaks = []
+    blocks_before = sys.getallocatedblocks()
+
+    gc.collect()
+    gc.disable()
+    try:
+        if (track_allocations):
+            tracemalloc.start()
+        start = time.perf_counter()
+        for source, message in messages:
+            clock.now += 0.001
+            if (track_allocations):
+                tracemalloc.reset_peak()
+                base, _ = tracemalloc.get_traced_memory()
+            t0 = time.perf_counter_ns()
+            callback(source, message)
+            timings.append(time.perf_counter_ns() - t0)
+            if (track_allocations):
+                _, peak = tracemalloc.get_traced_memory()
+                alloc_peaks.append(peak - base)
+        elapsed = time.perf_counter() - start
+    finally:
+        if (track_allocations):
+            tracemalloc.stop()
+        gc.enable()
+
+    net_blocks = sys.getallocatedblocks() - blocks_before
+    timings.sort()
+    n = len(messages)
+    result = {
+        "messages": n,
+        "msgs_per_sec": n / elapsed if elapsed else 0.0,
+        "p50_us": percentile(timings, 0.50) / 1000.0,
+        "p90_us": percentile(timings, 0.90) / 1000.0,
+        "p99_us": percentile(timings, 0.99) / 1000.0,
+        "max_us": timings[-1] / 1000.0 if timings else 0.0,
+        "net_blocks_per_call": net_blocks / n if n else 0.0,
+    }
+    if (track_allocations):
+        result["alloc_peak_bytes_per_call"] = sum(alloc_peaks) / n if n else 0.0
+    return result
+
+
+def run_scenario(name, orders_per_side, scenario, n, seed, track_allocations):
+    rng = random.Random(seed)
+    bot, api, clock = make_bot(name, orders_per_side)
+    sent = prime(bot, api, clock, rng)
+
+    if (scenario == "trades"):
+        messages = trade_stream(n, rng)
+    elif (scenario == "updates"):
+        messages = update_flood(n, first_auction_id=getattr(bot, "last_auction_id", 0) + 1)
+    else:
+        messages = exec_burst(sent, n)
+        if (not messages):
+            return None
+
+    result = measure(bot, clock, messages, track_allocations=False)
+    if (track_allocations):
+        # Allocation tracking distorts timings, so it runs on a fresh bot
+        rng = random.Random(seed)
+        bot, api, clock = make_bot(name, orders_per_side)
+        prime(bot, api, clock, rng)
+        allocations = measure(bot, clock, messages, track_allocations=True)
+        result["alloc_peak_bytes_per_call"] = allocations["alloc_peak_bytes_per_call"]
+        result["net_blocks_per_call"] = allocations["net_blocks_per_call"]
+    result["operations_per_message"] = (len(api.operations_log) - len(sent)) / len(messages)
+    return result
+
+
+def run_all(bots, orders_per_side_values, n, seed, track_allocations):
+    results = {}
+    for name in bots:
+        try:
+            load_bot_module(name, BOT_ARGV.get(name))
+        except Exception as e:
+            print("%-8s skipped: cannot import (%s)" % (name, e))
+            continue
+        for orders_per_side in orders_per_side_values:
+            for scenario in BOT_SCENARIOS[name]:
+                key = "%s/%s/%d" % (name, scenario, orders_per_side)
+                # The bots print on their hot path; keep that out of the report
+                with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                    result = run_scenario(name, orders_per_side, scenario, n, seed, track_allocations)
+                if (result is None):
+                    continue
+                results[key] = result
+                print("%-22s %10.0f msg/s  p50 %8.1fus  p99 %8.1fus  max %9.1fus  %8.0f B/call  %.2f ops/msg" % (
+                    key, result["msgs_per_sec"], result["p50_us"], result["p99_us"], result["max_us"],
+                    result.get("alloc_peak_bytes_per_call", 0.0), result["operations_per_message"]))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for key, result in sorted(results.items()):
+        if (key not in baseline):
+            continue
+        before = baseline[key]["msgs_per_sec"]
+        after = result["msgs_per_sec"]
+        change = (after - before) / before if before else 0.0
+        marker = ""
+        if (change < -tolerance):
+            marker = "  REGRESSION"
+            regressions.append(key)
+        print("%-22s %10.0f -> %10.0f msg/s (%+.1f%%)%s" % (key, before, after, 100.0 * change, marker))
+    return regressions
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the bot callbacks on synthetic feeds.')
+    parser.add_argument('--bots', dest='bots', default=",".join(DEFAULT_BOTS),
+                        help='comma separated bots to run (default: %s)' % ",".join(DEFAULT_BOTS))
+    parser.add_argument('--orders_per_side', dest='orders_per_side',
+                        default=",".join(str(n) for n in DEFAULT_ORDERS_PER_SIDE),
+                        help='comma separated orders_per_side values (default: 10,35,50,100)')
+    parser.add_argument('--messages', dest='messages', type=int, default=2000,
+                        help='messages per scenario (default: 2000)')
+    parser.add_argument('--seed', dest='seed', type=int, default=1,
+                        help='random seed of the synthetic feeds (default: 1)')
+    parser.add_argument('--no-allocations', dest='allocations', action='store_false',
+                        help='skip the allocation tracking pass')
+    parser.add_argument('--baseline', dest='baseline', default=None,
+                        help='compare against this baseline JSON file')
+    parser.add_argument('--save-baseline', dest='save_baseline', default=None,
+                        help='store the results as a baseline JSON file')
+    parser.add_argument('--tolerance', dest='tolerance', type=float, default=0.2,
+                        help='allowed relative throughput drop before flagging a regression (default: 0.2)')
+    parser.add_argument('--log_level', dest='log_level', default="WARNING",
+                        help='set the logging level while benchmarking (default: WARNING)')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    logging.basicConfig(level=getattr(logging, args.log_level.upper()),
+                        format='%(asctime)s %(levelname)-8s %(message)s')
+    logging.getLogger().setLevel(getattr(logging, args.log_level.upper()))
+
+    bots = [name for name in args.bots.split(",") if name]
+    orders_per_side_values = [int(n) for n in args.orders_per_side.split(",") if n]
+    results = run_all(bots, orders_per_side_values, args.messages, args.seed, args.allocations)
+
+    rc = 0
+    if (args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        if (compare(results, baseline, args.tolerance)):
+            rc = 1
+
+    if (args.save_baseline):
+        with open(args.save_baseline, "w") as f:
+            json.dump({"python": sys.version, "messages": args.messages, "seed": args.seed,
+                       "results": results}, f, indent=2, sort_keys=True)
+    return rc
+
+if __name__ == "__main__":
+    sys.exit(main())
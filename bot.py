@@ -41,6 +41,7 @@ import logging.handlers
 
 from decimal import Decimal
 from tickspread_api import TickSpreadAPI
+from auction_sequencer import AuctionSequencer
 # from python_loopring.tickspread_dex import TickSpreadDex
 from outside_api import ByBitAPI, BinanceAPI, BitMEXAPI, HuobiAPI, PythXauAPI
 
@@ -328,6 +329,8 @@ class MarketMaker:
 
         # Market State
         self.last_auction_id = 0
+        self.auction_sequencer = AuctionSequencer(self.apply_update, self.request_market_data,
+                                                  logger=logger, clock=time.time)
         
         self.has_execution_band = False
         self.execution_band_low = None
@@ -513,6 +516,22 @@ class MarketMaker:
         self.logger.info("Canc: %d, Received: %d",
                          order.auction_id_cancel, self.last_auction_id)
 
+    def receive_batch_result(self, operation, result):
+        """Handles a failed or netted batched operation right away, without waiting for the websocket."""
+        if (not TickSpreadAPI.batch_result_failed(result) or operation.get("market") != self.symbol):
+            return
+        order = self.find_order_by_clordid(int(operation["client_order_id"]))
+        if (not order):
+            return
+        if (result.get("status") == "netted"):
+            # Created and deleted in the same flush, neither was sent
+            if (operation["operation"] == "delete"):
+                self.exec_remove(order)
+        elif (operation["operation"] == "create" and order.state == OrderState.PENDING):
+            self.exec_reject(order)
+        elif (operation["operation"] == "delete" and order.cancel == CancelState.PENDING):
+            self.exec_cancel_reject(order)
+
     def find_order_by_clordid(self, clordid):
         for order in self.bids.orders:
             if (order.clordid == clordid):
@@ -626,6 +645,25 @@ class MarketMaker:
         self.bids.maybe_cancel_bottom_orders()
         self.asks.maybe_cancel_bottom_orders()
     
+    def apply_update(self, payload):
+        """Applies an 'update' payload, called by the auction sequencer in auction order."""
+        self.last_auction_id = int(payload['auction_id'])
+
+        if ('execution_band' in payload):
+            execution_band = payload['execution_band']
+            if (not 'high' in execution_band):
+                self.logger.warning("No high in execution_band")
+                return
+            if (not 'low' in execution_band):
+                self.logger.warning("No low in execution_band")
+                return
+            self.execution_band_high = Decimal(execution_band['high'])
+            self.execution_band_low = Decimal(execution_band['low'])
+
+    def request_market_data(self):
+        """Subscribes to market_data again, for a new partial after an auction gap."""
+        asyncio.get_event_loop().create_task(self.api.subscribe("market_data", {"symbol": self.symbol}))
+
     def tickspread_market_data_partial(self, payload):
         print("MARKET DATA PARTIAL: ", payload)
         if (not 'execution_band' in payload or payload['execution_band'] == None):
@@ -644,7 +682,6 @@ class MarketMaker:
             
         
         print(execution_band)
-        time.sleep(5.0)
         
         self.execution_band_high = Decimal(execution_band['high'])
         self.execution_band_low = Decimal(execution_band['low'])
@@ -791,6 +828,8 @@ class MarketMaker:
             
             if (topic == "market_data"):
                 self.tickspread_market_data_partial(payload)
+                self.auction_sequencer.on_snapshot(payload.get('auction_id'))
+                self.last_auction_id = self.auction_sequencer.last_auction_id
         
         if (event == "update"):
             if (not 'auction_id' in payload):
@@ -798,24 +837,8 @@ class MarketMaker:
                     "No 'auction_id' in TickSpread %s payload", event)
                 return 0
 
-            auction_id = int(payload['auction_id'])
-            if (self.last_auction_id and auction_id != self.last_auction_id + 1):
-                self.logger.warning(
-                    "Received auction_id = %d, last was %d", auction_id, self.last_auction_id)
-                return 0
-            self.last_auction_id = auction_id
-            #self.logger.info("AUCTION: %d" % auction_id)
-            
-            if ('execution_band' in payload):
-                execution_band = payload['execution_band']
-                if (not 'high' in execution_band):
-                    self.logger.warning("No high in execution_band")
-                    return 0
-                if (not 'low' in execution_band):
-                    self.logger.warning("No low in execution_band")
-                    return 0
-                self.execution_band_high = Decimal(execution_band['high'])
-                self.execution_band_low = Decimal(execution_band['low'])
+            # Applied in auction order, gaps are buffered or resynchronized
+            self.auction_sequencer.on_update(int(payload['auction_id']), payload)
         elif (event == "acknowledge_order" or event == "maker_order"
               or event == "delete_order" or event == "system_delete_order" or event == "abort_create"
               or event == "active_order" or event == "reject_order"
@@ -937,6 +960,30 @@ class MarketMaker:
         return rc
 
 
+# MarketMaker settings per market, also used by replay.py
+MARKET_PARAMS = {
+    "ETH": dict(tick_jump=Decimal("0.5"), orders_per_side=35,
+                order_size=Decimal("0.5"), max_position=Decimal("200.0")),
+    "SOL": dict(tick_jump=Decimal("0.05"), orders_per_side=35,
+                order_size=Decimal("10.0"), max_position=Decimal("500.0")),
+    "BNB": dict(tick_jump=Decimal("0.2"), orders_per_side=20,
+                order_size=Decimal("4.0"), max_position=Decimal("150.0")),
+    "BTC": dict(tick_jump=Decimal("2.0"), orders_per_side=50,
+                order_size=Decimal("0.01"), max_position=Decimal("18.0")),
+    "BTC|y000": dict(tick_jump=Decimal("100.0"), orders_per_side=40,
+                     order_size=Decimal("0.0003"), max_position=Decimal("0.2"), max_diff=0.6, leverage=2),
+}
+MARKET_PARAMS["BTC-PERP"] = MARKET_PARAMS["BTC"]
+MARKET_PARAMS["BTC|n000"] = MARKET_PARAMS["BTC|y000"]
+
+
+def market_maker_params(market):
+    """Returns the MarketMaker keyword arguments of `market`; raises KeyError for an unknown market."""
+    if market not in MARKET_PARAMS:
+        raise KeyError("No MarketMaker settings for '%s' in bot.py" % market)
+    return dict(MARKET_PARAMS[market])
+
+
 async def main():
     if dex == True:
         # api = TickSpreadDex(id_multiple=1000, env=env)
@@ -956,18 +1003,8 @@ async def main():
         #     mmaker = MarketMaker(api, tick_jump=Decimal("0.01"), orders_per_side=50,
         #                     order_size=Decimal("0.05"), max_position=Decimal("5.0"))
 
-        if args.market == "ETH":
-            mmaker = MarketMaker(api, tick_jump=Decimal("0.5"), orders_per_side=35,
-                            order_size=Decimal("0.5"), max_position=Decimal("200.0"))
+        mmaker = MarketMaker(api, **market_maker_params(args.market))
 
-        if args.market == "SOL":
-            mmaker = MarketMaker(api, tick_jump=Decimal("0.05"), orders_per_side=35,
-                            order_size=Decimal("10.0"), max_position=Decimal("500.0"))
-
-        if args.market == "BNB":
-            mmaker = MarketMaker(api, tick_jump=Decimal("0.2"), orders_per_side=20,
-                            order_size=Decimal("4.0"), max_position=Decimal("150.0"))
-            
         # if args.market == "ETH-TEST":
         #     # mmaker = MarketMaker(api, tick_jump=Decimal("0.2"), orders_per_side8,
         #     #                 order_size=Decimal("1.5"), max_position=Decimal("40.0"))
@@ -984,15 +1021,6 @@ async def main():
         #     mmaker = MarketMaker(api, tick_jump=Decimal("1.0"), orders_per_side=10,
         #                     order_size=Decimal("0.01"), max_position=Decimal("4.0"))
 
-        if args.market == "BTC" or args.market == "BTC-PERP":
-            mmaker = MarketMaker(api, tick_jump=Decimal("2.0"), orders_per_side=50,
-                            order_size=Decimal("0.01"), max_position=Decimal("18.0"))
-
-        
-
-        if args.market == "BTC|y000" or args.market == "BTC|n000":
-            mmaker = MarketMaker(api, tick_jump=Decimal("100.0"), orders_per_side=40,
-                            order_size=Decimal("0.0003"), max_position=Decimal("0.2"), max_diff=0.6, leverage=2)
         print("REGISTER")
         api.register('maker%s@tickspread.com' % id, tickspread_password)
         time.sleep(0.3)
@@ -1015,6 +1043,7 @@ async def main():
         await api.subscribe("market_data", {"symbol": args.market})
         await api.subscribe("user_data", {"symbol": args.market})
         api.on_message(mmaker.callback)
+        api.on_batch_result(mmaker.receive_batch_result)
         
         # These variables are not referred to anywhere, but an object is being created
         # We're passing the mmaker callbacks
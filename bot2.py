@@ -8,12 +8,25 @@ import asyncio
 import logging
 from enum import Enum
 
+import os
 import time
 import sys
+import atexit
 import logging.handlers
 
 from tickspread_api import TickSpreadAPI
-from outside_api import BinanceAPI, PythXauAPI
+from feed_recorder import FeedRecorder
+from feed_hub import FeedHub, FeedHubClient, PRICE_SOURCES
+from price_bus import PriceBusReader
+from market_params import MarketParams, DECIMAL_ZERO, DECIMAL_ONE, DELTA_TICKS_QUANTUM, to_decimal
+from risk import RiskEngine, RiskClient, RiskLimits
+from order_snapshot import OrderSnapshot
+from auction_sequencer import AuctionSequencer
+from timer_wheel import TimerWheel
+from rate_limiter import RateLimiter
+from auction_cadence import AuctionCadence
+from loop_monitor import LoopMonitor
+from metrics import REGISTRY, start_metrics_server
 
 class Side(Enum):
     BID = 1
@@ -96,7 +109,26 @@ def order_cancel_to_str(cancel):
         return "?"
 
 
+def old_order_clordid(old_order):
+    """Returns the client_order_id of an order of the user_data partial, None if it has none (e.g. placed by hand)."""
+    try:
+        return int(old_order['client_order_id'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
 MAX_CANCEL_RETRIES = 50
+# Backoff between retries of a rejected cancel, doubling from the minimum
+CANCEL_RETRY_MIN_DELAY = 0.05
+CANCEL_RETRY_MAX_DELAY = 2.0
+# A create still not acknowledged after this many auctions or seconds is reaped
+ACK_TIMEOUT_AUCTIONS = 20
+ACK_TIMEOUT = 5.0
+# Ring slots the reaper looks at per timer tick
+REAPER_SLOTS_PER_TICK = 4
+# Backoff between resends of the pulled cancels while order requests fail
+API_DOWN_RETRY_MIN_DELAY = 1.0
+API_DOWN_RETRY_MAX_DELAY = 30.0
 
 
 class Order:
@@ -112,6 +144,8 @@ class Order:
         self.auction_id_send = 0
         self.auction_id_cancel = 0
         self.last_send_time = 0.0
+        self.reaped = False
+        self.cancel_timer = None
         self.logger = logger
 
     def __str__(self):
@@ -133,6 +167,8 @@ class MarketMakerSide:
         self.min_order_size = Decimal(str(min_order_size))
         self.available_limit = Decimal(str(available_limit))
         self.tick_jump = Decimal(str(tick_jump))
+        self.tick_jump_reciprocal = None
+        self.price_increment = -self.tick_jump if side == Side.BID else self.tick_jump
         
         self.last_status_time = 0.0
 
@@ -141,6 +177,11 @@ class MarketMakerSide:
         self.orders = []
         for i in range(self.max_orders):
             self.orders.append(Order(self.side, self.parent.logger))
+        self.pending_max_orders = None
+
+        # Creates the rate limit leaves for the current recalculation, None if unlimited
+        self.create_allowance = None
+        self.creates_deferred = 0
 
     def round_down_to_precision(self, value, precision):
         return value.quantize(precision, rounding=ROUND_DOWN)
@@ -153,10 +194,14 @@ class MarketMakerSide:
 
     def set_new_price(self, new_price):
         tick_jump = self.tick_jump
+        if (self.tick_jump_reciprocal is not None):
+            ticks = new_price * self.tick_jump_reciprocal
+        else:
+            ticks = new_price / tick_jump
         if self.side == Side.BID:
-            new_top_price = (new_price / tick_jump).to_integral_value(rounding=ROUND_DOWN) * tick_jump
+            new_top_price = ticks.to_integral_value(rounding=ROUND_DOWN) * tick_jump
         else:
-            new_top_price = (new_price / tick_jump).to_integral_value(rounding=ROUND_UP) * tick_jump
+            new_top_price = ticks.to_integral_value(rounding=ROUND_UP) * tick_jump
 
         self.old_top_price = self.top_price
         self.top_price = new_top_price
@@ -169,8 +214,8 @@ class MarketMakerSide:
                 steps_diff = +int(price_diff / self.tick_jump)
             self.top_order = self.old_top_order + steps_diff
         self.parent.logger.debug(
-            "%s - top: %d => %d (%s)" %
-            (side_to_str(self.side), self.old_top_order, self.top_order, self.top_price))
+            "%s - top: %d => %d (%s)",
+            side_to_str(self.side), self.old_top_order, self.top_order, self.top_price)
 
     def recalculate_all_orders(self):
         current_time = time.time()
@@ -182,23 +227,38 @@ class MarketMakerSide:
 
         price_increment = self.get_price_increment()
         price = self.top_price
+        # Checked once, the per-level debug lines are formatted eagerly
+        log_levels = self.parent.logger.isEnabledFor(logging.DEBUG)
 
         # Initialize counters
         active_order_count = 0
-        total_liquidity = Decimal(0)
-        pending_cancel_liquidity = Decimal(0)
+        total_liquidity = DECIMAL_ZERO
+        pending_cancel_liquidity = DECIMAL_ZERO
+        live_orders_left = sum(1 for order in self.orders if order.state != OrderState.EMPTY)
 
         # Iterate through all order slots in the circular buffer
         for i in range(self.max_orders):
             index = self.get_order_index(i)
             order = self.orders[index]
 
+            # Empty slots past the limits neither cancel nor place anything,
+            # and the limits only tighten further down the ring
+            if (order.state == OrderState.EMPTY):
+                if (self.has_reached_limits(total_liquidity, active_order_count)):
+                    if (not live_orders_left):
+                        break
+                    price += price_increment
+                    continue
+            else:
+                live_orders_left -= 1
+
             # Calculate liquidity metrics for the current price level
             delta_ticks, expected_liquidity = self.calculate_liquidity_metrics(price, price_increment)
             liquidity_deltas = self.compute_liquidity_deltas(expected_liquidity, total_liquidity, pending_cancel_liquidity)
 
             # Log liquidity calculations for debugging
-            self.log_liquidity_metrics(price, delta_ticks, expected_liquidity, liquidity_deltas)
+            if (log_levels):
+                self.log_liquidity_metrics(price, delta_ticks, expected_liquidity, liquidity_deltas)
 
             # Handle order cancellations based on liquidity conditions
             self.handle_order_cancellations(order, price, liquidity_deltas, active_order_count)
@@ -235,7 +295,7 @@ class MarketMakerSide:
 
     def get_price_increment(self):
         """Determines the price increment direction based on the order side."""
-        return -self.tick_jump if self.side == Side.BID else self.tick_jump
+        return self.price_increment
 
     def get_order_index(self, iteration):
         """Calculates the order index in the circular buffer based on the iteration."""
@@ -249,7 +309,7 @@ class MarketMakerSide:
         expected_liquidity: The cumulative liquidity expected at this price level.
         """
         delta_ticks = (price - self.parent.fair_price) / price_increment
-        delta_ticks = delta_ticks.quantize(Decimal("0.001"), rounding=ROUND_DOWN)
+        delta_ticks = delta_ticks.quantize(DELTA_TICKS_QUANTUM, rounding=ROUND_DOWN)
 
         # Calculate expected liquidity based on the liquidity curve
         expected_liquidity = self.parent.avg_tick_liquidity * delta_ticks
@@ -322,13 +382,18 @@ class MarketMakerSide:
         - Ensures the new order size respects the minimum order size constraint.
         """
         if order.state == OrderState.EMPTY and liquidity_deltas['needed'] > self.min_order_size:
+            if (self.create_allowance is not None and self.create_allowance <= 0):
+                # Out of budget; the levels nearer the touch already had their turn
+                self.creates_deferred += 1
+                return
             size = min(liquidity_deltas['needed'], self.available_limit)
             size = min(size, self.parent.max_order_size)
             # Round down the size to the precision of min_order_size, but don't force it to be a multiple
             rounded_size = self.round_down_to_precision(size, self.min_order_size)
             self.parent.logger.info("Found empty order %d, will send NEW with size %d", self.get_order_index(i), rounded_size)
             if rounded_size >= self.min_order_size:
-                self.parent.send_new(order, rounded_size, price)
+                if self.parent.send_new(order, rounded_size, price) and self.create_allowance is not None:
+                    self.create_allowance -= 1
 
     def update_liquidity_counters(self, order, active_order_count, total_liquidity, pending_cancel_liquidity):
         """
@@ -340,9 +405,9 @@ class MarketMakerSide:
         """
         if order.state != OrderState.EMPTY:
             active_order_count += 1
-            total_liquidity += Decimal(str(order.amount_left))
+            total_liquidity += order.amount_left
             if order.cancel == CancelState.PENDING:
-                pending_cancel_liquidity += Decimal(str(order.amount_left))
+                pending_cancel_liquidity += order.amount_left
         return active_order_count, total_liquidity, pending_cancel_liquidity
 
     def has_reached_limits(self, total_liquidity, active_order_count):
@@ -356,12 +421,98 @@ class MarketMakerSide:
             or active_order_count >= self.target_num_orders
         )
 
+    def adopt(self, index, clordid, price, amount_left, total_amount=None):
+        """
+        Takes a resting order of a previous run into slot `index`, as if it had been sent by this bot.
+
+        Args:
+            index (int): Slot in the ring, must be empty.
+            clordid (int): The order's client_order_id.
+            price (Decimal): The order's price.
+            amount_left (Decimal): The amount still open on the exchange.
+            total_amount (Decimal, optional): The original amount, defaults to amount_left.
+        """
+        order = self.orders[index]
+        assert (order.state == OrderState.EMPTY)
+        order.state = OrderState.MAKER
+        order.cancel = CancelState.NORMAL
+        order.cancel_retries = 0
+        order.clordid = clordid
+        order.price = price
+        order.amount_left = amount_left
+        order.total_amount = total_amount if total_amount is not None else amount_left
+        order.auction_id_send = self.parent.last_auction_id
+
+    def adopt_on_grid(self, clordid, price, amount_left):
+        """
+        Adopts a resting order into the slot of its price, if that price is on the current ladder.
+
+        Returns:
+            bool: False if the price is off the tick grid, outside the ring
+            or its slot is already taken; the order is then not adopted.
+        """
+        steps = (price - self.top_price) / self.price_increment
+        if (steps != steps.to_integral_value() or steps < 0 or steps >= self.max_orders):
+            return False
+        index = self.get_order_index(int(steps))
+        if (self.orders[index].state != OrderState.EMPTY):
+            return False
+        self.adopt(index, clordid, price, amount_left)
+        return True
+
+    def set_params(self, params):
+        """Takes the grid and size settings of a MarketParams."""
+        if (self.tick_jump != params.tick_jump):
+            self.set_tick_jump(params.tick_jump)
+        self.tick_jump_reciprocal = params.tick_jump_reciprocal
+        self.min_order_size = params.lot_size
+
+    def set_tick_jump(self, tick_jump):
+        """Changes the price grid; the next set_new_price starts from a fresh top price."""
+        self.tick_jump = Decimal(str(tick_jump))
+        self.tick_jump_reciprocal = None
+        self.price_increment = -self.tick_jump if self.side == Side.BID else self.tick_jump
+        self.top_price = None
+
+    def resize(self, target_num_orders):
+        """
+        Changes the number of orders per side, keeping the live orders in their slots.
+
+        The ring is rebased so the top order is slot 0. When shrinking, slots
+        beyond the new ring size must be empty first: the lower target makes
+        the next recalculations cancel the excess orders, and the shrink is
+        retried by apply_pending_resize until it fits.
+        """
+        self.target_num_orders = target_num_orders
+        self.pending_max_orders = 2 * target_num_orders
+        self.apply_pending_resize()
+
+    def apply_pending_resize(self):
+        new_max_orders = self.pending_max_orders
+        if (new_max_orders is None):
+            return True
+
+        ordered = [self.orders[self.get_order_index(i)] for i in range(self.max_orders)]
+        if (any(order.state != OrderState.EMPTY for order in ordered[new_max_orders:])):
+            return False
+
+        ordered = ordered[:new_max_orders]
+        while (len(ordered) < new_max_orders):
+            ordered.append(Order(self.side, self.parent.logger))
+        self.orders = ordered
+        self.max_orders = new_max_orders
+        self.top_order = 0
+        self.pending_max_orders = None
+        return True
+
 class MarketMaker:
     def __init__(self, api, market, money_asset, *, logger=logging.getLogger(),
                  name="bot_example", version="0.0",
                  orders_per_side=8, max_position=400, tick_jump=10, min_order_size=0.5,
                  order_leverage=50, target_leverage=10,
-                 max_diff = 0.004, max_liquidity = -1, max_order_size=10.0, spread_bps=0.5):
+                 max_diff = 0.004, max_liquidity = -1, max_order_size=10.0, spread_bps=0.5,
+                 liquidity_curve_hysteresis_low=0.9, liquidity_curve_hysteresis_minimum=0.8,
+                 adopt_old_orders=False, ack_timeout_auctions=ACK_TIMEOUT_AUCTIONS, ack_timeout=ACK_TIMEOUT):
         """
         Initializes the MarketMaker with a circular buffer to manage orders.
 
@@ -376,16 +527,40 @@ class MarketMaker:
         self.name = name
         self.version = version
 
+        # Parameters, validated and precomputed once (raises ValueError)
+        params = MarketParams(orders_per_side=orders_per_side, max_position=max_position, tick_jump=tick_jump,
+                              min_order_size=min_order_size, order_leverage=order_leverage,
+                              target_leverage=target_leverage, max_diff=max_diff, max_liquidity=max_liquidity,
+                              max_order_size=max_order_size, spread_bps=spread_bps,
+                              liquidity_curve_hysteresis_low=liquidity_curve_hysteresis_low,
+                              liquidity_curve_hysteresis_minimum=liquidity_curve_hysteresis_minimum)
+
         # Structure
         self.bids = MarketMakerSide(self, side=Side.BID,
-                                    target_num_orders=orders_per_side, max_orders=2*orders_per_side,
-                                    min_order_size=min_order_size, available_limit=max_position, tick_jump=tick_jump)
+                                    target_num_orders=params.orders_per_side, max_orders=params.max_orders,
+                                    min_order_size=params.lot_size, available_limit=params.max_position,
+                                    tick_jump=params.tick_jump)
         self.asks = MarketMakerSide(self, side=Side.ASK,
-                                    target_num_orders=orders_per_side, max_orders=2*orders_per_side,
-                                    min_order_size=min_order_size, available_limit=max_position, tick_jump=tick_jump)
+                                    target_num_orders=params.orders_per_side, max_orders=params.max_orders,
+                                    min_order_size=params.lot_size, available_limit=params.max_position,
+                                    tick_jump=params.tick_jump)
 
         # Market State
         self.last_auction_id = 0
+        self.auction_sequencer = AuctionSequencer(self.apply_update, self.request_market_data,
+                                                  logger=logger, clock=time.time)
+        self.router = None
+
+        # Timers, advanced from the callbacks and timer_loop
+        self.timers = TimerWheel(clock=time.time)
+        self.cancel_all_count = 0
+
+        # Pending-order reaper, one slot sweep per timer tick
+        self.ack_timeout_auctions = ack_timeout_auctions
+        self.ack_timeout = ack_timeout
+        self.reaper_cursor = 0
+        self.reaped_orders = 0
+        self.timers.schedule(self.timers.tick, self.reap_pending)
         
         self.has_execution_band = False
         self.execution_band_low = None
@@ -410,24 +585,32 @@ class MarketMaker:
         self.gross_profit = 0
         self.fees_paid = 0
 
+        # Account risk throttle, see risk.py
+        self.risk = None
+        self.risk_level = None
+        self.size_factor = DECIMAL_ONE
+        self.spread_multiplier = DECIMAL_ONE
+        self.quotes_pulled = False
+        # Order requests keep failing, see TickSpreadAPI.on_api_state
+        self.api_down = False
+        self.api_down_retries = 0
+        self.api_down_timer = None
+
+        # Warm restart, see order_snapshot.py
+        self.snapshot = None
+        self.restored_snapshot = None
+        # Map the old orders of the partial onto the ladder instead of cancelling them
+        self.adopt_old_orders = adopt_old_orders
+        self.pending_adoption = False
+
         # Parameters
-        self.tick_jump = Decimal(tick_jump)
-        self.min_order_size = Decimal(min_order_size)
-        self.max_order_size = Decimal(max_order_size)
-        self.order_leverage = Decimal(order_leverage)
-        self.target_leverage = Decimal(target_leverage)
         self.symbol = market
         self.money = money_asset
-        self.max_diff = Decimal(str(max_diff))
-        self.max_position = Decimal(str(max_position))
-        if (max_liquidity >= 0):
-            self.max_liquidity = Decimal(str(max_liquidity))
-        else:
-            self.max_liquidity = Decimal(str(max_position))
-        
-        # Hardcoded parameters -- the lower the higher the hysteresis
-        self.liquidity_curve_hysteresis_low = Decimal(0.9)
-        self.liquidity_curve_hysteresis_minimum = Decimal(0.8)
+        self.apply_params(params)
+
+        # Messages per source, the rest of the metrics is read by collect_metrics()
+        self.messages = REGISTRY.counter("messages_total", "Messages received", ("market", "source"))
+        self.messages_by_source = {}	# source -> Counter
 
         # State
         self.real = True
@@ -435,8 +618,211 @@ class MarketMaker:
         self.fair_price = None
         self.kyle_impact = None
         self.avg_tick_liquidity = None
-        self.spread_bps = Decimal(spread_bps)
+        self.last_price = None
     
+    def apply_params(self, params):
+        """
+        Installs a MarketParams, mirroring its settings as attributes.
+
+        Args:
+            params (MarketParams): The new parameters.
+        """
+        self.params = params
+        self.tick_jump = params.tick_jump
+        self.min_order_size = params.min_order_size
+        self.max_order_size = params.max_order_size
+        self.order_leverage = params.order_leverage
+        self.target_leverage = params.target_leverage
+        self.max_diff = params.max_diff
+        self.max_position = params.max_position
+        self.max_liquidity = params.max_liquidity * self.size_factor
+        self.spread_bps = params.spread_bps
+        self.spread_factor = params.spread_factor * self.spread_multiplier
+
+        # Liquidity curve hysteresis -- the lower the higher the hysteresis
+        self.liquidity_curve_hysteresis_low = params.liquidity_curve_hysteresis_low
+        self.liquidity_curve_hysteresis_minimum = params.liquidity_curve_hysteresis_minimum
+
+        self.bids.set_params(params)
+        self.asks.set_params(params)
+
+    def attach_risk(self, risk):
+        """
+        Reports positions, balances, fills and prices to an account risk engine and follows its throttle.
+
+        Args:
+            risk (RiskEngine or RiskClient): The account's risk engine.
+        """
+        self.risk = risk
+        risk.add_listener(self.set_risk_throttle)
+
+    def set_risk_throttle(self, level, throttle):
+        # The level alone is not enough, a reloaded throttle can change its factors
+        if (level == self.risk_level and throttle.size_factor == self.size_factor
+                and throttle.spread_multiplier == self.spread_multiplier and throttle.pull == self.quotes_pulled):
+            return
+        self.logger.warning("%s risk level %s: %s", self.symbol, level.name, throttle)
+        self.risk_level = level
+        self.size_factor = throttle.size_factor
+        self.spread_multiplier = throttle.spread_multiplier
+        self.quotes_pulled = throttle.pull
+        self.max_liquidity = self.params.max_liquidity * self.size_factor
+        self.spread_factor = self.params.spread_factor * self.spread_multiplier
+        if (self.active and self.last_price is not None):
+            self.reprice(self.last_price)
+            self.api.dispatch_batch()
+
+    def pull_quotes(self):
+        """Cancels every live order of both sides."""
+        for side in (self.bids, self.asks):
+            for order in side.orders:
+                if (order.state != OrderState.EMPTY and order.cancel == CancelState.NORMAL):
+                    self.send_cancel(order)
+
+    def handle_api_state(self, down, reason):
+        """Pulls the quotes while order requests fail, and quotes again once they succeed."""
+        if (down == self.api_down):
+            return
+        self.api_down = down
+        if (down):
+            self.logger.error("%s: order requests failing (%s), pulling quotes", self.symbol, reason)
+            self.pull_quotes()
+            self.api_down_retries = 0
+            self.api_down_timer = self.timers.schedule(API_DOWN_RETRY_MIN_DELAY, self.retry_while_down)
+        else:
+            self.logger.warning("%s: order requests succeed again, quoting", self.symbol)
+            if (self.api_down_timer):
+                self.api_down_timer.cancel()
+                self.api_down_timer = None
+            if (self.active and self.last_price is not None):
+                self.reprice(self.last_price)
+        self.api.dispatch_batch()
+
+    def retry_while_down(self):
+        """
+        Sends the cancels of the pulled quotes again while order requests fail.
+
+        A batch that fails after its retries delivers no results, so its
+        cancels would stay pending forever and nothing else would be sent
+        to notice the API is back. Orders that went live meanwhile are
+        cancelled too. With no cancel outstanding the API is probed instead.
+        Any answer of the exchange brings it back up, see handle_api_state.
+        """
+        self.api_down_timer = None
+        if (not self.api_down):
+            return
+        outstanding = 0
+        for side in (self.bids, self.asks):
+            for order in side.orders:
+                if (order.state == OrderState.EMPTY):
+                    continue
+                if (order.cancel == CancelState.NORMAL):
+                    self.send_cancel(order)
+                else:
+                    self.api.delete_order(order.clordid, symbol=self.symbol, asynchronous=True, batch=True)
+                outstanding += 1
+        if (outstanding):
+            self.logger.warning("%s: order requests still failing, resending %d cancels", self.symbol, outstanding)
+        else:
+            self.logger.warning("%s: order requests still failing, probing", self.symbol)
+            self.api.probe(self.symbol)
+        self.api_down_retries += 1
+        delay = min(API_DOWN_RETRY_MIN_DELAY * 2 ** self.api_down_retries, API_DOWN_RETRY_MAX_DELAY)
+        self.api_down_timer = self.timers.schedule(delay, self.retry_while_down)
+
+    def request_market_data(self):
+        """Subscribes to market_data again, for a new partial after an auction gap."""
+        if (self.router):
+            self.router.expect_partial("market_data", self.symbol)
+        asyncio.get_event_loop().create_task(self.api.subscribe("market_data", {"symbol": self.symbol}))
+
+    def attach_snapshot(self, snapshot):
+        """
+        Keeps the order rings in `snapshot` and adopts the orders of the previous run it holds.
+
+        Args:
+            snapshot (OrderSnapshot): Snapshot file of this market.
+        """
+        self.snapshot = snapshot
+        self.restored_snapshot = snapshot.load()
+
+    def adopt_snapshot_orders(self):
+        """
+        Adopts the old orders of the user_data partial that the snapshot still has in the same slot.
+
+        An order is adopted when its client_order_id, side and price match
+        the snapshot; its open amount is taken from the partial. The rings
+        are only restored if their size and tick jump did not change.
+
+        Returns:
+            set: client_order_ids of the adopted orders.
+        """
+        restored, self.restored_snapshot = self.restored_snapshot, None
+        adopted = set()
+        if (not restored):
+            return adopted
+
+        old_orders = {}
+        for old_order in self.old_orders:
+            clordid = old_order_clordid(old_order)
+            if (clordid is not None):
+                old_orders[clordid] = old_order
+
+        for side, name in ((self.bids, 'bids'), (self.asks, 'asks')):
+            ring = restored[name]
+            if (ring['max_orders'] != side.max_orders or ring['tick_jump'] != side.tick_jump):
+                self.logger.info("Order snapshot of %s %s no longer matches the ring", self.symbol, name)
+                continue
+            side.top_order = ring['top_order']
+            side.top_price = ring['top_price']
+            for index, clordid, state, cancel, price, amount_left, total_amount in ring['orders']:
+                old_order = old_orders.get(clordid)
+                if (old_order is None or
+                        'price' not in old_order or 'amount' not in old_order or
+                        str_to_side(old_order.get('side')) != side.side or
+                        Decimal(old_order['price']) != price):
+                    continue
+                side.adopt(index, clordid, price, Decimal(old_order['amount']), total_amount)
+                adopted.add(clordid)
+
+        self.logger.info("Adopted %d of %d old orders from the order snapshot", len(adopted), len(self.old_orders))
+        return adopted
+
+    def adopt_grid_orders(self):
+        """
+        Adopts the old orders whose prices are on the first ladder, and cancels the others.
+
+        Runs once, right after the first set_new_price. Adopted orders that
+        are still too many or too large for the liquidity curve are then
+        cancelled by the recalculation like any other order.
+        """
+        self.pending_adoption = False
+        leftovers = []
+        for old_order in self.old_orders:
+            try:
+                clordid = int(old_order['client_order_id'])
+                price = Decimal(old_order['price'])
+                amount = Decimal(old_order['amount'])
+                side = str_to_side(old_order['side'])
+            except (KeyError, TypeError, ValueError, ArithmeticError):
+                leftovers.append(old_order)
+                continue
+            if (old_order.get('market', self.symbol) != self.symbol):
+                adopted = False
+            elif (side == Side.BID):
+                adopted = self.bids.adopt_on_grid(clordid, price, amount)
+            elif (side == Side.ASK):
+                adopted = self.asks.adopt_on_grid(clordid, price, amount)
+            else:
+                adopted = False
+            if (not adopted):
+                leftovers.append(old_order)
+
+        self.logger.info("Adopted %d of %d old orders on the ladder",
+                         len(self.old_orders) - len(leftovers), len(self.old_orders))
+        self.old_orders = leftovers
+        self.cancel_old_orders()
+
     def log_new(self, side, amount, price, clordid):
         self.logger.info("->NEW %s %s @ %s (%d)" %
                          (side_to_str(side), amount, price, clordid))
@@ -454,18 +840,23 @@ class MarketMaker:
         
         clordid = self.api.get_next_clordid()
 
-        self.log_new(order.side, amount, price, clordid)
-
-        order.last_send_time = time.time()
         if (self.real):
+            if (not self.api.create_order(amount=amount,
+                                          price=price,
+                                          leverage=self.order_leverage,
+                                          symbol=self.symbol,
+                                          side=side_to_str(order.side),
+                                          asynchronous=True,
+                                          batch=True)):
+                # Refused by the rate limiter
+                return False
+            self.log_new(order.side, amount, price, clordid)
+            order.last_send_time = time.time()
             self.register_new(order, clordid, amount, price)
-            self.api.create_order(amount=amount,
-                                  price=price,
-                                  leverage=self.order_leverage,
-                                  symbol=self.symbol,
-                                  side=side_to_str(order.side),
-                                  asynchronous=True,
-                                  batch=True)
+        else:
+            self.log_new(order.side, amount, price, clordid)
+            order.last_send_time = time.time()
+        return True
 
     def send_cancel(self, order):
         self.log_cancel(order.side, order.amount_left,
@@ -484,6 +875,11 @@ class MarketMaker:
         order.amount_left = amount
         order.price = price
         order.auction_id_send = self.last_auction_id
+        order.reaped = False
+        order.cancel_retries = 0
+        if (order.cancel_timer is not None):
+            order.cancel_timer.cancel()
+            order.cancel_timer = None
 
     def register_cancel(self, order):
         assert (order.cancel == CancelState.NORMAL)
@@ -499,6 +895,10 @@ class MarketMaker:
         order.state = OrderState.EMPTY
         order.cancel = CancelState.NORMAL
         order.cancel_retries = 0
+        order.reaped = False
+        if (order.cancel_timer is not None):
+            order.cancel_timer.cancel()
+            order.cancel_timer = None
         order.total_amount = 0
         order.amount_left = 0
         order.clordid = None
@@ -542,21 +942,115 @@ class MarketMaker:
             self.logger.warning(
                 "Received reject_cancel, but order %d was not waiting for cancel",
                 order.clordid)
+        if (order.reaped and order.state == OrderState.PENDING):
+            # The reaper's cancel found nothing: the create never arrived
+            self.logger.warning("Order %d was never created, freeing its slot", order.clordid)
+            self._delete_order(order)
+            return
+        if (order.cancel_timer is not None):
+            # Rejected by both the batch response and the websocket, already retrying
+            return
+
         order.cancel_retries += 1
 
         if (order.cancel_retries >= MAX_CANCEL_RETRIES):
             if (order.state == OrderState.PENDING):
                 self.logger.warning(
-                    "Order %d has been cancelled %d times, still pending, assume was never sent")
+                    "Order %d has been cancelled %d times, still pending, assume was never sent",
+                    order.clordid, order.cancel_retries)
                 self._delete_order(order)
             else:
                 self.logger.error(
-                    "Order %d has been cancelled more than %d times, giving up", order.clordid, MAX_CANCEL_RETRIES)
-                # logging.shutdown()
-                # sys.exit(1)
+                    "Order %d has been cancelled %d times, cancelling every order of %s",
+                    order.clordid, MAX_CANCEL_RETRIES, self.symbol)
+                order.cancel_retries = 0
+                self.cancel_all_orders()
         else:
-            order.cancel = CancelState.NORMAL
-            # TODO send another cancel immediately
+            # Retry with backoff, the order keeps its pending cancel meanwhile
+            delay = min(CANCEL_RETRY_MIN_DELAY * 2 ** (order.cancel_retries - 1), CANCEL_RETRY_MAX_DELAY)
+            order.cancel_timer = self.timers.schedule(delay, self.retry_cancel, order, order.clordid)
+
+    def retry_cancel(self, order, clordid):
+        """Sends the cancel of `order` again, unless it was removed or reused meanwhile."""
+        # Slots are reset before reuse, so this timer is the order's one whatever its clordid
+        order.cancel_timer = None
+        if (not self.real or order.clordid != clordid or order.state == OrderState.EMPTY or
+                order.cancel != CancelState.PENDING):
+            return
+        self.log_cancel(order.side, order.amount_left, order.price, order.clordid)
+        order.auction_id_cancel = self.last_auction_id
+        self.api.delete_order(order.clordid, symbol=self.symbol, asynchronous=True, batch=True)
+
+    def cancel_all_orders(self):
+        """Cancels every live order of this market, including those already waiting for a cancel."""
+        self.cancel_all_count += 1
+        for side in (self.bids, self.asks):
+            for order in side.orders:
+                if (order.state == OrderState.EMPTY):
+                    continue
+                if (order.cancel == CancelState.NORMAL):
+                    self.send_cancel(order)
+                else:
+                    self.retry_cancel(order, order.clordid)
+
+    def ack_overdue(self, auction_id, sent_time, now):
+        return (self.last_auction_id - auction_id > self.ack_timeout_auctions or
+                now - sent_time > self.ack_timeout)
+
+    def reap_pending(self):
+        """
+        Looks at the next REAPER_SLOTS_PER_TICK ring slots for creates that were never acknowledged.
+
+        The cursor walks both rings round-robin, so the cost per tick is
+        constant however many orders are pending. An overdue create is
+        cancelled by client_order_id: a delete_order frees the slot as
+        usual, and a reject_cancel while still PENDING means the create was
+        lost. If the cancel is not answered either, the slot is freed as
+        never sent. update_orders then fills the slot again.
+        """
+        self.timers.schedule(self.timers.tick, self.reap_pending)
+        num_bids = len(self.bids.orders)
+        total = num_bids + len(self.asks.orders)
+        now = time.time()
+        for _ in range(min(REAPER_SLOTS_PER_TICK, total)):
+            index = self.reaper_cursor % total
+            self.reaper_cursor = index + 1
+            if (index < num_bids):
+                order = self.bids.orders[index]
+            else:
+                order = self.asks.orders[index - num_bids]
+            if (order.state != OrderState.PENDING):
+                continue
+
+            if (not order.reaped):
+                if (self.ack_overdue(order.auction_id_send, order.last_send_time, now)):
+                    self.logger.warning("Order %d not acknowledged after %d auctions (%.1fs), cancelling it",
+                                        order.clordid, self.last_auction_id - order.auction_id_send,
+                                        now - order.last_send_time)
+                    self.reaped_orders += 1
+                    order.reaped = True
+                    order.last_send_time = now
+                    if (order.cancel == CancelState.NORMAL):
+                        self.send_cancel(order)
+                    else:
+                        order.auction_id_cancel = self.last_auction_id
+            elif (self.ack_overdue(order.auction_id_cancel, order.last_send_time, now)):
+                self.logger.warning("Order %d: neither create nor cancel answered, assume it was never sent",
+                                    order.clordid)
+                self._delete_order(order)
+
+    def run_timers(self):
+        """Runs the due timers and sends what they queued."""
+        if (self.timers.advance()):
+            self.api.dispatch_batch()
+
+    async def timer_loop(self):
+        while True:
+            await asyncio.sleep(self.timers.tick)
+            try:
+                self.run_timers()
+            except Exception as e:
+                self.logger.error("Timer failed: %s", e)
 
     def exec_maker(self, order):
         if (order.state != OrderState.ACKED and
@@ -599,6 +1093,22 @@ class MarketMaker:
         self.logger.info("Canc: %d, Received: %d",
                          order.auction_id_cancel, self.last_auction_id)
 
+    def receive_batch_result(self, operation, result):
+        """Handles a failed or netted batched operation right away, without waiting for the websocket."""
+        if (not TickSpreadAPI.batch_result_failed(result) or operation.get("market") != self.symbol):
+            return
+        order = self.find_order_by_clordid(int(operation["client_order_id"]))
+        if (not order):
+            return
+        if (result.get("status") == "netted"):
+            # Created and deleted in the same flush, neither was sent
+            if (operation["operation"] == "delete"):
+                self.exec_remove(order)
+        elif (operation["operation"] == "create" and order.state == OrderState.PENDING):
+            self.exec_reject(order)
+        elif (operation["operation"] == "delete" and order.cancel == CancelState.PENDING):
+            self.exec_cancel_reject(order)
+
     def find_order_by_clordid(self, clordid):
         for order in self.bids.orders:
             if (order.clordid == clordid):
@@ -647,14 +1157,34 @@ class MarketMaker:
         # Update Order
         order.amount_left -= execution_amount
         if (order.amount_left == 0):
-            order.state = OrderState.EMPTY
-            order.cancel = CancelState.NORMAL
-            order.cancel_retries = 0
-            order.total_amount = 0
-            order.clordid = None
-            order.price = None
-
-    def receive_exec_trade(self, event, clordid, execution_amount, side):
+            # Nothing left to return to the limit, only the slot is reset
+            self._delete_order(order)
+
+    def update_pnl(self, side, execution_amount, price):
+        """
+        Books a fill into the average entry price and the realized PnL.
+
+        Realized PnL is accumulated in gross_profit; must be called before
+        the position itself is updated.
+        """
+        signed_amount = execution_amount if side == "bid" else -execution_amount
+        position = self.position
+        new_position = position + signed_amount
+
+        if (position == 0 or (position > 0) == (signed_amount > 0)):
+            # Increasing the position, average the entry price
+            self.position_entry_price = (abs(position) * self.position_entry_price +
+                                         execution_amount * price) / abs(new_position)
+        else:
+            closed = min(execution_amount, abs(position))
+            direction = 1 if position > 0 else -1
+            self.gross_profit += closed * (price - self.position_entry_price) * direction
+            if (new_position == 0):
+                self.position_entry_price = Decimal(0)
+            elif ((new_position > 0) != (position > 0)):
+                self.position_entry_price = price
+
+    def receive_exec_trade(self, event, clordid, execution_amount, side, *, price=None, fee=None):
         if (clordid):
             order = self.find_order_by_clordid(clordid)
             if (not order):
@@ -681,6 +1211,14 @@ class MarketMaker:
         else:
             pass
 
+        # Update PnL
+        if (price is not None):
+            self.update_pnl(side, execution_amount, price)
+        if (fee is not None):
+            self.fees_paid += fee
+        if (self.risk and price is not None):
+            self.risk.record_trade(self.symbol, side, execution_amount, price, fee)
+
         # Update Position
         if (side == "bid"):
             self.position += execution_amount
@@ -693,14 +1231,61 @@ class MarketMaker:
     def update_orders(self):
         self.logger.info("update_orders")
         assert (self.active)
-        price_spread = self.fair_price * self.spread_bps * Decimal(0.0001)
+        self.bids.apply_pending_resize()
+        self.asks.apply_pending_resize()
+        price_spread = self.fair_price * self.spread_factor
         
         self.bids.set_new_price(min(self.fair_price - price_spread, self.execution_band_high))
         self.asks.set_new_price(max(self.fair_price + price_spread, self.execution_band_low))
-
+        if (self.pending_adoption):
+            self.adopt_grid_orders()
+
+        # With a rate limit, each side gets half of the creates left (and the
+        # asks whatever the bids did not use), spent from the touch outward
+        budget = self.api.create_budget()
+        if (budget is not None):
+            self.bids.create_allowance = budget - budget // 2
         self.bids.recalculate_all_orders()
+        if (budget is not None):
+            self.asks.create_allowance = budget // 2 + self.bids.create_allowance
+            self.bids.create_allowance = None
         self.asks.recalculate_all_orders()
+        self.asks.create_allowance = None
     
+    def reconfigure(self, *, orders_per_side=None, max_position=None, tick_jump=None, min_order_size=None,
+                    order_leverage=None, target_leverage=None, max_diff=None, max_liquidity=-1,
+                    max_order_size=None, spread_bps=None,
+                    liquidity_curve_hysteresis_low=None, liquidity_curve_hysteresis_minimum=None):
+        """
+        Applies new parameters to the running bot without touching the orders directly.
+
+        Takes the same keyword arguments as __init__; None keeps the current
+        value, and max_liquidity < 0 follows max_position as in __init__.
+        The next recalculation (run right away if active) then cancels and
+        sends only the orders that no longer fit the new ladder.
+        """
+        params = self.params.replace(orders_per_side=orders_per_side, max_position=max_position,
+                                     tick_jump=tick_jump, min_order_size=min_order_size,
+                                     order_leverage=order_leverage, target_leverage=target_leverage,
+                                     max_diff=max_diff, max_liquidity=max_liquidity,
+                                     max_order_size=max_order_size, spread_bps=spread_bps,
+                                     liquidity_curve_hysteresis_low=liquidity_curve_hysteresis_low,
+                                     liquidity_curve_hysteresis_minimum=liquidity_curve_hysteresis_minimum)
+
+        delta = params.max_position - self.params.max_position
+        self.bids.available_limit += delta
+        self.asks.available_limit += delta
+        self.apply_params(params)
+        if (params.orders_per_side != self.bids.target_num_orders):
+            self.bids.resize(params.orders_per_side)
+            self.asks.resize(params.orders_per_side)
+
+        self.logger.info("Reconfigured %s: orders_per_side=%d max_position=%s tick_jump=%s spread_bps=%s",
+                         self.symbol, self.bids.target_num_orders, self.max_position, self.tick_jump, self.spread_bps)
+        if (self.active and self.last_price is not None):
+            self.reprice(self.last_price)
+            self.api.dispatch_batch()
+
     def quiver_market_data_partial(self, payload):
         print("MARKET DATA PARTIAL: ", payload)
         if (not 'execution_band' in payload or payload['execution_band'] == None):
@@ -719,7 +1304,6 @@ class MarketMaker:
             
         
         print(execution_band)
-        time.sleep(5.0)
         
         self.execution_band_high = Decimal(execution_band['high'])
         self.execution_band_low = Decimal(execution_band['low'])
@@ -767,6 +1351,8 @@ class MarketMaker:
                 "Could not find %s balance in partial" % self.money)
             return
         self.has_user_balance = True
+        if (self.risk):
+            self.risk.update_balance(self.balance_available, self.balance_frozen)
 
         self.old_orders = orders
         self.has_old_orders = True
@@ -812,6 +1398,8 @@ class MarketMaker:
                 "Could not find %s position in partial" % self.symbol)
             self.position = 0
         self.has_user_position = True
+        if (self.risk):
+            self.risk.update_position(self.symbol, self.position, self.position_entry_price, self.position_total_margin)
         print("Read user_data partial successfully")
 
     def cancel_old_orders(self):
@@ -920,9 +1508,18 @@ class MarketMaker:
         """
         if topic == "user_data":
             self.quiver_user_data_partial(payload)
-            self.cancel_old_orders()  # Cancel outdated orders to maintain liquidity curves
+            adopted = self.adopt_snapshot_orders()  # Keep the orders the snapshot knows
+            if adopted:
+                self.old_orders = [old_order for old_order in self.old_orders
+                                   if old_order_clordid(old_order) not in adopted]
+            if self.adopt_old_orders and self.old_orders:
+                self.pending_adoption = True  # Matched to the ladder once the first price is known
+            else:
+                self.cancel_old_orders()  # Cancel outdated orders to maintain liquidity curves
         elif topic == "market_data":
             self.quiver_market_data_partial(payload)
+            self.auction_sequencer.on_snapshot(payload.get('auction_id'))
+            self.last_auction_id = self.auction_sequencer.last_auction_id
 
     def handle_update_event(self, payload):
         """
@@ -933,20 +1530,22 @@ class MarketMaker:
 
         Process:
             - Validates the presence of 'auction_id'.
-            - Ensures auction IDs are sequential to maintain order consistency.
-            - Updates execution bands if present to adjust liquidity parameters.
+            - Passes the update to the auction sequencer, which applies the
+              updates in auction order and recovers from gaps.
         """
         if 'auction_id' not in payload:
             self.logger.warning("No 'auction_id' in TickSpread update payload")
             return
 
+        # Applied in auction order, gaps are buffered or resynchronized
         auction_id = int(payload['auction_id'])
+        if (self.api.auction_cadence is not None):
+            self.api.auction_cadence.on_auction(self.symbol, auction_id)
+        self.auction_sequencer.on_update(auction_id, payload)
 
-        # Verify that auction_id is sequential to prevent inconsistencies
-        if self.last_auction_id and auction_id != self.last_auction_id + 1:
-            self.logger.warning("Received auction_id = %d, last was %d", auction_id, self.last_auction_id)
-            return
-        self.last_auction_id = auction_id
+    def apply_update(self, payload):
+        """Applies an 'update' payload, called by the auction sequencer in auction order."""
+        self.last_auction_id = int(payload['auction_id'])
 
         # Update execution bands if provided in the payload
         if 'execution_band' in payload:
@@ -980,8 +1579,38 @@ class MarketMaker:
         """
     
     def handle_balance_event(self, payload):
-        print("BALANCE EVENT")
-        pass
+        for each_balance in payload.get('balance', []):
+            if (each_balance.get('asset') == self.money and
+                    'available' in each_balance and 'frozen' in each_balance):
+                self.balance_available = Decimal(each_balance['available'])
+                self.balance_frozen = Decimal(each_balance['frozen'])
+                if (self.risk):
+                    self.risk.update_balance(self.balance_available, self.balance_frozen)
+
+    def handle_position_event(self, payload):
+        """
+        Takes the exchange's view of the position after a fill.
+
+        The amount itself is tracked from the trade events (which also move
+        the available limits), so only a mismatch is logged here.
+        """
+        if (payload.get('market') != self.symbol):
+            return
+        if ('amount' not in payload or 'entry_price' not in payload):
+            self.logger.warning("No 'amount' or 'entry_price' in TickSpread update_position payload")
+            return
+        amount = Decimal(payload['amount'])
+        if (amount != self.position):
+            self.logger.warning("Exchange position %s differs from tracked position %s", amount, self.position)
+        self.position_entry_price = Decimal(payload['entry_price'])
+        if ('total_margin' in payload):
+            self.position_total_margin = Decimal(payload['total_margin'])
+        if ('funding' in payload):
+            self.position_funding = Decimal(payload['funding'])
+        if ('liquidation_price' in payload):
+            self.position_liquidation_price = Decimal(payload['liquidation_price'])
+        if (self.risk):
+            self.risk.update_position(self.symbol, amount, self.position_entry_price, self.position_total_margin)
 
     def handle_trade_event(self, event, payload):
         clordid = payload.get('client_order_id')
@@ -1000,13 +1629,15 @@ class MarketMaker:
 
         execution_amount = Decimal(payload['execution_amount'])
         side = payload['side']
+        price = Decimal(payload['price']) if payload.get('price') is not None else None
+        fee = Decimal(payload['fee']) if payload.get('fee') is not None else None
 
-        self.receive_exec_trade(event, clordid, execution_amount, side)  # Update trade execution details
+        self.receive_exec_trade(event, clordid, execution_amount, side, price=price, fee=fee)  # Update trade execution details
 
     def common_callback(self, data):
         # self.logger.info("common_callback")
         
-        self.logger.info("callback data: %s" % str(data))
+        self.logger.debug("callback data: %s", data)
         
         new_price = None
         if ("p" in data):
@@ -1033,18 +1664,28 @@ class MarketMaker:
                 print(self.has_user_balance, self.has_old_orders, self.has_user_position, self.has_execution_band)
 
             #self.logger.info("active = %s" % str(self.active))
+            self.last_price = new_price
             if (self.active):
-                factor = Decimal(1) - Decimal(self.max_diff) * self.position / self.max_position
-                self.fair_price = new_price * Decimal(factor)
-                self.kyle_impact = new_price * self.max_diff / self.max_position	# Price Impact (per position unit)
-                self.avg_tick_liquidity = self.tick_jump / self.kyle_impact     # On average how much liquidity we want per tick (based on tick jump)
-                
-                self.logger.info("new_price = %.2f, fair_price = %.2f, spread=%.3f%%" % (new_price, self.fair_price, Decimal(0.01)*self.spread_bps))
-                self.update_orders()
+                self.reprice(new_price)
 
         self.api.dispatch_batch()
         return 0
 
+    def reprice(self, new_price):
+        if (self.risk):
+            self.risk.update_mark(self.symbol, new_price)
+        if (self.quotes_pulled or self.api_down):
+            self.pull_quotes()
+            return
+        params = self.params
+        self.kyle_impact = new_price * params.kyle_coefficient	# Price Impact (per position unit)
+        self.fair_price = new_price - self.kyle_impact * self.position
+        self.avg_tick_liquidity = params.tick_liquidity_factor / new_price     # On average how much liquidity we want per tick (based on tick jump)
+
+        self.logger.info("new_price = %.2f, fair_price = %.2f, spread=%.3f%%",
+                         new_price, self.fair_price, params.spread_percent * self.spread_multiplier)
+        self.update_orders()
+
     def ftx_callback(self, data):
         return self.common_callback(data)
 
@@ -1056,6 +1697,11 @@ class MarketMaker:
 
     def callback(self, source, raw_data):
         #self.logger.info("<-%-10s: %s", source, raw_data)
+        messages = self.messages_by_source.get(source)
+        if (messages is None):
+            messages = self.messages_by_source[source] = self.messages.labels(self.symbol, source)
+        messages.inc()
+        self.run_timers()
 
         if isinstance(raw_data, dict):
             data = raw_data
@@ -1071,8 +1717,243 @@ class MarketMaker:
             rc = self.binance_s_callback(data)
         elif (source == 'pyth'):
             rc = self.pyth_xau_callback(data)
+        if (self.snapshot):
+            self.snapshot.save(self)
+        return rc
+
+class MarketRouter:
+    """
+    Routes the feed of one shared TickSpreadAPI to one MarketMaker per market.
+
+    TickSpread messages go to the MarketMaker of their payload 'market'.
+    Messages without it are routed by client_order_id ownership; partials go
+    to the markets in subscription order, with the orders of a user_data
+    partial filtered to the receiving market so no bot cancels the orders of
+    another. Anything else is broadcast.
+
+    External prices do not go through the router, every MarketMaker
+    subscribes to its own symbol on the FeedHub.
+    """
+
+    def __init__(self, logger=logging.getLogger()):
+        self.logger = logger
+        self.markets = {}			# market -> MarketMaker
+        self.pending_partials = {"market_data": [], "user_data": []}	# markets in subscription order
+
+        self.unrouted = 0
+
+    def add(self, market, mmaker):
+        self.markets[market] = mmaker
+        mmaker.router = self
+
+    def expect_partial(self, topic, market):
+        self.pending_partials[topic].append(market)
+
+    def owner_of(self, clordid):
+        for mmaker in self.markets.values():
+            if (mmaker.find_order_by_clordid(clordid)):
+                return mmaker
+        return None
+
+    def route_tickspread(self, data):
+        payload = data.get('payload')
+        if (not isinstance(payload, dict)):
+            return list(self.markets.values())
+
+        event = data.get('event')
+        topic = data.get('topic')
+        market = payload.get('market') or payload.get('symbol')
+        if (market in self.markets):
+            # a partial that names its market still answers that market's subscription
+            pending = self.pending_partials.get(topic)
+            if (event == "partial" and pending and market in pending):
+                pending.remove(market)
+            return [self.markets[market]]
+
+        if (event == "partial" and self.pending_partials.get(topic)):
+            market = self.pending_partials[topic].pop(0)
+            if (topic == "user_data" and 'orders' in payload):
+                payload = dict(payload)
+                payload['orders'] = [order for order in payload['orders'] if order.get('market') == market]
+                data = dict(data, payload=payload)
+            return [(self.markets[market], data)]
+
+        if ('client_order_id' in payload):
+            try:
+                mmaker = self.owner_of(int(payload['client_order_id']))
+            except (TypeError, ValueError):
+                mmaker = None
+            if (mmaker):
+                return [mmaker]
+            self.unrouted += 1
+            self.logger.warning("No market owns order %s (%s)", payload['client_order_id'], event)
+            return []
+
+        return list(self.markets.values())
+
+    def callback(self, source, raw_data):
+        if isinstance(raw_data, dict):
+            data = raw_data
+        else:
+            data = json.loads(raw_data)
+
+        rc = 0
+        for target in self.route_tickspread(data):
+            if (isinstance(target, tuple)):
+                mmaker, message = target
+            else:
+                mmaker, message = target, data
+            rc = mmaker.callback(source, message) or rc
         return rc
 
+class ConfigWatcher:
+    """
+    Polls a JSON config file and hands every new valid version to `on_change(config)`.
+
+    A file that fails to parse is logged and ignored until it changes again,
+    so a half-written config never reaches the bots.
+    """
+
+    def __init__(self, path, on_change, interval=2.0, logger=logging.getLogger()):
+        self.path = path
+        self.on_change = on_change
+        self.interval = interval
+        self.logger = logger
+        self.signature = self.stat()
+        self.reloads = 0
+
+    def stat(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def check(self):
+        signature = self.stat()
+        if (signature is None or signature == self.signature):
+            return False
+        self.signature = signature
+        try:
+            with open(self.path) as f:
+                config = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            self.logger.error("Ignoring %s: %s", self.path, e)
+            return False
+        self.reloads += 1
+        self.on_change(config)
+        return True
+
+    async def loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.check()
+            except Exception as e:
+                self.logger.error("Config reload failed: %s", e)
+
+def collect_metrics(mmakers, api, clients=()):
+    """
+    Reads the bot state for a metrics scrape, see metrics.Registry.add_collector.
+
+    Args:
+        mmakers (dict): market -> MarketMaker.
+        api (TickSpreadAPI): The shared API.
+        clients (list): (name, client) of the feed hub and risk clients, counted by connects.
+    """
+    orders = []
+    liquidity = []
+    limits = []
+    positions = []
+    gaps = []
+    resyncs = []
+    cancel_alls = []
+    reaped = []
+    for market, mmaker in mmakers.items():
+        for side in (mmaker.bids, mmaker.asks):
+            side_name = side_to_str(side.side)
+            counts = {state: 0 for state in OrderState if state != OrderState.EMPTY}
+            resting = DECIMAL_ZERO
+            for order in side.orders:
+                if (order.state != OrderState.EMPTY):
+                    counts[order.state] += 1
+                if (order.state in (OrderState.MAKER, OrderState.ACTIVE)):
+                    resting += order.amount_left
+            for state, count in counts.items():
+                orders.append(({"market": market, "side": side_name, "state": state.name.lower()}, count))
+            liquidity.append(({"market": market, "side": side_name}, resting))
+            limits.append(({"market": market, "side": side_name}, side.available_limit))
+        positions.append(({"market": market}, mmaker.position))
+        gaps.append(({"market": market}, mmaker.auction_sequencer.gaps))
+        resyncs.append(({"market": market}, mmaker.auction_sequencer.resyncs))
+        cancel_alls.append(({"market": market}, mmaker.cancel_all_count))
+        reaped.append(({"market": market}, mmaker.reaped_orders))
+
+    metrics = [
+        ("orders", "Orders in the ring by state", "gauge", orders),
+        ("resting_liquidity", "Amount left of the orders in the book", "gauge", liquidity),
+        ("available_limit", "Amount the side may still add to the position", "gauge", limits),
+        ("position", "Tracked position", "gauge", positions),
+        ("auction_gaps_total", "Gaps in the auction_id of the updates", "counter", gaps),
+        ("auction_resyncs_total", "Market data resynchronizations", "counter", resyncs),
+        ("cancel_all_total", "Cancel-alls after cancels kept failing", "counter", cancel_alls),
+        ("reaped_orders_total", "Creates reaped without an acknowledgement", "counter", reaped),
+        ("api_down", "Order requests keep failing", "gauge", [({}, api.down)]),
+        ("http_failures_total", "Order requests that failed", "counter", [({}, api.http_failures)]),
+        ("http_retries_total", "Order requests retried", "counter", [({}, api.retries)]),
+        ("batches_sent_total", "Batch requests sent", "counter", [({}, api.batches_sent)]),
+        ("operations_sent_total", "Operations sent in batches", "counter", [({}, api.operations_sent)]),
+        ("operations_failed_total", "Operations the exchange refused", "counter", [({}, api.operations_failed)]),
+        ("operations_netted_total", "Operations dropped before sending", "counter", [({}, api.operations_netted)]),
+        ("client_connects_total", "Connections of the feed hub and risk clients", "counter",
+         [({"client": name}, client.connects) for name, client in clients]),
+    ]
+    if (api.rate_limiter):
+        stats = api.rate_limiter.stats()
+        metrics.append(("rate_limit_tokens", "Operations left in the account bucket", "gauge",
+                        [({}, stats["tokens"])]))
+        metrics.append(("creates_refused_total", "Creates refused by the rate limiter", "counter",
+                        [({}, stats["creates_refused"])]))
+        metrics.append(("cancels_in_debt_total", "Cancels sent over the rate limit", "counter",
+                        [({}, stats["cancels_in_debt"])]))
+        metrics.append(("requests_delayed_total", "Requests delayed by the rate limiter", "counter",
+                        [({}, stats["requests_delayed"])]))
+    return metrics
+
+def reload_market_settings(mmakers, applied_settings, config):
+    """
+    Applies the changed market_settings of `config` to the running MarketMakers.
+
+    The new parameters are built from the defaults rather than merged into
+    the running ones, so a key removed from the config goes back to its
+    default. A market whose settings fail keeps its old parameters and does
+    not stop the reload of the others.
+
+    Args:
+        mmakers (dict): market -> MarketMaker.
+        applied_settings (dict): market -> settings currently applied, updated in place.
+        config (dict): The new config.json contents.
+    """
+    for market, mmaker in mmakers.items():
+        market_settings = config.get('market_settings', {}).get(market)
+        if not market_settings or market_settings == applied_settings.get(market):
+            continue
+        for key in ('external_market', 'price_source'):
+            if market_settings.get(key) != applied_settings[market].get(key):
+                logging.warning(f"'{key}' of '{market}' changed, it only takes effect after a restart")
+        try:
+            # Every setting, the missing ones at their defaults
+            params = MarketParams(**parse_market_settings(market_settings)).settings
+            logging.info(f"Reloading market settings for '{market}': {market_settings}")
+            mmaker.reconfigure(**params)
+        except ValueError as e:
+            logging.error(f"Not reloading invalid market settings for '{market}': {e}")
+            continue
+        except Exception:
+            logging.exception(f"Reloading market settings for '{market}' failed")
+            continue
+        applied_settings[market] = dict(market_settings)
+
 def load_json_file(file_path):
     """
     Loads a JSON file and returns the parsed data.
@@ -1131,6 +2012,8 @@ def parse_arguments():
     parser = argparse.ArgumentParser(
         description='Run a market maker bot on TickSpread exchange.'
     )
+    parser.add_argument('--config', dest='config', default='config.json',
+                        help='Set the config file, also watched for market_settings edits (default: config.json)')
     parser.add_argument('--id', dest='id', default=None,
                         help='Set the id to run the account (default from config)')
     parser.add_argument('--env', dest='env', default=None,
@@ -1145,57 +2028,102 @@ def parse_arguments():
                         help='Set the market to run the bot on (default from config)')
     parser.add_argument('--money_asset', dest='money_asset', default=None,
                         help='Set the money asset (default from config)')
+    parser.add_argument('--record_dir', dest='record_dir', default=None,
+                        help='Record every raw feed frame into this directory (default: disabled)')
+    parser.add_argument('--feed_hub', dest='feed_hub', default=None,
+                        help='Take external prices from the feed_hub.py socket at this path (default: own feeds)')
+    parser.add_argument('--price_bus', dest='price_bus', default=None,
+                        help='Take external prices from the shared-memory price bus with this name (set by supervisor.py)')
+    parser.add_argument('--reload_interval', dest='reload_interval', type=float, default=2.0,
+                        help='Seconds between checks of config.json for market_settings changes, 0 disables (default: 2)')
+    parser.add_argument('--markets', dest='markets', default=None,
+                        help='Run several markets in this process, comma separated or "all" (overrides --market)')
+    parser.add_argument('--batch_window_ms', dest='batch_window_ms', type=float, default=0.0,
+                        help='Milliseconds to hold order operations so every market shares one batch request; '
+                             '0 merges what is queued in the same event loop iteration (default: 0)')
+    parser.add_argument('--max_batch_size', dest='max_batch_size', type=int, default=100,
+                        help='Maximum operations per batch request, larger batches are split (default: 100)')
+    parser.add_argument('--loop_budget_ms', dest='loop_budget_ms', type=float, default=10.0,
+                        help='Warn when a market callback or the event loop lag exceeds this many milliseconds, '
+                             '0 disables the loop monitor (default: 10)')
+    parser.add_argument('--metrics_port', dest='metrics_port', type=int, default=0,
+                        help='Serve Prometheus metrics on this localhost port, 0 disables (default: 0)')
+    parser.add_argument('--split_sockets', dest='split_sockets', action='store_true',
+                        help='Receive user_data on its own websocket, processed ahead of market_data')
+    parser.add_argument('--auction_dispatch', dest='auction_dispatch', action='store_true',
+                        help='Hold order operations until just before the next auction, learned from the updates')
+    parser.add_argument('--auction_lead_ms', dest='auction_lead_ms', type=float, default=20.0,
+                        help='Milliseconds before the expected auction to send the held operations (default: 20)')
+    parser.add_argument('--max_ops_per_second', dest='max_ops_per_second', type=float, default=0.0,
+                        help='Order operations per second of the account, shared by every market; '
+                             'creates stop before the cancel reserve (default: 0, no limit)')
+    parser.add_argument('--max_requests_per_second', dest='max_requests_per_second', type=float, default=0.0,
+                        help='HTTP requests per second of each order endpoint (default: 0, no limit)')
+    parser.add_argument('--cancel_reserve', dest='cancel_reserve', type=float, default=0.2,
+                        help='Share of the operation budget kept for cancels (default: 0.2)')
+    parser.add_argument('--risk_socket', dest='risk_socket', default=None,
+                        help='Report to the account risk engine of risk.py on this unix socket instead of in-process')
+    parser.add_argument('--snapshot_dir', dest='snapshot_dir', default=None,
+                        help='Keep order snapshots in this directory and adopt the open orders on restart (default: disabled)')
+    parser.add_argument('--adopt_orders', dest='adopt_orders', action='store_true',
+                        help='Keep the open orders of the user_data partial that are on the ladder instead of cancelling all')
+    parser.add_argument('--ack_timeout_auctions', dest='ack_timeout_auctions', type=int, default=ACK_TIMEOUT_AUCTIONS,
+                        help='Auctions to wait for an order acknowledge before cancelling and freeing its slot '
+                             '(default: %d)' % ACK_TIMEOUT_AUCTIONS)
+    parser.add_argument('--ack_timeout', dest='ack_timeout', type=float, default=ACK_TIMEOUT,
+                        help='Seconds to wait for an order acknowledge, for when auctions stall (default: %s)' % ACK_TIMEOUT)
 
     return parser.parse_args()
 
-async def main():
-    # Parse command line arguments
-    args = parse_arguments()
-
-    # Load configurations
-    config = load_json_file('config.json')
-
-    # Override configurations with command line arguments if provided
-    general_config = config.get('general', {})
-    general_config['id'] = args.id if args.id is not None else general_config.get('id', '0')
-    general_config['env'] = args.env if args.env is not None else general_config.get('env', 'prod')
-    general_config['market'] = args.market if args.market is not None else general_config.get('market', 'ETH')
-    general_config['money_asset'] = args.money_asset if args.money_asset is not None else general_config.get('money_asset', 'USD')
+def market_maker_params(market, market_settings):
+    """
+    Converts the config.json settings of a market into MarketMaker keyword arguments.
 
-    # Override tickspread_password from command line or secrets.json
-    tickspread_password = args.tickspread_password if args.tickspread_password is not None else load_json_file('secrets.json').get('tickspread_password', 'maker')
+    Args:
+        market (str): Market name, used for error messages.
+        market_settings (dict): The market's entry in 'market_settings'.
 
-    # Setup logging
-    logging_config = config.get('logging', {})
-    setup_logging(logging_config, log_output=args.log if args.log else logging_config.get('file', 'shell'),
-                 log_level_override=args.log_level)
+    Returns:
+        dict: Keyword arguments for MarketMaker.
+    """
+    try:
+        return parse_market_settings(market_settings)
+    except ValueError as e:
+        logging.error(f"Invalid market settings for '{market}': {e}")
+        sys.exit(1)
 
-    # Initialize TickSpreadAPI
-    api = TickSpreadAPI(id_multiple=1000, env=general_config['env'])
+def parse_market_settings(market_settings):
+    """
+    Converts and validates the settings of a market.
 
-    # Initialize MarketMaker based on the selected market
-    market = general_config['market']
-    market_settings = config.get('market_settings', {}).get(market)
+    Args:
+        market_settings (dict): The market's entry in 'market_settings'.
 
-    if not market_settings:
-        logging.error(f"Market settings for '{market}' not found in config.json.")
-        sys.exit(1)
+    Returns:
+        dict: Keyword arguments for MarketMaker.
 
+    Raises:
+        ValueError: If a setting is missing or invalid.
+    """
     # Convert string parameters to appropriate types
     try:
-        tick_jump = Decimal(market_settings['tick_jump'])
+        tick_jump = to_decimal(market_settings['tick_jump'])
         orders_per_side = int(market_settings['orders_per_side'])
-        min_order_size = Decimal(market_settings['min_order_size'])
-        max_position = Decimal(market_settings['max_position'])
-        max_order_size = Decimal(market_settings.get('max_order_size')) if 'max_order_size' in market_settings else None
-        max_liquidity = Decimal(market_settings.get('max_liquidity')) if 'max_liquidity' in market_settings else None
-        max_diff = float(market_settings.get('max_diff')) if 'max_diff' in market_settings else None
+        min_order_size = to_decimal(market_settings['min_order_size'])
+        max_position = to_decimal(market_settings['max_position'])
+        max_order_size = to_decimal(market_settings.get('max_order_size')) if 'max_order_size' in market_settings else None
+        max_liquidity = to_decimal(market_settings.get('max_liquidity')) if 'max_liquidity' in market_settings else None
+        max_diff = to_decimal(market_settings.get('max_diff')) if 'max_diff' in market_settings else None
         order_leverage = int(market_settings.get('order_leverage')) if 'order_leverage' in market_settings else None
         target_leverage = int(market_settings.get('target_leverage')) if 'target_leverage' in market_settings else None
-        spread_bps = Decimal(market_settings.get('spread_bps')) if 'spread_bps' in market_settings else None
-    except (KeyError, ValueError) as e:
-        logging.error(f"Invalid market settings for '{market}': {e}")
-        sys.exit(1)
+        spread_bps = to_decimal(market_settings.get('spread_bps')) if 'spread_bps' in market_settings else None
+        hysteresis_low = to_decimal(market_settings.get('liquidity_curve_hysteresis_low')) if 'liquidity_curve_hysteresis_low' in market_settings else None
+        hysteresis_minimum = to_decimal(market_settings.get('liquidity_curve_hysteresis_minimum')) if 'liquidity_curve_hysteresis_minimum' in market_settings else None
+    except KeyError as e:
+        raise ValueError(f"missing {e}")
+    except ArithmeticError as e:
+        # decimal.InvalidOperation on malformed numbers
+        raise ValueError(f"malformed number ({e!r})")
 
     # Initialize MarketMaker with the appropriate parameters
     mmaker_params = {
@@ -1217,8 +2145,107 @@ async def main():
         mmaker_params['target_leverage'] = target_leverage
     if spread_bps is not None:
         mmaker_params['spread_bps'] = spread_bps
+    if hysteresis_low is not None:
+        mmaker_params['liquidity_curve_hysteresis_low'] = hysteresis_low
+    if hysteresis_minimum is not None:
+        mmaker_params['liquidity_curve_hysteresis_minimum'] = hysteresis_minimum
+
+    # Same checks as MarketMaker, before anything is started
+    MarketParams(**mmaker_params)
+    return mmaker_params
 
-    mmaker = MarketMaker(api, market, general_config['money_asset'], **mmaker_params)
+async def main():
+    # Parse command line arguments
+    args = parse_arguments()
+
+    # Load configurations
+    config = load_json_file(args.config)
+
+    # Override configurations with command line arguments if provided
+    general_config = config.get('general', {})
+    general_config['id'] = args.id if args.id is not None else general_config.get('id', '0')
+    general_config['env'] = args.env if args.env is not None else general_config.get('env', 'prod')
+    general_config['market'] = args.market if args.market is not None else general_config.get('market', 'ETH')
+    general_config['money_asset'] = args.money_asset if args.money_asset is not None else general_config.get('money_asset', 'USD')
+
+    # Override tickspread_password from command line or secrets.json
+    tickspread_password = args.tickspread_password if args.tickspread_password is not None else load_json_file('secrets.json').get('tickspread_password', 'maker')
+
+    # Setup logging
+    logging_config = config.get('logging', {})
+    setup_logging(logging_config, log_output=args.log if args.log else logging_config.get('file', 'shell'),
+                 log_level_override=args.log_level)
+
+    # Initialize TickSpreadAPI, shared by every market of this process
+    rate_limiter = None
+    if args.max_ops_per_second > 0 or args.max_requests_per_second > 0:
+        rate_limiter = RateLimiter(operations_per_second=max(args.max_ops_per_second, 0.0),
+                                   requests_per_second=max(args.max_requests_per_second, 0.0),
+                                   cancel_reserve=args.cancel_reserve)
+    api = TickSpreadAPI(id_multiple=1000, env=general_config['env'],
+                        flush_window=max(args.batch_window_ms, 0.0) / 1000.0, max_batch_size=args.max_batch_size,
+                        rate_limiter=rate_limiter,
+                        auction_cadence=AuctionCadence(lead=args.auction_lead_ms / 1000.0) if args.auction_dispatch else None,
+                        split_topics=args.split_sockets)
+
+    # Initialize one MarketMaker per selected market
+    if args.markets:
+        all_markets = list(config.get('market_settings', {}).keys())
+        markets = all_markets if args.markets == 'all' else [m.strip() for m in args.markets.split(',') if m.strip()]
+    else:
+        markets = [general_config['market']]
+
+    mmakers = {}
+    for market in markets:
+        market_settings = config.get('market_settings', {}).get(market)
+        if not market_settings:
+            logging.error(f"Market settings for '{market}' not found in config.json.")
+            sys.exit(1)
+        mmaker_params = market_maker_params(market, market_settings)
+        mmakers[market] = MarketMaker(api, market, general_config['money_asset'],
+                                      adopt_old_orders=args.adopt_orders, ack_timeout_auctions=args.ack_timeout_auctions,
+                                      ack_timeout=args.ack_timeout, **mmaker_params)
+
+    # Event loop lag and the time spent in each market's callbacks
+    monitor = None
+    if args.loop_budget_ms > 0:
+        monitor = LoopMonitor(budget=args.loop_budget_ms / 1000.0)
+        api.dispatch_batch = monitor.wrap_stage("dispatch_batch", api.dispatch_batch)
+        for market, mmaker in mmakers.items():
+            mmaker.update_orders = monitor.wrap_stage("update_orders", mmaker.update_orders)
+            mmaker.callback = monitor.wrap_callback(market, mmaker.callback)
+
+    # Account risk: shared with other processes through --risk_socket, or
+    # in-process when config.json has a "risk" section
+    risk = None
+    if args.risk_socket:
+        risk = RiskClient(args.risk_socket)
+    elif 'risk' in config:
+        try:
+            risk = RiskEngine(RiskLimits.from_config(config['risk']))
+        except ValueError as e:
+            logging.error(f"Invalid risk settings: {e}")
+            sys.exit(1)
+    if risk:
+        for mmaker in mmakers.values():
+            mmaker.attach_risk(risk)
+
+    # Persist the order rings, so a restart adopts the resting orders
+    if args.snapshot_dir:
+        os.makedirs(args.snapshot_dir, exist_ok=True)
+        for market, mmaker in mmakers.items():
+            path = os.path.join(args.snapshot_dir, market.replace('|', '_') + '.orders')
+            mmaker.attach_snapshot(OrderSnapshot(path, market))
+
+    # With several markets a router dispatches the shared feeds by market
+    router = None
+    if len(markets) > 1:
+        router = MarketRouter()
+        for market, mmaker in mmakers.items():
+            router.add(market, mmaker)
+        callback = router.callback
+    else:
+        callback = mmakers[markets[0]].callback
 
     # Register and login to TickSpread API
     logging.info("LOGIN")
@@ -1229,26 +2256,81 @@ async def main():
         return 1
     logging.info("STARTING")
 
+    # Optionally record every raw frame for replay and latency forensics.
+    # The recorder is registered first so it also captures the partials.
+    recorder = None
+    if args.record_dir:
+        prefix = markets[0].replace('|', '_') if len(markets) == 1 else 'multi'
+        recorder = FeedRecorder(args.record_dir, prefix=prefix)
+        # Flush the buffered frames and finish the capture file however the bot exits
+        atexit.register(recorder.close)
+        api.on_message(recorder.callback)
+
     # Connect to TickSpread API and subscribe to necessary feeds
     await api.connect()
-    await api.subscribe("market_data", {"symbol": market})
-    await api.subscribe("user_data", {"symbol": market})
-    api.on_message(mmaker.callback)
-
-    # Initialize and subscribe to external market APIs
-    external_market = market_settings['external_market']
-    price_source = market_settings['price_source']
-    
-    if price_source == 'pyth_network':
-        external_api = PythXauAPI()
-        external_api.subscribe_index_price(external_market)
-        external_api.on_message(mmaker.callback)
-    elif price_source == 'binance_spot':
-        binance_api = BinanceAPI()
-        binance_api.subscribe_futures(external_market)
-        binance_api.on_message(mmaker.callback)
+    for market in markets:
+        if router:
+            router.expect_partial("market_data", market)
+            router.expect_partial("user_data", market)
+        await api.subscribe("market_data", {"symbol": market})
+        await api.subscribe("user_data", {"symbol": market})
+    api.on_message(callback)
+
+    # Failed batch operations go straight back to their market
+    def batch_result(operation, result):
+        mmaker = mmakers.get(operation.get("market"))
+        if (mmaker):
+            mmaker.receive_batch_result(operation, result)
+    api.on_batch_result(batch_result)
+    for mmaker in mmakers.values():
+        api.on_api_state(mmaker.handle_api_state)
+
+    # Subscribe to the external prices, one upstream per external symbol
+    # whether from an in-process hub, a hub shared with other processes or
+    # the shared-memory price bus of supervisor.py
+    shared_feed = args.price_bus or args.feed_hub
+    if args.price_bus:
+        feed_hub = PriceBusReader(args.price_bus)
+    elif args.feed_hub:
+        feed_hub = FeedHubClient(args.feed_hub, name=','.join(markets))
     else:
-        assert(False)
+        feed_hub = FeedHub()
+        if recorder:
+            feed_hub.on_message(recorder.callback)
+    recorded = set()
+    for market, mmaker in mmakers.items():
+        market_settings = config['market_settings'][market]
+        price_source = PRICE_SOURCES.get(market_settings['price_source'])
+        assert(price_source)
+        external_market = market_settings['external_market']
+        if shared_feed and recorder and (price_source, external_market) not in recorded:
+            # Only normalized ticks reach this process, record those
+            feed_hub.subscribe(price_source, external_market, recorder.callback, name='recorder')
+            recorded.add((price_source, external_market))
+        feed_hub.subscribe(price_source, external_market, mmaker.callback, name=market)
+    if shared_feed:
+        await feed_hub.connect()
+    if args.risk_socket:
+        await risk.connect()
+    for mmaker in mmakers.values():
+        asyncio.get_event_loop().create_task(mmaker.timer_loop())
+    if monitor:
+        asyncio.get_event_loop().create_task(monitor.run())
+
+    # Metrics are only read from the bot state when scraped
+    if args.metrics_port:
+        clients = [(name, client) for name, client in (('feed_hub', feed_hub), ('risk', risk))
+                   if isinstance(client, (FeedHubClient, RiskClient))]
+        REGISTRY.add_collector(lambda: collect_metrics(mmakers, api, clients))
+        await start_metrics_server(args.metrics_port)
+
+    # Apply market_settings edits of config.json live
+    if args.reload_interval > 0:
+        applied_settings = {market: dict(config['market_settings'][market]) for market in markets}
+        watcher = ConfigWatcher(args.config,
+                                lambda new_config: reload_market_settings(mmakers, applied_settings, new_config),
+                                interval=args.reload_interval)
+        asyncio.get_event_loop().create_task(watcher.loop())
 
     logging.info("FINISH INIT")
 
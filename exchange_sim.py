@@ -0,0 +1,387 @@
+# -*- coding: utf-8 -*-
+"""Simulated TickSpread matching engine
+
+Pure-python model of the exchange used by the mock server (mock_exchange.py).
+It keeps one order book per market, runs discrete auctions with sequential
+`auction_id`, enforces execution bands and emits the same events the bots
+handle on the websocket:
+
+    acknowledge_order, reject_order, maker_order, active_order, delete_order,
+    reject_cancel, maker_trade, taker_trade, update_position, balance,
+    update and trade
+
+New orders and cancels are queued and take effect at the next auction.
+Incoming orders are matched in arrival order against resting orders
+(price-time priority) at the resting price; the remainder rests as a maker
+order. Events are delivered to `listeners` as
+`listener(account, topic, event, payload)` where `account` is None for
+market_data events.
+"""
+
+import collections
+import itertools
+import logging
+import random
+from decimal import Decimal
+
+from enum import Enum
+
+
+class SimOrderState(Enum):
+    PENDING = 0
+    RESTING = 1
+    DONE = 2
+
+
+class SimOrder:
+    __slots__ = ('client_order_id', 'account', 'market', 'side', 'price', 'amount',
+                 'amount_left', 'leverage', 'state', 'sequence', 'auction_id')
+
+    def __init__(self, client_order_id, account, market, side, price, amount, leverage, sequence):
+        self.client_order_id = client_order_id
+        self.account = account
+        self.market = market
+        self.side = side
+        self.price = price
+        self.amount = amount
+        self.amount_left = amount
+        self.leverage = leverage
+        self.state = SimOrderState.PENDING
+        self.sequence = sequence
+        self.auction_id = 0
+
+    def to_partial(self):
+        return {"client_order_id": self.client_order_id, "amount": str(self.amount_left),
+                "price": str(self.price), "side": self.side, "market": self.market}
+
+
+class SimPosition:
+    __slots__ = ('amount', 'entry_price', 'funding', 'total_margin')
+
+    def __init__(self):
+        self.amount = Decimal(0)
+        self.entry_price = Decimal(0)
+        self.funding = Decimal(0)
+        self.total_margin = Decimal(0)
+
+
+class SimAccount:
+    def __init__(self, name, money_asset, initial_balance):
+        self.name = name
+        self.money_asset = money_asset
+        self.available = Decimal(initial_balance)
+        self.frozen = Decimal(0)
+        self.positions = collections.defaultdict(SimPosition)
+        self.orders = {}
+
+    def position_partial(self, market):
+        position = self.positions[market]
+        return {"market": market, "amount": str(position.amount), "funding": str(position.funding),
+                "entry_price": str(position.entry_price), "liquidation_price": "0",
+                "total_margin": str(position.total_margin)}
+
+    def balance_partial(self):
+        return [{"asset": self.money_asset, "available": str(self.available), "frozen": str(self.frozen)}]
+
+
+class SimMarket:
+    def __init__(self, symbol, *, reference_price, band_fraction=Decimal("0.05")):
+        self.symbol = symbol
+        self.reference_price = Decimal(reference_price)
+        self.band_fraction = Decimal(band_fraction)
+        self.auction_id = 0
+
+        # price -> deque of resting orders, oldest first
+        self.bids = collections.defaultdict(collections.deque)
+        self.asks = collections.defaultdict(collections.deque)
+
+        self.incoming = []
+        self.cancels = []
+        self.execution_band_low = None
+        self.execution_band_high = None
+        self.update_execution_band()
+
+    def update_execution_band(self):
+        self.execution_band_low = self.reference_price * (1 - self.band_fraction)
+        self.execution_band_high = self.reference_price * (1 + self.band_fraction)
+
+    def execution_band(self):
+        return {"low": str(self.execution_band_low), "high": str(self.execution_band_high)}
+
+    def book(self, side):
+        return self.bids if side == "bid" else self.asks
+
+    def best_levels(self, side):
+        """Prices on the opposite book an incoming `side` order can trade with, best first."""
+        if (side == "bid"):
+            return sorted(self.asks)
+        else:
+            return sorted(self.bids, reverse=True)
+
+    def remove_resting(self, order):
+        book = self.book(order.side)
+        level = book.get(order.price)
+        if (level is None):
+            return False
+        try:
+            level.remove(order)
+        except ValueError:
+            return False
+        if (not level):
+            del book[order.price]
+        return True
+
+
+class ExchangeSim:
+    def __init__(self, *, money_asset="USD", initial_balance="1000000", maker_fee=Decimal("0"),
+                 taker_fee=Decimal("0.0005"), logger=logging.getLogger()):
+        self.money_asset = money_asset
+        self.initial_balance = initial_balance
+        self.maker_fee = Decimal(maker_fee)
+        self.taker_fee = Decimal(taker_fee)
+        self.logger = logger
+
+        self.markets = {}
+        self.accounts = {}
+        self.listeners = []
+        self.sequence = itertools.count()
+
+    # Setup
+
+    def add_market(self, symbol, *, reference_price, band_fraction=Decimal("0.05")):
+        market = SimMarket(symbol, reference_price=reference_price, band_fraction=band_fraction)
+        self.markets[symbol] = market
+        return market
+
+    def get_account(self, name):
+        if (name not in self.accounts):
+            self.accounts[name] = SimAccount(name, self.money_asset, self.initial_balance)
+        return self.accounts[name]
+
+    def on_event(self, listener):
+        self.listeners.append(listener)
+
+    def emit(self, account, topic, event, payload):
+        for listener in self.listeners:
+            listener(account, topic, event, payload)
+
+    # Snapshots
+
+    def market_data_partial(self, symbol):
+        market = self.markets[symbol]
+        return {"market": symbol, "auction_id": market.auction_id, "execution_band": market.execution_band()}
+
+    def user_data_partial(self, account, symbol):
+        orders = [order.to_partial() for order in account.orders.values() if order.market == symbol]
+        return {"balance": account.balance_partial(), "orders": orders,
+                "positions": [account.position_partial(symbol)]}
+
+    # Order entry
+
+    def create_order(self, account, operation):
+        """
+        Queues a new order for the next auction.
+
+        Returns:
+            dict: Per-operation result, with 'status' either 'ok' or 'error'.
+        """
+        try:
+            client_order_id = int(operation['client_order_id'])
+            symbol = operation['market']
+            side = operation['side']
+            price = Decimal(operation['price'])
+            amount = Decimal(operation['amount'])
+            leverage = Decimal(str(operation.get('leverage', 1)))
+        except (KeyError, ValueError, ArithmeticError) as e:
+            return {"client_order_id": operation.get('client_order_id'), "status": "error", "reason": "invalid order: %s" % e}
+
+        market = self.markets.get(symbol)
+        reason = None
+        if (market is None):
+            reason = "unknown market"
+        elif (side not in ("bid", "ask")):
+            reason = "invalid side"
+        elif (amount <= 0 or price <= 0):
+            reason = "invalid amount or price"
+        elif (client_order_id in account.orders):
+            reason = "duplicate client_order_id"
+        elif (price > market.execution_band_high or price < market.execution_band_low):
+            reason = "price outside execution band"
+
+        if (reason):
+            self.emit(account, "user_data", "reject_order",
+                      {"client_order_id": client_order_id, "market": symbol, "reason": reason})
+            return {"client_order_id": client_order_id, "status": "error", "reason": reason}
+
+        order = SimOrder(client_order_id, account, symbol, side, price, amount, leverage, next(self.sequence))
+        account.orders[client_order_id] = order
+        market.incoming.append(order)
+        self.emit(account, "user_data", "acknowledge_order",
+                  {"client_order_id": client_order_id, "market": symbol})
+        return {"client_order_id": client_order_id, "status": "ok"}
+
+    def delete_order(self, account, operation):
+        try:
+            client_order_id = int(operation['client_order_id'])
+        except (KeyError, ValueError) as e:
+            return {"client_order_id": operation.get('client_order_id'), "status": "error", "reason": "invalid cancel: %s" % e}
+
+        order = account.orders.get(client_order_id)
+        if (order is None or order.state == SimOrderState.DONE):
+            self.emit(account, "user_data", "reject_cancel",
+                      {"client_order_id": client_order_id, "market": operation.get('market')})
+            return {"client_order_id": client_order_id, "status": "error", "reason": "unknown order"}
+
+        self.markets[order.market].cancels.append(order)
+        return {"client_order_id": client_order_id, "status": "ok"}
+
+    def batch(self, account, operations):
+        results = []
+        for operation in operations:
+            if (operation.get('operation') == "create"):
+                results.append(self.create_order(account, operation))
+            elif (operation.get('operation') == "delete"):
+                results.append(self.delete_order(account, operation))
+            else:
+                results.append({"client_order_id": operation.get('client_order_id'), "status": "error",
+                                "reason": "unknown operation"})
+        return results
+
+    # Auctions
+
+    def set_reference_price(self, symbol, price):
+        market = self.markets[symbol]
+        market.reference_price = Decimal(price)
+        market.update_execution_band()
+
+    def run_auction(self, symbol):
+        market = self.markets[symbol]
+        market.auction_id += 1
+
+        cancels, market.cancels = market.cancels, []
+        for order in cancels:
+            self.finish_cancel(market, order)
+
+        incoming, market.incoming = market.incoming, []
+        for order in incoming:
+            if (order.state != SimOrderState.PENDING):
+                continue
+            order.auction_id = market.auction_id
+            self.match(market, order)
+            if (order.amount_left > 0):
+                order.state = SimOrderState.RESTING
+                market.book(order.side)[order.price].append(order)
+                self.emit(order.account, "user_data", "maker_order",
+                          {"client_order_id": order.client_order_id, "market": symbol,
+                           "auction_id": market.auction_id})
+            else:
+                self.finish(order)
+
+        self.emit(None, "market_data", "update",
+                  {"market": symbol, "auction_id": market.auction_id, "execution_band": market.execution_band()})
+
+    def finish_cancel(self, market, order):
+        account = order.account
+        if (order.state == SimOrderState.DONE):
+            self.emit(account, "user_data", "reject_cancel",
+                      {"client_order_id": order.client_order_id, "market": market.symbol})
+            return
+        if (order.state == SimOrderState.PENDING):
+            try:
+                market.incoming.remove(order)
+            except ValueError:
+                pass
+        else:
+            market.remove_resting(order)
+        self.finish(order)
+        self.emit(account, "user_data", "delete_order",
+                  {"client_order_id": order.client_order_id, "market": market.symbol})
+
+    def finish(self, order):
+        order.state = SimOrderState.DONE
+        order.account.orders.pop(order.client_order_id, None)
+
+    def crosses(self, side, limit_price, level_price):
+        return level_price <= limit_price if side == "bid" else level_price >= limit_price
+
+    def match(self, market, taker):
+        opposite = market.asks if taker.side == "bid" else market.bids
+        for level_price in market.best_levels(taker.side):
+            if (taker.amount_left <= 0 or not self.crosses(taker.side, taker.price, level_price)):
+                break
+            level = opposite[level_price]
+            while level and taker.amount_left > 0:
+                maker = level[0]
+                amount = min(maker.amount_left, taker.amount_left)
+                self.execute(market, maker, taker, amount, level_price)
+                if (maker.amount_left == 0):
+                    level.popleft()
+                    self.finish(maker)
+                else:
+                    self.emit(maker.account, "user_data", "maker_order",
+                              {"client_order_id": maker.client_order_id, "market": market.symbol,
+                               "auction_id": market.auction_id})
+            if (not level):
+                del opposite[level_price]
+
+    def execute(self, market, maker, taker, amount, price):
+        maker.amount_left -= amount
+        taker.amount_left -= amount
+
+        self.emit(maker.account, "user_data", "active_order",
+                  {"client_order_id": maker.client_order_id, "market": market.symbol,
+                   "auction_id": market.auction_id})
+        for order, event, fee_rate in ((maker, "maker_trade", self.maker_fee),
+                                       (taker, "taker_trade", self.taker_fee)):
+            if (order.account is None):
+                continue
+            fee = amount * price * fee_rate
+            self.emit(order.account, "user_data", event,
+                      {"client_order_id": order.client_order_id, "market": market.symbol,
+                       "execution_amount": str(amount), "price": str(price), "side": order.side,
+                       "fee": str(fee), "auction_id": market.auction_id})
+            self.apply_fill(order.account, market.symbol, order.side, amount, price, fee)
+
+        self.emit(None, "market_data", "trade",
+                  {"market": market.symbol, "amount": str(amount), "price": str(price),
+                   "side": taker.side, "auction_id": market.auction_id})
+
+    def apply_fill(self, account, symbol, side, amount, price, fee):
+        position = account.positions[symbol]
+        signed = amount if side == "bid" else -amount
+        new_amount = position.amount + signed
+
+        if (position.amount == 0 or (position.amount > 0) == (signed > 0)):
+            # Increasing the position, average the entry price
+            total = abs(position.amount) * position.entry_price + amount * price
+            position.entry_price = total / abs(new_amount)
+        else:
+            closed = min(amount, abs(position.amount))
+            direction = 1 if position.amount > 0 else -1
+            account.available += closed * (price - position.entry_price) * direction
+            if (new_amount == 0):
+                position.entry_price = Decimal(0)
+            elif ((new_amount > 0) != (position.amount > 0)):
+                position.entry_price = price
+
+        position.amount = new_amount
+        account.available -= fee
+
+        self.emit(account, "user_data", "update_position", account.position_partial(symbol))
+        self.emit(account, "user_data", "balance", {"balance": account.balance_partial()})
+
+    # Background flow
+
+    def random_taker(self, symbol, *, max_amount, rng=random):
+        """
+        Sends an anonymous marketable order against the book, so resting
+        maker orders get filled without a second trading bot.
+        """
+        market = self.markets[symbol]
+        side = rng.choice(("bid", "ask"))
+        price = market.execution_band_high if side == "bid" else market.execution_band_low
+        amount = Decimal(str(round(rng.uniform(0, float(max_amount)), 4)))
+        if (amount <= 0):
+            return
+        order = SimOrder(0, None, symbol, side, price, amount, Decimal(1), next(self.sequence))
+        self.match(market, order)
@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+"""External price feed hub
+
+Opens one upstream subscription per (venue, symbol) and fans the ticks out
+to every subscribed market, so `BTC`, `BTC|y000`, `BTC|n000` and
+`BTC-TEST` share a single Binance BTCUSDT trade socket.
+
+Ticks are normalized to the minimal message the bots already understand:
+
+    {"s": "BTCUSDT", "p": "64000.5", "q": "0.01", "T": 1717200000000, "m": true}
+
+Subscribers are either in-process callbacks with the usual
+`callback(source, data)` signature, or other processes connected to the
+hub's unix socket with FeedHubClient. The wire protocol is JSON lines:
+
+    client -> hub    {"subscribe": ["binance-s", "BTCUSDT"]}
+    hub -> client    {"source": "binance-s", "tick": {...}, "recv": 1717200000.123}
+
+Each subscriber tracks its delivery lag (hub receive time to delivery) and,
+for remote subscribers, its queue depth and the ticks dropped because it
+fell behind. Only the latest price matters to the bots, so a slow remote
+subscriber loses its oldest ticks instead of blocking the others.
+
+Example:
+    To run a shared hub and point bots at it::
+
+        $ python3 feed_hub.py --socket /tmp/tickspread-feeds.sock
+        $ python3 bot2.py --market BTC --feed_hub /tmp/tickspread-feeds.sock
+
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+
+from outside_api import BinanceAPI, PythXauAPI
+
+
+# config.json price_source -> feed source name used by the bot callbacks
+PRICE_SOURCES = {
+    'binance_spot': 'binance-s',
+    'pyth_network': 'pyth',
+}
+
+
+def normalize_tick(source, symbol, data):
+    """Returns the normalized tick of an upstream message, or None if it carries no price."""
+    if isinstance(data, (str, bytes)):
+        data = json.loads(data)
+    if (source == 'binance-s'):
+        if ('data' in data and isinstance(data['data'], dict)):
+            data = data['data']
+        if ('p' not in data):
+            return None
+        return {"s": symbol, "p": data['p'], "q": data.get('q'), "T": data.get('T'), "m": data.get('m')}
+    if (source == 'pyth'):
+        if (data.get('status') != 'ok' or 'p' not in data):
+            return None
+        return {"s": symbol, "p": data['p'], "confidence": data.get('confidence')}
+    return None
+
+
+class Subscriber:
+    def __init__(self, name, venue, symbol, callback):
+        self.name = name
+        self.venue = venue
+        self.symbol = symbol
+        self.callback = callback
+
+        self.delivered = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.total_lag = 0.0
+
+    def record_lag(self, recv_time):
+        lag = time.time() - recv_time
+        self.delivered += 1
+        self.last_lag = lag
+        self.total_lag += lag
+        if (lag > self.max_lag):
+            self.max_lag = lag
+
+    def deliver(self, source, tick, recv_time):
+        self.callback(source, tick)
+        self.record_lag(recv_time)
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "venue": self.venue,
+            "symbol": self.symbol,
+            "delivered": self.delivered,
+            "last_lag": self.last_lag,
+            "max_lag": self.max_lag,
+            "mean_lag": self.total_lag / self.delivered if self.delivered else 0.0,
+        }
+
+
+class RemoteSubscriber(Subscriber):
+    """Subscriber on the unix socket: ticks are queued and written by the connection's writer task."""
+
+    def __init__(self, name, venue, symbol, connection):
+        super().__init__(name, venue, symbol, None)
+        self.connection = connection
+
+    def deliver(self, source, tick, recv_time):
+        self.connection.enqueue(self, source, tick, recv_time)
+
+    def stats(self):
+        stats = super().stats()
+        stats["queued"] = self.connection.queue.qsize()
+        stats["dropped"] = self.connection.dropped
+        return stats
+
+
+class Upstream:
+    def __init__(self, venue, symbol, api):
+        self.venue = venue
+        self.symbol = symbol
+        self.api = api
+        self.subscribers = []
+        self.messages = 0
+        self.last_tick = None
+        self.last_recv_time = None
+
+
+class RemoteConnection:
+    def __init__(self, hub, reader, writer, max_queue):
+        self.hub = hub
+        self.reader = reader
+        self.writer = writer
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.subscribers = []
+        self.dropped = 0
+
+    def enqueue(self, subscriber, source, tick, recv_time):
+        if (self.queue.full()):
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait((subscriber, source, tick, recv_time))
+
+    async def write_loop(self):
+        while True:
+            subscriber, source, tick, recv_time = await self.queue.get()
+            line = json.dumps({"source": source, "tick": tick, "recv": recv_time}) + "\n"
+            self.writer.write(line.encode())
+            await self.writer.drain()
+            subscriber.record_lag(recv_time)
+
+    async def read_loop(self):
+        peer = "remote-%d" % id(self)
+        while True:
+            line = await self.reader.readline()
+            if (not line):
+                return
+            try:
+                request = json.loads(line)
+                venue, symbol = request["subscribe"]
+                name = request.get("name", peer)
+            except (ValueError, KeyError, TypeError):
+                self.hub.logger.warning("Invalid feed hub request: %r", line[:200])
+                continue
+            subscriber = RemoteSubscriber(name, venue, symbol, self)
+            try:
+                self.hub.add_subscriber(subscriber)
+            except ValueError as e:
+                self.hub.logger.warning("Rejected feed hub subscription: %s", e)
+                continue
+            self.subscribers.append(subscriber)
+
+
+class FeedHub:
+    def __init__(self, logger=logging.getLogger(), max_remote_queue=1000):
+        self.logger = logger
+        self.max_remote_queue = max_remote_queue
+        self.upstreams = {}		# (venue, symbol) -> Upstream
+        self.callbacks = []		# raw upstream messages, e.g. the feed recorder
+        self.server = None
+
+    def on_message(self, callback):
+        """Registers a callback for every raw upstream message, before normalization."""
+        self.callbacks.append(callback)
+
+    def subscribe(self, venue, symbol, callback, name=None):
+        """
+        Subscribes `callback(source, tick)` to the ticks of `symbol` on `venue`.
+
+        Args:
+            venue (str): Feed source name, 'binance-s' or 'pyth' (see PRICE_SOURCES).
+            symbol (str): External market, e.g. 'BTCUSDT'.
+            name (str, optional): Subscriber name shown in the stats.
+
+        Returns:
+            Subscriber: Handle for unsubscribe() and lag stats.
+        """
+        subscriber = Subscriber(name or "%s:%s" % (venue, symbol), venue, symbol, callback)
+        self.add_subscriber(subscriber)
+        return subscriber
+
+    def add_subscriber(self, subscriber):
+        key = (subscriber.venue, subscriber.symbol)
+        upstream = self.upstreams.get(key)
+        if (upstream is None):
+            upstream = self.upstreams[key] = self.open_upstream(*key)
+        upstream.subscribers.append(subscriber)
+
+    def unsubscribe(self, subscriber):
+        upstream = self.upstreams.get((subscriber.venue, subscriber.symbol))
+        if (upstream and subscriber in upstream.subscribers):
+            upstream.subscribers.remove(subscriber)
+
+    def open_upstream(self, venue, symbol):
+        self.logger.info("Opening upstream %s %s", venue, symbol)
+        if (venue == 'binance-s'):
+            api = BinanceAPI()
+            upstream = Upstream(venue, symbol, api)
+            api.on_message(lambda source, data: self.dispatch(upstream, source, data))
+            api.subscribe_futures(symbol)
+        elif (venue == 'pyth'):
+            api = PythXauAPI(logger=self.logger)
+            upstream = Upstream(venue, symbol, api)
+            api.on_message(lambda source, data: self.dispatch(upstream, source, data))
+            api.subscribe_index_price(symbol)
+        else:
+            raise ValueError("Unknown feed venue '%s'" % venue)
+        return upstream
+
+    def dispatch(self, upstream, source, data):
+        recv_time = time.time()
+        for callback in self.callbacks:
+            callback(source, data)
+
+        tick = normalize_tick(source, upstream.symbol, data)
+        if (tick is None):
+            return 0
+        upstream.messages += 1
+        upstream.last_tick = tick
+        upstream.last_recv_time = recv_time
+
+        for subscriber in upstream.subscribers:
+            try:
+                subscriber.deliver(source, tick, recv_time)
+            except Exception as e:
+                # One failing market must not starve the others
+                self.logger.error("Feed subscriber %s failed: %r", subscriber.name, e)
+        return 0
+
+    def stats(self):
+        return [{
+            "venue": upstream.venue,
+            "symbol": upstream.symbol,
+            "messages": upstream.messages,
+            "subscriber_count": len(upstream.subscribers),
+            "subscribers": [subscriber.stats() for subscriber in upstream.subscribers],
+        } for upstream in self.upstreams.values()]
+
+    # Unix socket server for other processes
+
+    async def start_server(self, path):
+        if (os.path.exists(path)):
+            os.unlink(path)
+        self.server = await asyncio.start_unix_server(self.handle_client, path=path)
+        self.logger.info("Feed hub listening on %s", path)
+
+    async def handle_client(self, reader, writer):
+        connection = RemoteConnection(self, reader, writer, self.max_remote_queue)
+        write_task = asyncio.get_event_loop().create_task(connection.write_loop())
+        try:
+            await connection.read_loop()
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            self.logger.info("Feed hub client disconnected: %s", e)
+        finally:
+            write_task.cancel()
+            for subscriber in connection.subscribers:
+                self.unsubscribe(subscriber)
+            writer.close()
+
+    async def log_stats(self, interval=10.0):
+        while True:
+            await asyncio.sleep(interval)
+            for upstream in self.stats():
+                self.logger.info("%s %s: %d messages, %d subscribers", upstream["venue"], upstream["symbol"],
+                                 upstream["messages"], upstream["subscriber_count"])
+                for subscriber in upstream["subscribers"]:
+                    self.logger.info("    %-20s lag last=%.1fms max=%.1fms queued=%s dropped=%s",
+                                     subscriber["name"], subscriber["last_lag"] * 1e3, subscriber["max_lag"] * 1e3,
+                                     subscriber.get("queued", "-"), subscriber.get("dropped", "-"))
+
+
+class FeedHubClient:
+    """
+    Receives ticks from a FeedHub running in another process.
+
+    Has the same subscribe() interface as FeedHub, and reconnects and
+    resubscribes if the hub goes away.
+    """
+
+    def __init__(self, path, logger=logging.getLogger(), name=None):
+        self.path = path
+        self.logger = logger
+        self.name = name or "pid-%d" % os.getpid()
+        self.subscribers = {}		# (venue, symbol) -> [Subscriber]
+        self.writer = None
+        self.connects = 0
+
+    def subscribe(self, venue, symbol, callback, name=None):
+        subscriber = Subscriber(name or "%s:%s" % (venue, symbol), venue, symbol, callback)
+        key = (venue, symbol)
+        first = key not in self.subscribers
+        self.subscribers.setdefault(key, []).append(subscriber)
+        if (first and self.writer):
+            self.send_subscribe(venue, symbol)
+        return subscriber
+
+    def send_subscribe(self, venue, symbol):
+        request = {"subscribe": [venue, symbol], "name": self.name}
+        self.writer.write((json.dumps(request) + "\n").encode())
+
+    async def connect(self):
+        asyncio.get_event_loop().create_task(self.loop())
+
+    async def loop(self):
+        while True:
+            try:
+                reader, self.writer = await asyncio.open_unix_connection(self.path)
+                self.connects += 1
+                for venue, symbol in self.subscribers:
+                    self.send_subscribe(venue, symbol)
+                while True:
+                    line = await reader.readline()
+                    if (not line):
+                        break
+                    try:
+                        message = json.loads(line)
+                        source = message["source"]
+                        tick = message["tick"]
+                        recv_time = message["recv"]
+                        subscribers = self.subscribers.get((source, tick.get("s")), [])
+                    except (ValueError, KeyError, TypeError, AttributeError) as e:
+                        self.logger.error("Bad feed hub message %r: %s", line[:200], e)
+                        continue
+                    for subscriber in subscribers:
+                        try:
+                            subscriber.deliver(source, tick, recv_time)
+                        except Exception as e:
+                            # One failing market must not starve the others
+                            self.logger.error("Feed subscriber %s failed: %r", subscriber.name, e)
+            except (OSError, ValueError) as e:
+                self.logger.warning("Feed hub connection failed: %s", e)
+            self.writer = None
+            await asyncio.sleep(1.0)
+
+    def stats(self):
+        return [subscriber.stats() for subscribers in self.subscribers.values() for subscriber in subscribers]
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Share external price feeds between bot processes.')
+    parser.add_argument('--socket', dest='socket', default="/tmp/tickspread-feeds.sock",
+                        help='unix socket to serve on (default: /tmp/tickspread-feeds.sock)')
+    parser.add_argument('--subscribe', dest='subscribe', action='append', default=[],
+                        help='upstream to open at startup, e.g. binance-s:BTCUSDT (repeatable)')
+    parser.add_argument('--stats_interval', dest='stats_interval', type=float, default=10.0,
+                        help='seconds between stats log lines (default: 10)')
+    return parser.parse_args()
+
+
+async def main():
+    args = parse_arguments()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)-8s %(message)s')
+
+    hub = FeedHub()
+    for spec in args.subscribe:
+        venue, symbol = spec.split(":", 1)
+        hub.subscribe(venue, symbol, lambda source, tick: 0, name="warm")
+    await hub.start_server(args.socket)
+    await hub.log_stats(args.stats_interval)
+
+if __name__ == "__main__":
+    try:
+        loop = asyncio.get_event_loop()
+        loop.create_task(main())
+        loop.run_forever()
+    except (Exception, KeyboardInterrupt) as e:
+        print('ERROR', str(e))
+        exit()
@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+"""Raw feed recorder
+
+Captures every frame received from the TickSpread websocket and from the
+external price feeds (Binance, Pyth, ...) together with its receive
+timestamps, so it can later be replayed, backtested or used for latency
+forensics.
+
+Each frame is stored as a length-prefixed record:
+
+    <payload_len:u32><monotonic_ns:i64><wall_ns:i64><source_len:u16><source><payload>
+
+Files are compressed with zstd when the `zstandard` package is available
+(gzip otherwise) and rotated by size and age. The recorder callback only
+appends to an in-memory buffer; compression and disk writes happen on a
+background thread, so recording never blocks the event loop. When the
+buffer is full new frames are dropped and counted in `dropped_frames`.
+
+Example:
+    To record the ETH markets::
+
+        $ python3 feed_recorder.py --market ETH --external_market ETHUSDT --dir captures
+
+"""
+
+import argparse
+import asyncio
+import collections
+import gzip
+import json
+import logging
+import os
+import struct
+import threading
+import time
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+FRAME_HEADER = struct.Struct("<IqqH")
+
+DEFAULT_MAX_FILE_BYTES = 256 * 1024 * 1024
+DEFAULT_MAX_FILE_SECONDS = 3600.0
+DEFAULT_MAX_BUFFER_BYTES = 64 * 1024 * 1024
+
+
+def default_compression():
+    return "zstd" if zstandard else "gzip"
+
+
+def compression_suffix(compression):
+    if (compression == "zstd"):
+        return ".frames.zst"
+    elif (compression == "gzip"):
+        return ".frames.gz"
+    else:
+        return ".frames"
+
+
+def open_frames_writer(path, compression):
+    if (compression == "zstd"):
+        if (not zstandard):
+            raise RuntimeError("zstd compression requested but zstandard is not installed")
+        fh = open(path, "wb")
+        return zstandard.ZstdCompressor(level=3).stream_writer(fh, closefd=True)
+    elif (compression == "gzip"):
+        return gzip.open(path, "wb", compresslevel=5)
+    else:
+        return open(path, "wb")
+
+
+def open_frames_reader(path):
+    if (path.endswith(".zst")):
+        if (not zstandard):
+            raise RuntimeError("%s is zstd compressed but zstandard is not installed" % path)
+        fh = open(path, "rb")
+        return zstandard.ZstdDecompressor().stream_reader(fh, closefd=True)
+    elif (path.endswith(".gz")):
+        return gzip.open(path, "rb")
+    else:
+        return open(path, "rb")
+
+
+def encode_frame(source, raw_data, monotonic_ns, wall_ns):
+    if isinstance(raw_data, bytes):
+        payload = raw_data
+    elif isinstance(raw_data, str):
+        payload = raw_data.encode()
+    else:
+        payload = json.dumps(raw_data, default=str).encode()
+    source_bytes = source.encode()
+    return FRAME_HEADER.pack(len(payload), monotonic_ns, wall_ns, len(source_bytes)) + source_bytes + payload
+
+
+def _read_exact(reader, size):
+    chunks = []
+    while size > 0:
+        try:
+            chunk = reader.read(size)
+        except EOFError:
+            # Compressed stream cut off mid-block, e.g. by a crash: a short read
+            break
+        if (not chunk):
+            break
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def read_frames(path):
+    """
+    Iterates over the frames stored in a capture file.
+
+    Args:
+        path (str): Path to a file written by FeedRecorder.
+
+    Yields:
+        tuple: (monotonic_ns, wall_ns, source, payload) with payload as str.
+    """
+    with open_frames_reader(path) as reader:
+        while True:
+            header = _read_exact(reader, FRAME_HEADER.size)
+            if (len(header) < FRAME_HEADER.size):
+                if (header):
+                    logging.warning("Truncated frame header at the end of %s", path)
+                return
+            payload_len, monotonic_ns, wall_ns, source_len = FRAME_HEADER.unpack(header)
+            body = _read_exact(reader, source_len + payload_len)
+            if (len(body) < source_len + payload_len):
+                logging.warning("Truncated frame at the end of %s", path)
+                return
+            source = body[:source_len].decode()
+            payload = body[source_len:].decode()
+            yield monotonic_ns, wall_ns, source, payload
+
+
+class FeedRecorder:
+    def __init__(self, directory, *, prefix="feed", compression=None,
+                 max_file_bytes=DEFAULT_MAX_FILE_BYTES, max_file_seconds=DEFAULT_MAX_FILE_SECONDS,
+                 max_buffer_bytes=DEFAULT_MAX_BUFFER_BYTES, logger=logging.getLogger()):
+        self.directory = directory
+        self.prefix = prefix
+        self.compression = compression if compression else default_compression()
+        self.max_file_bytes = max_file_bytes
+        self.max_file_seconds = max_file_seconds
+        self.max_buffer_bytes = max_buffer_bytes
+        self.logger = logger
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        # Buffer shared with the writer thread
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.buffer = collections.deque()
+        self.buffered_bytes = 0
+
+        # Statistics
+        self.recorded_frames = 0
+        self.dropped_frames = 0
+        self.written_bytes = 0
+        self.files_written = []
+
+        # Writer state (only touched by the writer thread)
+        self.file = None
+        self.file_seq = 0
+        self.file_bytes = 0
+        self.file_open_time = 0.0
+
+        self.running = True
+        self.thread = threading.Thread(target=self.writer_loop, name="feed-recorder", daemon=True)
+        self.thread.start()
+
+    def callback(self, source, raw_data):
+        """
+        Stamps and buffers a frame. Has the same signature as the bots'
+        callbacks, so it can be registered with `on_message` of any feed.
+        """
+        monotonic_ns = time.monotonic_ns()
+        wall_ns = time.time_ns()
+        frame = encode_frame(source, raw_data, monotonic_ns, wall_ns)
+
+        with self.lock:
+            if (self.buffered_bytes + len(frame) > self.max_buffer_bytes):
+                self.dropped_frames += 1
+                return 0
+            self.buffer.append(frame)
+            self.buffered_bytes += len(frame)
+            self.recorded_frames += 1
+        self.wakeup.set()
+        return 0
+
+    def take_buffer(self):
+        with self.lock:
+            frames = self.buffer
+            self.buffer = collections.deque()
+            self.buffered_bytes = 0
+        return frames
+
+    def open_next_file(self):
+        self.close_file()
+        self.file_seq += 1
+        name = "%s-%s-%04d%s" % (self.prefix, time.strftime("%Y%m%d-%H%M%S"),
+                                 self.file_seq, compression_suffix(self.compression))
+        path = os.path.join(self.directory, name)
+        self.file = open_frames_writer(path, self.compression)
+        self.file_bytes = 0
+        self.file_open_time = time.monotonic()
+        self.files_written.append(path)
+        self.logger.info("Recording feeds to %s", path)
+
+    def close_file(self):
+        if (self.file):
+            self.file.close()
+            self.file = None
+
+    def should_rotate(self):
+        return (self.file_bytes >= self.max_file_bytes or
+                time.monotonic() - self.file_open_time >= self.max_file_seconds)
+
+    def write_frames(self, frames):
+        for frame in frames:
+            if (not self.file or self.should_rotate()):
+                self.open_next_file()
+            self.file.write(frame)
+            self.file_bytes += len(frame)
+            self.written_bytes += len(frame)
+
+    def writer_loop(self):
+        while self.running:
+            self.wakeup.wait(0.5)
+            self.wakeup.clear()
+            frames = self.take_buffer()
+            try:
+                self.write_frames(frames)
+                if (self.file and self.should_rotate()):
+                    self.open_next_file()
+            except Exception as e:
+                self.logger.error("Feed recorder failed to write %d frames: %s", len(frames), e)
+        self.write_frames(self.take_buffer())
+        self.close_file()
+
+    def close(self):
+        if (not self.running):
+            return
+        self.running = False
+        self.wakeup.set()
+        self.thread.join()
+        self.logger.info("Feed recorder closed: %d frames, %d dropped, %d bytes",
+                         self.recorded_frames, self.dropped_frames, self.written_bytes)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Record raw TickSpread and external feeds.')
+    parser.add_argument('--env', dest='env', default="prod",
+                        help='set the env to connect to (default: prod)')
+    parser.add_argument('--market', dest='market', action='append', default=[],
+                        help='TickSpread market to record market_data from (repeatable)')
+    parser.add_argument('--external_market', dest='external_market', action='append', default=[],
+                        help='Binance symbol to record trades from (repeatable)')
+    parser.add_argument('--pyth', dest='pyth', action='append', default=[],
+                        help='Pyth symbol to record prices from (repeatable)')
+    parser.add_argument('--dir', dest='directory', default="captures",
+                        help='set the output directory (default: captures)')
+    parser.add_argument('--compression', dest='compression', default=None,
+                        help='zstd, gzip or none (default: zstd if available)')
+    return parser.parse_args()
+
+
+async def main():
+    from tickspread_api import TickSpreadAPI
+    from outside_api import BinanceAPI, PythXauAPI
+
+    args = parse_arguments()
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)-8s %(message)s')
+
+    recorder = FeedRecorder(args.directory, compression=args.compression)
+
+    if (args.market):
+        api = TickSpreadAPI(env=args.env)
+        api.token = None
+        api.on_message(recorder.callback)
+        await api.connect()
+        for market in args.market:
+            await api.subscribe("market_data", {"symbol": market})
+
+    for external_market in args.external_market:
+        binance_api = BinanceAPI()
+        binance_api.on_message(recorder.callback)
+        binance_api.subscribe_futures(external_market)
+
+    for symbol in args.pyth:
+        pyth_api = PythXauAPI()
+        pyth_api.on_message(recorder.callback)
+        pyth_api.subscribe_index_price(symbol)
+
+    try:
+        while True:
+            await asyncio.sleep(10)
+            logging.info("Recorded %d frames (%d dropped)", recorder.recorded_frames, recorder.dropped_frames)
+    finally:
+        recorder.close()
+
+if __name__ == "__main__":
+    try:
+        asyncio.get_event_loop().run_until_complete(main())
+    except (Exception, KeyboardInterrupt) as e:
+        print('ERROR', str(e))
+        logging.shutdown()
+        exit()
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""Event loop saturation monitor
+
+Everything a bot process does runs on one asyncio loop, so a slow
+callback delays every other market, feed and timer of the process.
+LoopMonitor measures this in two ways:
+
+    - lag: a task sleeps `interval` seconds and records how late it wakes
+      up, which is how long the loop was busy with something else
+    - callback timing: wrap_callback() and wrap_stage() replace bound
+      methods with timing wrappers; a callback over `budget` seconds logs a
+      warning naming its slowest stage
+
+The timings are Summary metrics, so their percentiles can be read from the
+metrics registry. When a market's callbacks keep exceeding the budget it
+is time to give it its own process.
+
+"""
+
+import asyncio
+import logging
+import time
+
+from metrics import REGISTRY
+
+
+class LoopMonitor:
+    def __init__(self, *, interval=0.1, budget=0.01, registry=REGISTRY, logger=logging.getLogger(),
+                 clock=time.perf_counter):
+        """
+        Args:
+            interval (float): Seconds between lag measurements.
+            budget (float): Seconds a callback may take before a warning.
+        """
+        self.interval = interval
+        self.budget = budget
+        self.logger = logger
+        self.clock = clock
+
+        self.lag = registry.summary("loop_lag_seconds", "Delay of the event loop in waking up a sleeping task").labels()
+        self.callback_seconds = registry.summary("callback_seconds", "Duration of a callback", ("callback",))
+        self.stage_seconds = registry.summary("stage_seconds", "Duration of a stage inside the callbacks", ("stage",))
+        self.over_budget = registry.counter("callback_over_budget_total", "Callbacks that exceeded the budget", ("callback",))
+
+        self.stages = None			# stage -> seconds, of the callback running
+        self.max_lag = 0.0
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(loop.time() - start - self.interval, 0.0)
+            self.lag.observe(lag)
+            if (lag > self.max_lag):
+                self.max_lag = lag
+            if (lag > self.budget):
+                self.logger.warning("Event loop lag %.1f ms", lag * 1000)
+
+    def wrap_callback(self, name, func):
+        """Returns `func` timed as callback `name`, with the stages it runs."""
+        seconds = self.callback_seconds.labels(name)
+        over_budget = self.over_budget.labels(name)
+
+        def timed(*args, **kwargs):
+            outer = self.stages
+            self.stages = {}
+            start = self.clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = self.clock() - start
+                stages, self.stages = self.stages, outer
+                seconds.observe(elapsed)
+                if (elapsed > self.budget):
+                    over_budget.inc()
+                    if (stages):
+                        stage, stage_elapsed = max(stages.items(), key=lambda item: item[1])
+                    else:
+                        stage, stage_elapsed = name, elapsed
+                    self.logger.warning("%s took %.1f ms (budget %.1f ms), slowest stage %s %.1f ms",
+                                        name, elapsed * 1000, self.budget * 1000, stage, stage_elapsed * 1000)
+        return timed
+
+    def wrap_stage(self, name, func):
+        """Returns `func` timed as stage `name` of whichever callback runs it."""
+        seconds = self.stage_seconds.labels(name)
+
+        def timed(*args, **kwargs):
+            start = self.clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = self.clock() - start
+                seconds.observe(elapsed)
+                if (self.stages is not None):
+                    self.stages[name] = self.stages.get(name, 0.0) + elapsed
+        return timed
+
+    def stats(self):
+        return {
+            "lag_ms": {quantile: round(value * 1000, 3) for quantile, value in self.lag.percentiles().items()},
+            "max_lag_ms": round(self.max_lag * 1000, 3),
+            "callbacks_ms": {values[0]: {quantile: round(value * 1000, 3)
+                                         for quantile, value in summary.percentiles().items()}
+                             for values, summary in self.callback_seconds.children.items()},
+        }
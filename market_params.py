@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""Validated, immutable market maker parameters
+
+MarketParams is built once per market (and again on every config reload)
+from the MarketMaker keyword arguments. Every value is converted to an
+exact Decimal there, and the values the quoting path derives from them are
+computed once, so `update_orders` and the price callbacks do no per-tick
+conversions or constant construction.
+
+Floats are converted through their shortest repr, so 0.9 becomes
+Decimal("0.9") rather than 0.90000000000000002220446...
+
+"""
+
+from decimal import Decimal
+
+
+DECIMAL_ZERO = Decimal(0)
+DECIMAL_ONE = Decimal(1)
+BPS = Decimal("0.0001")
+PERCENT_PER_BPS = Decimal("0.01")
+DELTA_TICKS_QUANTUM = Decimal("0.001")
+
+
+def to_decimal(value):
+    if isinstance(value, Decimal):
+        return value
+    if isinstance(value, float):
+        return Decimal(repr(value))
+    return Decimal(value)
+
+
+class MarketParams:
+    """
+    Frozen parameter set of one market.
+
+    Takes the MarketMaker keyword arguments; raises ValueError if they are
+    inconsistent. Use replace() to derive a changed copy.
+    """
+
+    __slots__ = (
+        # Settings
+        'tick_jump', 'orders_per_side', 'min_order_size', 'max_position', 'max_order_size',
+        'max_liquidity', 'max_diff', 'order_leverage', 'target_leverage', 'spread_bps',
+        'liquidity_curve_hysteresis_low', 'liquidity_curve_hysteresis_minimum',
+        # Derived
+        'max_orders', 'lot_size', 'tick_jump_reciprocal', 'spread_factor', 'spread_percent',
+        'kyle_coefficient', 'tick_liquidity_factor',
+        # The arguments, for replace()
+        'settings',
+    )
+
+    def __init__(self, *, tick_jump=10, orders_per_side=8, min_order_size=0.5, max_position=400,
+                 max_order_size=10.0, max_liquidity=-1, max_diff=0.004, order_leverage=50, target_leverage=10,
+                 spread_bps=0.5, liquidity_curve_hysteresis_low=0.9, liquidity_curve_hysteresis_minimum=0.8):
+        settings = {
+            'tick_jump': tick_jump, 'orders_per_side': orders_per_side, 'min_order_size': min_order_size,
+            'max_position': max_position, 'max_order_size': max_order_size, 'max_liquidity': max_liquidity,
+            'max_diff': max_diff, 'order_leverage': order_leverage, 'target_leverage': target_leverage,
+            'spread_bps': spread_bps, 'liquidity_curve_hysteresis_low': liquidity_curve_hysteresis_low,
+            'liquidity_curve_hysteresis_minimum': liquidity_curve_hysteresis_minimum,
+        }
+        try:
+            tick_jump = to_decimal(tick_jump)
+            orders_per_side = int(orders_per_side)
+            min_order_size = to_decimal(min_order_size)
+            max_position = to_decimal(max_position)
+            max_order_size = to_decimal(max_order_size)
+            max_liquidity = to_decimal(max_liquidity)
+            max_diff = to_decimal(max_diff)
+            order_leverage = to_decimal(order_leverage)
+            target_leverage = to_decimal(target_leverage)
+            spread_bps = to_decimal(spread_bps)
+            hysteresis_low = to_decimal(liquidity_curve_hysteresis_low)
+            hysteresis_minimum = to_decimal(liquidity_curve_hysteresis_minimum)
+        except ArithmeticError as e:
+            # decimal.InvalidOperation on malformed numbers
+            raise ValueError("malformed number (%r)" % e)
+
+        if (tick_jump <= 0 or min_order_size <= 0 or max_position <= 0):
+            raise ValueError("tick_jump, min_order_size and max_position must be positive")
+        if (orders_per_side < 0):
+            # 0 is a market that only listens
+            raise ValueError("orders_per_side must not be negative")
+        if (max_order_size < min_order_size):
+            raise ValueError("max_order_size must not be below min_order_size")
+        if (spread_bps < 0):
+            raise ValueError("spread_bps must not be negative")
+        if (max_diff <= 0):
+            raise ValueError("max_diff must be positive")
+        if (not (0 < hysteresis_minimum <= hysteresis_low <= 1)):
+            raise ValueError("liquidity curve hysteresis must satisfy 0 < minimum <= low <= 1")
+
+        if (max_liquidity < 0):
+            max_liquidity = max_position
+
+        reciprocal = DECIMAL_ONE / tick_jump
+        setter = object.__setattr__
+        setter(self, 'settings', settings)
+        setter(self, 'tick_jump', tick_jump)
+        setter(self, 'orders_per_side', orders_per_side)
+        setter(self, 'min_order_size', min_order_size)
+        setter(self, 'max_position', max_position)
+        setter(self, 'max_order_size', max_order_size)
+        setter(self, 'max_liquidity', max_liquidity)
+        setter(self, 'max_diff', max_diff)
+        setter(self, 'order_leverage', order_leverage)
+        setter(self, 'target_leverage', target_leverage)
+        setter(self, 'spread_bps', spread_bps)
+        setter(self, 'liquidity_curve_hysteresis_low', hysteresis_low)
+        setter(self, 'liquidity_curve_hysteresis_minimum', hysteresis_minimum)
+
+        setter(self, 'max_orders', 2 * orders_per_side)
+        # Sizes are rounded down to the precision of min_order_size
+        setter(self, 'lot_size', min_order_size)
+        # Only used when exact, so grid rounding never differs from a division
+        setter(self, 'tick_jump_reciprocal', reciprocal if reciprocal * tick_jump == DECIMAL_ONE else None)
+        setter(self, 'spread_factor', spread_bps * BPS)
+        setter(self, 'spread_percent', spread_bps * PERCENT_PER_BPS)
+        # Price impact per position unit is price * kyle_coefficient, and the
+        # average liquidity per tick is tick_jump / impact = tick_liquidity_factor / price
+        setter(self, 'kyle_coefficient', max_diff / max_position)
+        setter(self, 'tick_liquidity_factor', tick_jump / (max_diff / max_position))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("MarketParams is immutable, use replace()")
+
+    def __delattr__(self, name):
+        raise AttributeError("MarketParams is immutable")
+
+    def __eq__(self, other):
+        return isinstance(other, MarketParams) and all(
+            getattr(self, name) == getattr(other, name) for name in self.__slots__ if name != 'settings')
+
+    def __hash__(self):
+        return hash((self.tick_jump, self.orders_per_side, self.max_position, self.spread_bps))
+
+    def __repr__(self):
+        return "MarketParams(%s)" % ", ".join(
+            "%s=%s" % (name, getattr(self, name)) for name in self.__slots__[:12])
+
+    def replace(self, **changes):
+        """Returns a validated copy with `changes` applied; None values are ignored."""
+        settings = dict(self.settings)
+        settings.update({key: value for key, value in changes.items() if value is not None})
+        return MarketParams(**settings)
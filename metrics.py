@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""In-process metrics registry
+
+Metrics are plain objects updated from the hot path without locks: the
+bots run on one event loop thread, and the few updates made from executor
+threads are counters where an occasional lost increment does not matter.
+Nothing is formatted until collect() is called.
+
+    - Counter: monotonically increasing value, named with a _total suffix
+    - Gauge: value that is set
+    - Summary: count, sum and percentiles of the last `window` observations
+    - Histogram: cumulative counts of observations per bucket
+
+A family groups the metrics of one name by label values; labels() returns
+(and creates on first use) the metric of one combination, which callers
+keep to avoid the lookup per update. Values that already live in the bot
+state are not copied into gauges: add_collector() registers a function
+that reads them when the registry is collected.
+
+render_prometheus() formats a collection in the Prometheus text format,
+and start_metrics_server() serves it over HTTP on the bot's event loop.
+
+"""
+
+import asyncio
+import bisect
+import collections
+import logging
+
+
+QUANTILES = (0.5, 0.9, 0.99)
+SUMMARY_WINDOW = 1024
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Counter:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self, name):
+        return [(name, (), self.value)]
+
+
+class Gauge:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self, name):
+        return [(name, (), self.value)]
+
+
+class Summary:
+    __slots__ = ('window', 'count', 'sum')
+
+    def __init__(self, window=SUMMARY_WINDOW):
+        self.window = collections.deque(maxlen=window)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.window.append(value)
+        self.count += 1
+        self.sum += value
+
+    def percentiles(self, quantiles=QUANTILES):
+        ordered = sorted(self.window)
+        if (not ordered):
+            return {quantile: 0.0 for quantile in quantiles}
+        return {quantile: ordered[min(int(quantile * len(ordered)), len(ordered) - 1)] for quantile in quantiles}
+
+    def samples(self, name):
+        samples = [(name, (("quantile", str(quantile)),), value)
+                   for quantile, value in self.percentiles().items()]
+        samples.append((name + "_sum", (), self.sum))
+        samples.append((name + "_count", (), self.count))
+        return samples
+
+
+class Histogram:
+    __slots__ = ('bounds', 'counts', 'count', 'sum')
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * len(bounds)	# per bucket, accumulated on collection
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.bounds, value)
+        if (index < len(self.bounds)):
+            self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    def samples(self, name):
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            samples.append((name + "_bucket", (("le", repr(bound)),), cumulative))
+        samples.append((name + "_bucket", (("le", "+Inf"),), self.count))
+        samples.append((name + "_sum", (), self.sum))
+        samples.append((name + "_count", (), self.count))
+        return samples
+
+
+class Family:
+    def __init__(self, name, help, kind, factory, labelnames):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.factory = factory
+        self.labelnames = tuple(labelnames)
+        self.children = {}			# label values -> metric
+
+    def labels(self, *values):
+        values = tuple(str(value) for value in values)
+        if (len(values) != len(self.labelnames)):
+            raise ValueError("%s takes labels %s" % (self.name, self.labelnames))
+        metric = self.children.get(values)
+        if (metric is None):
+            metric = self.children[values] = self.factory()
+        return metric
+
+    def samples(self):
+        for values, metric in self.children.items():
+            labels = tuple(zip(self.labelnames, values))
+            for name, extra, value in metric.samples(self.name):
+                yield name, labels + extra, value
+
+
+class Registry:
+    def __init__(self):
+        self.families = {}			# name -> Family
+        self.collectors = []
+
+    def family(self, name, help, kind, factory, labelnames):
+        family = self.families.get(name)
+        if (family is None):
+            family = self.families[name] = Family(name, help, kind, factory, labelnames)
+        elif (family.kind != kind or family.labelnames != tuple(labelnames)):
+            raise ValueError("metric %s already registered as %s%s" % (name, family.kind, family.labelnames))
+        return family
+
+    def counter(self, name, help, labelnames=()):
+        return self.family(name, help, "counter", Counter, labelnames)
+
+    def gauge(self, name, help, labelnames=()):
+        return self.family(name, help, "gauge", Gauge, labelnames)
+
+    def summary(self, name, help, labelnames=()):
+        return self.family(name, help, "summary", Summary, labelnames)
+
+    def histogram(self, name, help, labelnames=(), bounds=LATENCY_BUCKETS):
+        return self.family(name, help, "histogram", lambda: Histogram(bounds), labelnames)
+
+    def add_collector(self, collect):
+        """
+        Registers `collect()`, called on every collection.
+
+        It returns (name, help, kind, [(labels dict, value)]) tuples of
+        values read from the bot state at that moment.
+        """
+        self.collectors.append(collect)
+
+    def collect(self):
+        """
+        Returns:
+            list: (name, help, kind, [(sample name, ((label, value), ...), value)]) per metric.
+        """
+        metrics = []
+        for family in self.families.values():
+            metrics.append((family.name, family.help, family.kind, list(family.samples())))
+        for collect in self.collectors:
+            for name, help, kind, values in collect():
+                metrics.append((name, help, kind, [(name, tuple(labels.items()), value) for labels, value in values]))
+        return metrics
+
+
+# Shared by every module of the process
+REGISTRY = Registry()
+
+
+def escape_label(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_value(value):
+    if (isinstance(value, bool)):
+        return "1" if value else "0"
+    if (isinstance(value, int)):
+        return str(value)
+    value = float(value)
+    if (value != value):
+        return "NaN"
+    if (value in (float("inf"), float("-inf"))):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value)
+
+
+def render_prometheus(registry=REGISTRY):
+    """Returns the registry in the Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    for name, help, kind, samples in registry.collect():
+        lines.append("# HELP %s %s" % (name, help.replace("\\", "\\\\").replace("\n", "\\n")))
+        lines.append("# TYPE %s %s" % (name, "untyped" if kind is None else kind))
+        for sample, labels, value in samples:
+            if (value is None):
+                continue
+            if (labels):
+                sample += "{%s}" % ",".join('%s="%s"' % (label, escape_label(str(label_value)))
+                                            for label, label_value in labels)
+            lines.append("%s %s" % (sample, format_value(value)))
+    return "\n".join(lines) + "\n"
+
+
+async def start_metrics_server(port, host="127.0.0.1", registry=REGISTRY, logger=logging.getLogger()):
+    """
+    Serves GET /metrics on `host`:`port`; the metrics are only collected when scraped.
+
+    Returns:
+        asyncio.AbstractServer: The listening server.
+    """
+    async def handle(reader, writer):
+        try:
+            request = await reader.readline()
+            while True:
+                line = await reader.readline()
+                if (not line or line in (b"\r\n", b"\n")):
+                    break
+            parts = request.decode("latin-1").split()
+            if (len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] in ("/metrics", "/")):
+                status = "200 OK"
+                body = render_prometheus(registry).encode()
+            else:
+                status = "404 Not Found"
+                body = b"not found\n"
+            writer.write(("HTTP/1.1 %s\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                          "Content-Length: %d\r\nConnection: close\r\n\r\n" % (status, len(body))).encode() + body)
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            logger.info("Metrics client disconnected: %s", e)
+        except Exception as e:
+            logger.error("Metrics scrape failed: %s", e)
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host=host, port=port)
+    logger.info("Metrics on http://%s:%d/metrics", host, port)
+    return server
@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+"""Local mock TickSpread exchange
+
+Self-contained server emulating the parts of the TickSpread API the bots use,
+backed by the ExchangeSim matching engine (exchange_sim.py):
+
+    POST   /v1/accounts                      register
+    POST   /v1/accounts/login                login, returns a token
+    POST   /v2/orders                        create order
+    DELETE /v2/orders                        delete order
+    POST   /v2/orders/batch                  batch of create/delete operations
+    POST   /v3/broker/margin_update_request  margin update
+    GET    /realtime                         websocket, `market_data` and `user_data` topics
+
+Auctions run every `--auction_ms` per market. Optional artificial latency is
+added to every HTTP response and websocket event, and `--max_ops` bounds the
+number of order operations accepted per second (excess gets HTTP 429).
+
+`TickSpreadAPI(env="dev")` points at localhost:4000, which is the default here.
+
+Example:
+    To load test bot2 locally::
+
+        $ python3 mock_exchange.py --market ETH=2500 --latency_ms 5 --max_ops 2000
+        $ python3 bot2.py --env dev --market ETH --tickspread_password maker
+
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import secrets
+import time
+from decimal import Decimal
+
+from aiohttp import web, WSMsgType
+
+from exchange_sim import ExchangeSim
+
+
+class OperationBudget:
+    """Fixed one-second window counter of accepted order operations."""
+
+    def __init__(self, max_per_second):
+        self.max_per_second = max_per_second
+        self.window_start = 0.0
+        self.count = 0
+        self.rejected = 0
+
+    def take(self, n):
+        if (not self.max_per_second):
+            return True
+        now = time.monotonic()
+        if (now - self.window_start >= 1.0):
+            self.window_start = now
+            self.count = 0
+        if (self.count + n > self.max_per_second):
+            self.rejected += n
+            return False
+        self.count += n
+        return True
+
+
+class MockExchange:
+    def __init__(self, sim, *, auction_interval=0.1, latency=0.0, max_ops_per_second=0,
+                 taker_probability=0.0, taker_max_amount=Decimal("1"), volatility=0.0,
+                 logger=logging.getLogger()):
+        self.sim = sim
+        self.auction_interval = auction_interval
+        self.latency = latency
+        self.budget = OperationBudget(max_ops_per_second)
+        self.taker_probability = taker_probability
+        self.taker_max_amount = Decimal(taker_max_amount)
+        self.volatility = volatility
+        self.logger = logger
+
+        self.tokens = {}		# token -> account
+        self.subscribers = []	# (websocket, topic, symbol, account)
+        self.outboxes = {}		# websocket -> queue of (deliver_at, message), keeps events in order
+
+        self.requests = 0
+        self.operations = 0
+        self.events_sent = 0
+
+        self.sim.on_event(self.on_sim_event)
+
+    # Helpers
+
+    async def delay(self):
+        if (self.latency > 0):
+            await asyncio.sleep(self.latency)
+
+    def authorized_account(self, request):
+        header = request.headers.get("authorization", request.headers.get("Authorization", ""))
+        token = header[len("Bearer "):] if header.startswith("Bearer ") else header
+        return self.tokens.get(token)
+
+    async def respond(self, payload, status=200):
+        await self.delay()
+        return web.json_response(payload, status=status)
+
+    # HTTP handlers
+
+    async def register(self, request):
+        self.requests += 1
+        return await self.respond({"status": "ok"})
+
+    async def login(self, request):
+        self.requests += 1
+        body = await request.json()
+        username = body.get("username")
+        if (not username):
+            return await self.respond({"error": "missing username"}, status=400)
+        token = secrets.token_hex(16)
+        self.tokens[token] = self.sim.get_account(username)
+        return await self.respond({"token": token})
+
+    async def create_order(self, request):
+        self.requests += 1
+        account = self.authorized_account(request)
+        if (account is None):
+            return await self.respond({"error": "unauthorized"}, status=401)
+        if (not self.budget.take(1)):
+            return await self.respond({"error": "rate limited"}, status=429)
+        self.operations += 1
+        result = self.sim.create_order(account, await request.json())
+        return await self.respond(result, status=200 if result["status"] == "ok" else 400)
+
+    async def delete_order(self, request):
+        self.requests += 1
+        account = self.authorized_account(request)
+        if (account is None):
+            return await self.respond({"error": "unauthorized"}, status=401)
+        if (not self.budget.take(1)):
+            return await self.respond({"error": "rate limited"}, status=429)
+        self.operations += 1
+        result = self.sim.delete_order(account, await request.json())
+        return await self.respond(result, status=200 if result["status"] == "ok" else 400)
+
+    async def batch(self, request):
+        self.requests += 1
+        account = self.authorized_account(request)
+        if (account is None):
+            return await self.respond({"error": "unauthorized"}, status=401)
+        operations = (await request.json()).get("operations", [])
+        if (not self.budget.take(len(operations))):
+            return await self.respond({"error": "rate limited"}, status=429)
+        self.operations += len(operations)
+        return await self.respond({"results": self.sim.batch(account, operations)})
+
+    async def margin_update(self, request):
+        self.requests += 1
+        account = self.authorized_account(request)
+        if (account is None):
+            return await self.respond({"error": "unauthorized"}, status=401)
+        body = await request.json()
+        return await self.respond({"status": "ok", "market": body.get("market"), "amount": body.get("amount")})
+
+    # Websocket
+
+    async def realtime(self, request):
+        websocket = web.WebSocketResponse()
+        await websocket.prepare(request)
+        self.outboxes[websocket] = asyncio.Queue()
+        writer = asyncio.get_event_loop().create_task(self.ws_writer(websocket))
+        try:
+            async for message in websocket:
+                if (message.type != WSMsgType.TEXT):
+                    continue
+                self.handle_ws_message(websocket, json.loads(message.data))
+        finally:
+            self.subscribers = [s for s in self.subscribers if s[0] is not websocket]
+            del self.outboxes[websocket]
+            writer.cancel()
+        return websocket
+
+    async def ws_writer(self, websocket):
+        outbox = self.outboxes[websocket]
+        loop = asyncio.get_event_loop()
+        while True:
+            deliver_at, message = await outbox.get()
+            delay = deliver_at - loop.time()
+            if (delay > 0):
+                await asyncio.sleep(delay)
+            try:
+                await websocket.send_str(message)
+            except Exception as e:
+                self.logger.warning("Failed to send event: %s", e)
+                return
+
+    def send(self, websocket, message):
+        outbox = self.outboxes.get(websocket)
+        if (outbox is not None):
+            outbox.put_nowait((asyncio.get_event_loop().time() + self.latency, message))
+
+    def handle_ws_message(self, websocket, data):
+        if (data.get("event") != "subscribe"):
+            return
+        topic = data.get("topic")
+        symbol = (data.get("payload") or {}).get("symbol")
+        if (symbol not in self.sim.markets):
+            self.send(websocket, json.dumps({"topic": topic, "event": "error", "payload": {"reason": "unknown market"}}))
+            return
+
+        if (topic == "market_data"):
+            account = None
+            partial = self.sim.market_data_partial(symbol)
+        elif (topic == "user_data"):
+            token = (data.get("authorization") or "")[len("Bearer "):]
+            account = self.tokens.get(token)
+            if (account is None):
+                self.send(websocket, json.dumps({"topic": topic, "event": "error", "payload": {"reason": "unauthorized"}}))
+                return
+            partial = self.sim.user_data_partial(account, symbol)
+        else:
+            return
+
+        self.subscribers.append((websocket, topic, symbol, account))
+        self.send(websocket, json.dumps({"topic": topic, "event": "partial", "payload": partial}))
+
+    def on_sim_event(self, account, topic, event, payload):
+        symbol = payload.get("market")
+        message = None
+        for websocket, sub_topic, sub_symbol, sub_account in self.subscribers:
+            if (sub_topic != topic or (symbol and sub_symbol != symbol)):
+                continue
+            if (topic == "user_data" and sub_account is not account):
+                continue
+            if (message is None):
+                message = json.dumps({"topic": topic, "event": event, "payload": payload})
+            self.events_sent += 1
+            self.send(websocket, message)
+
+    # Auctions
+
+    async def auction_loop(self, symbol):
+        while True:
+            await asyncio.sleep(self.auction_interval)
+            if (self.volatility > 0):
+                market = self.sim.markets[symbol]
+                move = Decimal(str(random.gauss(0.0, self.volatility)))
+                self.sim.set_reference_price(symbol, market.reference_price * (1 + move))
+            if (self.taker_probability > 0 and random.random() < self.taker_probability):
+                self.sim.random_taker(symbol, max_amount=self.taker_max_amount)
+            self.sim.run_auction(symbol)
+
+    async def stats_loop(self):
+        while True:
+            await asyncio.sleep(10)
+            self.logger.info("requests=%d operations=%d rate_limited=%d events=%d subscribers=%d",
+                             self.requests, self.operations, self.budget.rejected,
+                             self.events_sent, len(self.subscribers))
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_post("/v1/accounts", self.register)
+        app.router.add_post("/v1/accounts/login", self.login)
+        app.router.add_post("/v2/orders", self.create_order)
+        app.router.add_delete("/v2/orders", self.delete_order)
+        app.router.add_post("/v2/orders/batch", self.batch)
+        app.router.add_post("/v3/broker/margin_update_request", self.margin_update)
+        app.router.add_get("/realtime", self.realtime)
+
+        async def start_background(app):
+            loop = asyncio.get_event_loop()
+            for symbol in self.sim.markets:
+                loop.create_task(self.auction_loop(symbol))
+            loop.create_task(self.stats_loop())
+
+        app.on_startup.append(start_background)
+        return app
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Run a local mock TickSpread exchange.')
+    parser.add_argument('--port', dest='port', type=int, default=4000,
+                        help='set the port to listen on (default: 4000)')
+    parser.add_argument('--market', dest='markets', action='append', default=[],
+                        help='market and reference price, e.g. ETH=2500 (repeatable)')
+    parser.add_argument('--auction_ms', dest='auction_ms', type=float, default=100.0,
+                        help='set the auction period in milliseconds (default: 100)')
+    parser.add_argument('--band', dest='band', default="0.05",
+                        help='set the execution band as a fraction of the reference price (default: 0.05)')
+    parser.add_argument('--latency_ms', dest='latency_ms', type=float, default=0.0,
+                        help='added latency on every response and event (default: 0)')
+    parser.add_argument('--max_ops', dest='max_ops', type=int, default=0,
+                        help='order operations accepted per second, 0 = unlimited (default: 0)')
+    parser.add_argument('--taker_probability', dest='taker_probability', type=float, default=0.0,
+                        help='probability of a random taker order per auction (default: 0)')
+    parser.add_argument('--taker_max_amount', dest='taker_max_amount', default="1",
+                        help='maximum size of the random taker orders (default: 1)')
+    parser.add_argument('--volatility', dest='volatility', type=float, default=0.0,
+                        help='per-auction relative stddev of the reference price (default: 0)')
+    parser.add_argument('--money_asset', dest='money_asset', default="USD",
+                        help='set the money asset (default: USD)')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)-8s %(message)s')
+
+    sim = ExchangeSim(money_asset=args.money_asset)
+    for market in (args.markets or ["ETH=2500"]):
+        symbol, price = market.rsplit("=", 1)
+        sim.add_market(symbol, reference_price=Decimal(price), band_fraction=Decimal(args.band))
+
+    exchange = MockExchange(sim, auction_interval=args.auction_ms / 1000.0,
+                            latency=args.latency_ms / 1000.0, max_ops_per_second=args.max_ops,
+                            taker_probability=args.taker_probability,
+                            taker_max_amount=Decimal(args.taker_max_amount),
+                            volatility=args.volatility)
+    web.run_app(exchange.make_app(), port=args.port)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""Order ring snapshots for warm restarts
+
+bot2 keeps the state of its order rings in a small memory-mapped file,
+rewritten whenever a message changed it. After a restart the snapshot is
+compared with the open orders of the user_data partial: orders found in
+both are adopted back into their ring slots instead of being cancelled and
+sent again, so a restart keeps the queue priority of the resting orders.
+
+Layout of the file:
+
+    header      magic, crc32 and length of the body, market
+    body        per side: top order, ring size, order count, top price,
+                tick jump, then one record per live order
+
+Decimals are stored as their exact string. The body is written before the
+header, so a process killed mid-write leaves a checksum mismatch and the
+snapshot is ignored (the bot then cancels everything as without one).
+
+"""
+
+import logging
+import mmap
+import os
+import struct
+import zlib
+from decimal import Decimal
+
+
+MAGIC = b"TSORDS01"
+HEADER = struct.Struct("<8sII32s")
+SIDE_HEADER = struct.Struct("<qII32s32s")
+# slot index, clordid, state, cancel state, price, amount left, total amount
+ORDER = struct.Struct("<Iq2B2x32s32s32s")
+
+
+def pack_decimal(value):
+    if (value is None):
+        return b""
+    text = str(value).encode()
+    if (len(text) > 32):
+        raise ValueError("%s does not fit in an order snapshot" % value)
+    return text
+
+
+def unpack_decimal(raw):
+    text = raw.rstrip(b"\0")
+    return Decimal(text.decode()) if text else None
+
+
+def snapshot_size(max_orders):
+    return HEADER.size + 2 * SIDE_HEADER.size + 2 * max_orders * ORDER.size
+
+
+class OrderSnapshot:
+    def __init__(self, path, market, logger=logging.getLogger()):
+        """
+        Args:
+            path (str): Snapshot file, created if missing.
+            market (str): Market of the snapshot, checked on load.
+        """
+        self.path = path
+        self.market = market
+        self.logger = logger
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self.size = 0
+        self.map = None
+        self.last_body = None
+        self.writes = 0
+        size = os.fstat(self.fd).st_size
+        if (size >= HEADER.size):
+            self.remap(size)
+
+    def remap(self, size):
+        if (self.map is not None):
+            self.map.close()
+        if (os.fstat(self.fd).st_size < size):
+            os.ftruncate(self.fd, size)
+        self.map = mmap.mmap(self.fd, size)
+        self.size = size
+
+    def load(self):
+        """
+        Reads the snapshot left by the previous run.
+
+        Returns:
+            dict: side -> {'top_order', 'top_price', 'max_orders', 'tick_jump',
+                'orders': [(index, clordid, state, cancel, price, amount_left, total_amount)]},
+                with state and cancel as the raw enum values; None if there is no valid snapshot.
+        """
+        if (self.map is None):
+            return None
+        magic, crc, length, market = HEADER.unpack_from(self.map, 0)
+        if (magic != MAGIC or HEADER.size + length > self.size):
+            return None
+        body = self.map[HEADER.size:HEADER.size + length]
+        if (zlib.crc32(body) != crc):
+            self.logger.warning("Ignoring damaged order snapshot %s", self.path)
+            return None
+        if (market.rstrip(b"\0").decode() != self.market):
+            return None
+
+        sides = []
+        offset = 0
+        for _ in range(2):
+            top_order, max_orders, count, top_price, tick_jump = SIDE_HEADER.unpack_from(body, offset)
+            offset += SIDE_HEADER.size
+            orders = []
+            for _ in range(count):
+                index, clordid, state, cancel, price, amount_left, total_amount = ORDER.unpack_from(body, offset)
+                offset += ORDER.size
+                orders.append((index, clordid, state, cancel, unpack_decimal(price),
+                               unpack_decimal(amount_left), unpack_decimal(total_amount)))
+            sides.append({'top_order': top_order, 'top_price': unpack_decimal(top_price),
+                          'max_orders': max_orders, 'tick_jump': unpack_decimal(tick_jump), 'orders': orders})
+        return {'bids': sides[0], 'asks': sides[1]}
+
+    def encode(self, mmaker):
+        parts = []
+        for side in (mmaker.bids, mmaker.asks):
+            live = [(index, order) for index, order in enumerate(side.orders) if order.clordid is not None]
+            parts.append(SIDE_HEADER.pack(side.top_order, side.max_orders, len(live),
+                                          pack_decimal(side.top_price), pack_decimal(side.tick_jump)))
+            for index, order in live:
+                parts.append(ORDER.pack(index, order.clordid, order.state.value, order.cancel.value,
+                                        pack_decimal(order.price), pack_decimal(order.amount_left),
+                                        pack_decimal(order.total_amount)))
+        return b"".join(parts)
+
+    def save(self, mmaker):
+        """Writes the rings of `mmaker` if they changed since the last save."""
+        try:
+            body = self.encode(mmaker)
+        except ValueError as e:
+            self.logger.warning("Order snapshot not saved: %s", e)
+            return False
+        if (body == self.last_body):
+            return False
+        size = HEADER.size + len(body)
+        if (size > self.size):
+            self.remap(max(size, snapshot_size(max(mmaker.bids.max_orders, mmaker.asks.max_orders))))
+        self.map[HEADER.size:size] = body
+        self.map[0:HEADER.size] = HEADER.pack(MAGIC, zlib.crc32(body), len(body), self.market.encode())
+        self.last_body = body
+        self.writes += 1
+        return True
+
+    def close(self):
+        if (self.map is not None):
+            self.map.flush()
+            self.map.close()
+            self.map = None
+        os.close(self.fd)
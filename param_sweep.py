@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""Parallel parameter sweep of bot2 over config.json market_settings
+
+Runs one backtest (backtest.py) per point of a grid of market_settings
+overrides and ranks the results:
+
+    $ python3 param_sweep.py --market BTC BTCUSDT-trades-2024-06-01.csv \\
+          --grid spread_bps=0.2,0.3,0.5 --grid max_diff=0.002,0.004 \\
+          --grid liquidity_curve_hysteresis_low=0.85,0.9,0.95 \\
+          --rank pnl --rank=-max_abs_position --output sweep.csv
+
+Grid values are given as they would be written in config.json and go
+through bot2's own `parse_market_settings`, so a point that runs here runs
+live the same way.
+
+The trades are decoded once into a flat binary file of fixed-size records
+(see TRADE_RECORD). Workers memory-map that file read-only, so every
+process shares the same page cache pages instead of parsing or pickling
+its own copy, and points are handed out one at a time to keep all cores
+busy until the end of the sweep.
+
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import logging
+import mmap
+import multiprocessing
+import os
+import struct
+import sys
+import tempfile
+import time
+
+from backtest import read_trades, run_backtest
+
+
+# time, price, qty, is_buyer_maker
+TRADE_RECORD = struct.Struct("<dddB")
+TRADES_MAGIC = b"TSTRADE1"
+
+
+# Shared market data
+
+def pack_trades(trades, path):
+    """Writes (time, price, qty, is_buyer_maker) tuples to `path`, returns the count."""
+    count = 0
+    with open(path, "wb") as f:
+        f.write(TRADES_MAGIC)
+        for timestamp, price, qty, is_buyer_maker in trades:
+            f.write(TRADE_RECORD.pack(timestamp, price, qty, is_buyer_maker))
+            count += 1
+    return count
+
+
+class MappedTrades:
+    """Read-only memory map of a file written by pack_trades, iterable any number of times."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if (self.map[:len(TRADES_MAGIC)] != TRADES_MAGIC):
+            raise ValueError("%s is not a packed trades file" % path)
+        self.count = (len(self.map) - len(TRADES_MAGIC)) // TRADE_RECORD.size
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        view = memoryview(self.map)[len(TRADES_MAGIC):len(TRADES_MAGIC) + self.count * TRADE_RECORD.size]
+        for timestamp, price, qty, is_buyer_maker in TRADE_RECORD.iter_unpack(view):
+            yield timestamp, price, qty, bool(is_buyer_maker)
+
+
+# Grid
+
+def parse_grid(specs):
+    """
+    Parses ['key=v1,v2', ...] into an ordered list of (key, [values]).
+
+    Values are kept as strings, the way config.json stores them.
+    """
+    grid = []
+    for spec in specs:
+        key, values = spec.split("=", 1)
+        grid.append((key.strip(), [value.strip() for value in values.split(",") if value.strip()]))
+    return grid
+
+
+def grid_points(grid):
+    keys = [key for key, _ in grid]
+    for values in itertools.product(*[values for _, values in grid]):
+        yield dict(zip(keys, values))
+
+
+def parse_rank(specs):
+    """'-name' minimizes a metric, 'name' maximizes it."""
+    return [(spec[1:], False) if spec.startswith("-") else (spec, True) for spec in specs]
+
+
+def rank_results(results, rank):
+    ok = [result for result in results if "error" not in result]
+    for metric, descending in reversed(rank):
+        ok.sort(key=lambda result: result[metric], reverse=descending)
+    return ok + [result for result in results if "error" in result]
+
+
+# Workers
+
+_worker = {}
+
+
+def init_worker(trades_path, config_path, market, options):
+    # Only errors from the bots, thousands of runs would flood the terminal otherwise
+    logging.basicConfig(level=logging.ERROR)
+    logging.getLogger().setLevel(logging.ERROR)
+    with open(config_path) as f:
+        config = json.load(f)
+    _worker["trades"] = MappedTrades(trades_path)
+    _worker["market_settings"] = config.get('market_settings', {}).get(market)
+    _worker["config_path"] = config_path
+    _worker["market"] = market
+    _worker["options"] = options
+
+
+def run_point(point):
+    import bot2
+
+    result = dict(point)
+    start = time.perf_counter()
+    try:
+        settings = dict(_worker["market_settings"])
+        settings.update(point)
+        params = bot2.parse_market_settings(settings)
+        backtest = run_backtest(iter(_worker["trades"]), market=_worker["market"],
+                                config_path=_worker["config_path"], params=params, **_worker["options"])
+        result.update(backtest.report())
+    except (Exception, SystemExit) as e:
+        # bot2 exits on overfill and invalid settings, that must not kill the pool worker
+        result["error"] = "%s: %s" % (type(e).__name__, e)
+    result["wall_seconds"] = time.perf_counter() - start
+    return result
+
+
+def run_sweep(trades_path, grid, *, market, config_path="config.json", processes=None, options=None,
+              logger=logging.getLogger()):
+    """
+    Runs every grid point over the packed trades in `trades_path` and returns the results.
+
+    Args:
+        grid (list): (key, [values]) pairs from parse_grid.
+        processes (int, optional): Worker processes (default: all cores).
+        options (dict, optional): Extra keyword arguments for run_backtest.
+    """
+    points = list(grid_points(grid))
+    processes = min(processes or os.cpu_count() or 1, len(points)) or 1
+    initargs = (trades_path, config_path, market, dict(options or {}))
+
+    results = []
+    start = time.perf_counter()
+    with multiprocessing.Pool(processes, initializer=init_worker, initargs=initargs) as pool:
+        for result in pool.imap_unordered(run_point, points, chunksize=1):
+            results.append(result)
+            logger.info("%d/%d points done (%.1fs)", len(results), len(points), time.perf_counter() - start)
+    return results
+
+
+def write_results(results, path, columns):
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(results)
+
+
+def print_table(results, columns, top):
+    def cell(value):
+        if (isinstance(value, float)):
+            return "%.6g" % value
+        return str(value)
+
+    rows = [[cell(result.get(column, "")) for column in columns] for result in results[:top]]
+    widths = [max([len(column)] + [len(row[i]) for row in rows]) for i, column in enumerate(columns)]
+    print("  ".join(column.rjust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(value.rjust(width) for value, width in zip(row, widths)))
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Sweep bot2 market_settings over a grid of backtests.')
+    parser.add_argument('trades', nargs='+',
+                        help='Binance trade/aggTrade CSV files or feed_recorder captures')
+    parser.add_argument('--market', dest='market', default="BTC",
+                        help='market from config.json (default: BTC)')
+    parser.add_argument('--config', dest='config', default="config.json",
+                        help='config file with the base market_settings (default: config.json)')
+    parser.add_argument('--grid', dest='grid', action='append', default=[],
+                        help='market_settings key and values, e.g. spread_bps=0.2,0.3,0.5 (repeatable)')
+    parser.add_argument('--rank', dest='rank', action='append', default=[],
+                        help='metric to rank by, --rank=-metric to minimize (repeatable, default: pnl)')
+    parser.add_argument('--processes', dest='processes', type=int, default=None,
+                        help='worker processes (default: all cores)')
+    parser.add_argument('--output', dest='output', default=None,
+                        help='write all results to this CSV file')
+    parser.add_argument('--top', dest='top', type=int, default=20,
+                        help='rows of the ranked table to print (default: 20)')
+    parser.add_argument('--auction_ms', dest='auction_ms', type=float, default=100.0,
+                        help='auction period in milliseconds (default: 100)')
+    parser.add_argument('--latency_ms', dest='latency_ms', type=float, default=20.0,
+                        help='one-way latency in milliseconds (default: 20)')
+    parser.add_argument('--maker_fee', dest='maker_fee', default="0",
+                        help='maker fee rate, negative for rebates (default: 0)')
+    parser.add_argument('--queue_ahead', dest='queue_ahead', type=float, default=0.0,
+                        help='volume queued ahead of each new order (default: 0)')
+    parser.add_argument('--flow_fraction', dest='flow_fraction', type=float, default=1.0,
+                        help='fraction of external volume assumed to reach TickSpread (default: 1)')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)-8s %(message)s')
+
+    grid = parse_grid(args.grid)
+    if (not grid):
+        print("Nothing to sweep, pass at least one --grid")
+        return 1
+    rank = parse_rank(args.rank or ["pnl"])
+
+    with tempfile.TemporaryDirectory(prefix="sweep-") as directory:
+        trades_path = os.path.join(directory, "trades.bin")
+        count = pack_trades(read_trades(args.trades), trades_path)
+        logging.info("Packed %d trades, sweeping %d points", count,
+                     len(list(grid_points(grid))))
+
+        start = time.perf_counter()
+        results = run_sweep(trades_path, grid, market=args.market, config_path=args.config,
+                            processes=args.processes,
+                            options={'auction_interval': args.auction_ms / 1000.0,
+                                     'latency': args.latency_ms / 1000.0,
+                                     'maker_fee': args.maker_fee, 'queue_ahead': args.queue_ahead,
+                                     'flow_fraction': args.flow_fraction})
+        elapsed = time.perf_counter() - start
+
+    results = rank_results(results, rank)
+    keys = [key for key, _ in grid]
+    metrics = [metric for metric, _ in rank]
+    columns = keys + metrics + [column for column in ("pnl", "fees_paid", "max_abs_position", "fill_rate",
+                                                      "order_churn_per_hour", "wall_seconds")
+                                if column not in metrics]
+
+    print_table(results, columns, args.top)
+    failed = [result for result in results if "error" in result]
+    for result in failed:
+        print("failed %s: %s" % ({key: result[key] for key in keys}, result["error"]))
+    print("%d points in %.1fs (%.1fs of backtests)" % (len(results), elapsed,
+                                                      sum(result["wall_seconds"] for result in results)))
+
+    if (args.output):
+        all_columns = list(keys)
+        for result in results:
+            all_columns += [column for column in result if column not in all_columns]
+        write_results(results, args.output, all_columns)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""Shared-memory price bus
+
+One writer process (the feed ingest of supervisor.py) publishes external
+price ticks into a ring in a `multiprocessing.shared_memory` block; any
+number of bot processes read it by polling memory, without a socket or
+any other syscall on the read path.
+
+Layout of the block:
+
+    header      magic, capacity, slot count, write count (8-byte aligned)
+    slot table  JSON list of [venue, symbol], one per slot, padded
+    ring        `capacity` entries of sequence number + ENTRY_BODY
+
+Every entry is a seqlock: the writer stores an odd sequence number, then the
+tick, then the even sequence number 2 * (index + 1), and only then
+increments the write count. A reader accepts entry `index` only if it sees
+that same even sequence number before and after copying the tick, so torn
+or lapped entries are detected and skipped. The ordering relies on the
+stores of the writer becoming visible in program order, as on x86-64.
+
+Readers only care about the latest price, so each poll delivers at most
+one tick per slot and a reader that falls more than `capacity` ticks behind
+jumps to the newest entries.
+
+"""
+
+import asyncio
+import json
+import logging
+import struct
+import time
+from multiprocessing import shared_memory
+
+from feed_hub import Subscriber
+
+
+HEADER = struct.Struct("<8sIIQ")
+WRITE_COUNT_OFFSET = 16
+SLOT_TABLE_BYTES = 4096
+# seq, then the body: slot, price, qty, exchange time (s), receive time (s)
+SEQ = struct.Struct("<Q")
+ENTRY_BODY = struct.Struct("<I4xdddd")
+ENTRY_SIZE = SEQ.size + ENTRY_BODY.size
+MAGIC = b"TSPRICE1"
+
+
+def bus_size(capacity):
+    return HEADER.size + SLOT_TABLE_BYTES + capacity * ENTRY_SIZE
+
+
+def attach_shared_memory(name):
+    """Attaches to an existing block without letting this process' resource tracker unlink it at exit."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 always tracks, undo it
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, "shared_memory")
+        except Exception:
+            pass
+        return shm
+
+
+class PriceBusWriter:
+    def __init__(self, name, slots, capacity=4096, create=True):
+        """
+        Args:
+            name (str): Shared memory block name.
+            slots (list): (venue, symbol) pairs, the index is the slot number.
+            capacity (int): Ring entries.
+            create (bool): Create the block, or reuse one the supervisor created.
+        """
+        table = json.dumps([list(slot) for slot in slots]).encode()
+        if (len(table) > SLOT_TABLE_BYTES):
+            raise ValueError("Too many price bus slots")
+
+        self.slots = {tuple(slot): index for index, slot in enumerate(slots)}
+        self.capacity = capacity
+        if (create):
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=bus_size(capacity))
+            self.buf = self.shm.buf
+            self.write_count = 0
+        else:
+            # A restarted writer continues the sequence the readers are following
+            self.shm = attach_shared_memory(name)
+            self.buf = self.shm.buf
+            self.write_count = SEQ.unpack_from(self.buf, WRITE_COUNT_OFFSET)[0]
+
+        self.buf[HEADER.size:HEADER.size + SLOT_TABLE_BYTES] = table.ljust(SLOT_TABLE_BYTES, b"\0")
+        HEADER.pack_into(self.buf, 0, MAGIC, capacity, len(slots), self.write_count)
+
+    def publish(self, slot, price, qty=0.0, exchange_time=0.0, recv_time=None):
+        index = self.write_count
+        offset = HEADER.size + SLOT_TABLE_BYTES + (index % self.capacity) * ENTRY_SIZE
+        SEQ.pack_into(self.buf, offset, 2 * index + 1)
+        ENTRY_BODY.pack_into(self.buf, offset + SEQ.size, slot, price, qty, exchange_time,
+                             time.time() if recv_time is None else recv_time)
+        SEQ.pack_into(self.buf, offset, 2 * (index + 1))
+        self.write_count = index + 1
+        SEQ.pack_into(self.buf, WRITE_COUNT_OFFSET, self.write_count)
+
+    def callback_for(self, venue, symbol):
+        """Returns a `callback(source, tick)` publishing normalized feed_hub ticks into the slot of (venue, symbol)."""
+        slot = self.slots[(venue, symbol)]
+
+        def callback(source, tick):
+            exchange_time = (tick.get("T") or 0) / 1000.0
+            self.publish(slot, float(tick["p"]), float(tick.get("q") or 0.0), exchange_time)
+            return 0
+        return callback
+
+    def close(self, unlink=True):
+        self.buf = None
+        self.shm.close()
+        if (unlink):
+            self.shm.unlink()
+
+
+class PriceBusReader:
+    """
+    Polls a price bus. Has the same subscribe() interface as FeedHub, and
+    delivers ticks shaped like feed_hub.normalize_tick's.
+    """
+
+    def __init__(self, name, logger=logging.getLogger(), poll_interval=0.001):
+        self.name = name
+        self.logger = logger
+        self.poll_interval = poll_interval
+        self.shm = attach_shared_memory(name)
+        self.buf = self.shm.buf
+
+        magic, self.capacity, slot_count, write_count = HEADER.unpack_from(self.buf, 0)
+        if (magic != MAGIC):
+            raise ValueError("%s is not a price bus" % name)
+        table = bytes(self.buf[HEADER.size:HEADER.size + SLOT_TABLE_BYTES]).rstrip(b"\0")
+        self.slot_keys = [tuple(slot) for slot in json.loads(table)][:slot_count]
+        self.slots = {key: index for index, key in enumerate(self.slot_keys)}
+        self.subscribers = {}		# slot -> [Subscriber]
+
+        # Start from the newest entries, like a fresh websocket subscription
+        self.read_count = write_count
+        self.torn = 0
+        self.lapped = 0
+
+    def subscribe(self, venue, symbol, callback, name=None):
+        slot = self.slots.get((venue, symbol))
+        if (slot is None):
+            raise KeyError("%s %s is not published on price bus %s" % (venue, symbol, self.name))
+        subscriber = Subscriber(name or "%s:%s" % (venue, symbol), venue, symbol, callback)
+        self.subscribers.setdefault(slot, []).append(subscriber)
+        return subscriber
+
+    def read_entry(self, index):
+        offset = HEADER.size + SLOT_TABLE_BYTES + (index % self.capacity) * ENTRY_SIZE
+        expected = 2 * (index + 1)
+        if (SEQ.unpack_from(self.buf, offset)[0] != expected):
+            return None
+        entry = ENTRY_BODY.unpack_from(self.buf, offset + SEQ.size)
+        if (SEQ.unpack_from(self.buf, offset)[0] != expected):
+            return None
+        return entry
+
+    def poll(self):
+        """Delivers the latest new tick of every subscribed slot, returns the number delivered."""
+        write_count = SEQ.unpack_from(self.buf, WRITE_COUNT_OFFSET)[0]
+        if (write_count == self.read_count):
+            return 0
+        if (write_count < self.read_count):
+            # The bus was recreated
+            self.read_count = 0
+        if (write_count - self.read_count > self.capacity):
+            self.lapped += write_count - self.read_count - self.capacity
+            self.read_count = write_count - self.capacity
+
+        latest = {}
+        for index in range(self.read_count, write_count):
+            entry = self.read_entry(index)
+            if (entry is None):
+                self.torn += 1
+                continue
+            if (entry[0] in self.subscribers):
+                latest[entry[0]] = entry
+        self.read_count = write_count
+
+        for slot, (_, price, qty, exchange_time, recv_time) in latest.items():
+            venue, symbol = self.slot_keys[slot]
+            tick = {"s": symbol, "p": repr(price), "q": repr(qty), "T": int(exchange_time * 1000)}
+            for subscriber in self.subscribers[slot]:
+                subscriber.deliver(venue, tick, recv_time)
+        return len(latest)
+
+    async def connect(self):
+        asyncio.get_event_loop().create_task(self.loop())
+
+    async def loop(self):
+        while True:
+            try:
+                self.poll()
+            except Exception as e:
+                self.logger.error("Price bus callback failed: %s", e)
+            await asyncio.sleep(self.poll_interval)
+
+    def stats(self):
+        return [subscriber.stats() for subscribers in self.subscribers.values() for subscriber in subscribers]
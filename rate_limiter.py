@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""Client-side rate limiting of order operations
+
+The exchange throttles an account by order operations per second, and
+every HTTP request counts against its endpoint. RateLimiter keeps token
+buckets for both on our side, so bursts are shaped here instead of being
+refused with 429s:
+
+    - the account bucket counts operations; creates may not take the last
+      `cancel_reserve` of it, so cancels can always go out
+    - cancels are never refused, they run the bucket into debt instead and
+      the creates wait until it is paid back
+    - one bucket per endpoint counts requests; a request over budget waits
+      for its token
+
+create_budget() tells the quoting layer how many creates it may still
+send, so the ladder is refreshed from the touch outward when it is short.
+
+"""
+
+import time
+
+
+class TokenBucket:
+    def __init__(self, rate, burst=None, clock=time.monotonic):
+        """
+        Args:
+            rate (float): Tokens added per second.
+            burst (float, optional): Capacity, defaults to one second of tokens.
+            clock (callable): Time source in seconds.
+        """
+        self.rate = rate
+        self.burst = max(burst if burst is not None else rate, 1)
+        self.tokens = self.burst
+        self.clock = clock
+        self.last = clock()
+
+    def refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        return self.tokens
+
+    def take(self, n=1, floor=0):
+        """Takes `n` tokens if `floor` are left afterwards; floor=None may run into debt."""
+        tokens = self.refill()
+        if (floor is not None and tokens - n < floor):
+            return False
+        self.tokens = tokens - n
+        return True
+
+    def delay(self, n=1, floor=0):
+        """Seconds until take(n, floor) succeeds."""
+        missing = n + floor - self.refill()
+        return max(missing, 0) / self.rate
+
+
+class RateLimiter:
+    def __init__(self, *, operations_per_second, requests_per_second=0, cancel_reserve=0.2,
+                 burst_seconds=1.0, clock=time.monotonic):
+        """
+        Args:
+            operations_per_second (float): Order operations per second of the account, 0 for no limit.
+            requests_per_second (float): Requests per second of each endpoint, 0 for no limit.
+            cancel_reserve (float): Share of the account bucket only cancels may use.
+            burst_seconds (float): Seconds of budget that may be spent at once.
+        """
+        self.account = None
+        self.reserve = 0
+        if (operations_per_second):
+            self.account = TokenBucket(operations_per_second, operations_per_second * burst_seconds, clock)
+            self.reserve = self.account.burst * cancel_reserve
+        self.requests_per_second = requests_per_second
+        self.burst_seconds = burst_seconds
+        self.clock = clock
+        self.endpoints = {}			# endpoint -> TokenBucket
+
+        self.creates_refused = 0
+        self.cancels_in_debt = 0
+        self.requests_delayed = 0
+
+    def take_create(self):
+        if (self.account is None or self.account.take(1, floor=self.reserve)):
+            return True
+        self.creates_refused += 1
+        return False
+
+    def take_cancel(self):
+        if (self.account is not None and not self.account.take(1)):
+            self.cancels_in_debt += 1
+            self.account.take(1, floor=None)
+
+    def create_budget(self):
+        """Creates that take_create would accept right now, None without an account limit."""
+        if (self.account is None):
+            return None
+        return max(int(self.account.refill() - self.reserve), 0)
+
+    def take_request(self, endpoint):
+        """Takes a request token of `endpoint`; returns 0, or the seconds to wait before trying again."""
+        if (not self.requests_per_second):
+            return 0
+        bucket = self.endpoints.get(endpoint)
+        if (bucket is None):
+            bucket = TokenBucket(self.requests_per_second, self.requests_per_second * self.burst_seconds, self.clock)
+            self.endpoints[endpoint] = bucket
+        if (bucket.take(1)):
+            return 0
+        self.requests_delayed += 1
+        return bucket.delay(1)
+
+    def stats(self):
+        return {
+            "tokens": round(self.account.refill(), 2) if self.account else None,
+            "creates_refused": self.creates_refused,
+            "cancels_in_debt": self.cancels_in_debt,
+            "requests_delayed": self.requests_delayed,
+        }
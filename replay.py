@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+"""Deterministic replay of recorded feeds
+
+Reads captures written by feed_recorder.py (TickSpread websocket frames and
+external price feeds), merges them by receive time and feeds them into
+`MarketMaker.callback(source, raw_data)` of bot.py, bot2.py or amm.py.
+
+The bot runs against a ReplayClock that replaces `time.time()` inside the
+bot module, and against a ReplayAPI that captures every operation instead
+of sending it. Replays run as fast as possible by default, or paced at a
+speed multiplier of the recorded timing.
+
+Example:
+    To replay an ETH capture through bot2 and store the operations::
+
+        $ python3 replay.py --bot bot2 --market ETH --output ops.jsonl captures/ETH-*.frames.zst
+
+"""
+
+import argparse
+import heapq
+import importlib
+import json
+import logging
+import sys
+import time
+from decimal import Decimal, InvalidOperation
+
+from feed_recorder import read_frames
+from tickspread_api import TickSpreadAPI
+
+
+class ReplayClock:
+    """Injected clock: `time()` returns the receive time of the frame being replayed."""
+
+    def __init__(self, start=0.0):
+        self.now = start
+
+    def time(self):
+        return self.now
+
+    def time_ns(self):
+        return int(self.now * 1e9)
+
+    def sleep(self, seconds):
+        # Sleeping inside a replayed callback only moves the virtual clock
+        self.now += seconds
+
+    def advance_to(self, timestamp):
+        if (timestamp > self.now):
+            self.now = timestamp
+
+
+class ClockedTimeModule:
+    """Stands in for the `time` module of a bot, redirecting the clock functions."""
+
+    def __init__(self, clock):
+        self.clock = clock
+
+    def time(self):
+        return self.clock.time()
+
+    def time_ns(self):
+        return self.clock.time_ns()
+
+    def sleep(self, seconds):
+        self.clock.sleep(seconds)
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+class ReplayAPI(TickSpreadAPI):
+    """
+    TickSpreadAPI that never touches the network.
+
+    Every order operation is captured in `operations_log` as
+    (time, operation), every dispatched batch in `batches` and every
+    subscription made after the start in `subscriptions`.
+    """
+
+    def __init__(self, clock, logger=logging.getLogger(), id_multiple=1000):
+        super().__init__(logger=logger, id_multiple=id_multiple, env="dev")
+        self.clock = clock
+        self.next_id = int(clock.time() * id_multiple)
+        self.token = "replay"
+        self.operations_log = []
+        self.batches = []
+        self.subscriptions = []
+
+    def create_order_sync(self, client_order_id, amount, price, leverage, symbol, side, type, sweeper):
+        order = TickSpreadAPI.mount_create_order(client_order_id, amount, price, leverage, symbol, side, type, sweeper)
+        order["operation"] = "create"
+        self.operations_log.append((self.clock.time(), order))
+        return client_order_id
+
+    def delete_order_sync(self, client_order_id, symbol):
+        order = TickSpreadAPI.mount_delete_order(client_order_id, symbol)
+        order["operation"] = "delete"
+        self.operations_log.append((self.clock.time(), order))
+        return order
+
+    def create_order(self, **kwargs):
+        kwargs['asynchronous'] = False
+        return super().create_order(**kwargs)
+
+    def delete_order(self, client_order_id, symbol="ETH", asynchronous=False, batch=False):
+        return super().delete_order(client_order_id, symbol=symbol, asynchronous=False, batch=batch)
+
+    def dispatch_batch(self):
+        if self.operations:
+            self.send_batch(self.operations)
+            self.operations = []
+
+    def send_batch(self, operations):
+        now = self.clock.time()
+        self.batches.append((now, operations))
+        for operation in operations:
+            self.operations_log.append((now, operation))
+
+    async def subscribe(self, topic, arguments):
+        self.subscriptions.append((self.clock.time(), topic, arguments))
+
+    def update_margin_sync(self, market, amount):
+        self.operations_log.append((self.clock.time(), {"operation": "margin", "market": market, "amount": amount}))
+        return {"market": market, "amount": amount}
+
+    def update_margin(self, market, amount, asynchronous=False):
+        return self.update_margin_sync(market, amount)
+
+
+def merge_captures(paths):
+    """Merges several capture files into one stream ordered by monotonic receive time."""
+    return heapq.merge(*[read_frames(path) for path in sorted(paths)], key=lambda frame: frame[0])
+
+
+class Replayer:
+    def __init__(self, paths, *, clock, speed=0.0, sources=None, logger=logging.getLogger()):
+        """
+        Args:
+            paths (list): Capture files to replay.
+            clock (ReplayClock): Clock advanced to each frame's wall-clock receive time.
+            speed (float): 0 replays as fast as possible, otherwise a multiplier of the recorded pace.
+            sources (set, optional): Only replay frames from these sources.
+        """
+        self.paths = paths
+        self.clock = clock
+        self.speed = speed
+        self.sources = sources
+        self.logger = logger
+
+        self.frames = 0
+        self.frames_by_source = {}
+        self.callback_seconds = 0.0
+
+    def pace(self, monotonic_ns, first_monotonic_ns, real_start):
+        target = (monotonic_ns - first_monotonic_ns) / 1e9 / self.speed
+        delay = target - (time.perf_counter() - real_start)
+        if (delay > 0):
+            time.sleep(delay)
+
+    def run(self, callback, *, limit=None):
+        first_monotonic_ns = None
+        real_start = time.perf_counter()
+
+        for monotonic_ns, wall_ns, source, payload in merge_captures(self.paths):
+            if (self.sources and source not in self.sources):
+                continue
+            if (first_monotonic_ns is None):
+                first_monotonic_ns = monotonic_ns
+            if (self.speed > 0):
+                self.pace(monotonic_ns, first_monotonic_ns, real_start)
+
+            self.clock.advance_to(wall_ns / 1e9)
+
+            start = time.perf_counter()
+            rc = callback(source, payload)
+            self.callback_seconds += time.perf_counter() - start
+
+            self.frames += 1
+            self.frames_by_source[source] = self.frames_by_source.get(source, 0) + 1
+            if (rc):
+                self.logger.warning("Callback returned %s at frame %d, stopping replay", rc, self.frames)
+                break
+            if (limit and self.frames >= limit):
+                break
+        return self.frames
+
+
+def load_bot_module(name, argv=None, clock=None):
+    """
+    Imports one of the bot modules and injects the replay clock into it.
+
+    bot.py and amm.py parse the command line at import time, so their
+    arguments are passed in `argv`.
+    """
+    saved_argv = sys.argv
+    sys.argv = [name + ".py"] + (argv or [])
+    try:
+        module = importlib.import_module(name)
+    finally:
+        sys.argv = saved_argv
+    if (clock):
+        module.time = ClockedTimeModule(clock)
+    return module
+
+
+def build_market_maker(name, api, *, market=None, money_asset="USD", config_path="config.json", params=None, logger=logging.getLogger()):
+    """
+    Instantiates the MarketMaker of bot.py, bot2.py or amm.py the way their main() does.
+
+    Args:
+        name (str): 'bot', 'bot2' or 'amm'; the module must already be loaded.
+        market (str): bot2's market in config.json; bot.py and amm.py use their own command line.
+        params (dict, optional): Extra keyword arguments overriding the defaults.
+    """
+    module = sys.modules[name]
+    params = dict(params or {})
+
+    if (name == "bot2"):
+        with open(config_path) as f:
+            config = json.load(f)
+        market_settings = config.get('market_settings', {}).get(market)
+        if (not market_settings):
+            raise KeyError("Market settings for '%s' not found in %s" % (market, config_path))
+        mmaker_params = module.market_maker_params(market, market_settings)
+        mmaker_params.update(params)
+        return module.MarketMaker(api, market, money_asset, logger=logger, **mmaker_params)
+    elif (name == "amm"):
+        args = module.args
+        mmaker_params = {'tick_jump': args.tick_jump, 'orders_per_side': 10, 'order_size': 10.0,
+                         'max_position': args.max_position, 'max_price': args.max_price,
+                         'amount_precision': args.amount_precision, 'liquidity': args.liquidity}
+        mmaker_params.update(params)
+        return module.MarketMaker(api, logger=logger, **mmaker_params)
+    else:
+        # bot.py's market is the --market of its own command line (--bot_args)
+        mmaker_params = module.market_maker_params(module.args.market)
+        mmaker_params.update(params)
+        return module.MarketMaker(api, logger=logger, **mmaker_params)
+
+
+def parse_param(text):
+    """Parses a 'key=value' override, keeping numbers exact (int or Decimal)."""
+    key, value = text.split("=", 1)
+    try:
+        return key, int(value)
+    except ValueError:
+        pass
+    try:
+        return key, Decimal(value)
+    except InvalidOperation:
+        return key, value
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Replay recorded feeds into a market maker bot.')
+    parser.add_argument('captures', nargs='+',
+                        help='capture files written by feed_recorder.py')
+    parser.add_argument('--bot', dest='bot', default="bot2", choices=["bot", "bot2", "amm"],
+                        help='bot module to drive (default: bot2)')
+    parser.add_argument('--bot_args', dest='bot_args', default="",
+                        help='command line for bot.py/amm.py, which parse it at import time')
+    parser.add_argument('--market', dest='market', default="ETH",
+                        help='market from config.json to run bot2 on (default: ETH)')
+    parser.add_argument('--money_asset', dest='money_asset', default="USD",
+                        help='set the money asset (default: USD)')
+    parser.add_argument('--param', dest='params', action='append', default=[],
+                        help='override a MarketMaker keyword argument, e.g. --param spread_bps=0.4')
+    parser.add_argument('--speed', dest='speed', type=float, default=0.0,
+                        help='pace multiplier of the recorded timing, 0 = as fast as possible (default: 0)')
+    parser.add_argument('--limit', dest='limit', type=int, default=None,
+                        help='stop after this many frames')
+    parser.add_argument('--output', dest='output', default=None,
+                        help='write the captured operations as JSON lines to this file')
+    parser.add_argument('--log_level', dest='log_level', default="WARNING",
+                        help='set the logging level (default: WARNING)')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    logging.basicConfig(level=getattr(logging, args.log_level.upper()),
+                        format='%(asctime)s %(levelname)-8s %(message)s')
+
+    # Start the clock at the first recorded frame so client order ids look like production ones
+    first_frame = next(iter(merge_captures(args.captures)), None)
+    if (first_frame is None):
+        print("No frames found")
+        return 1
+    clock = ReplayClock(first_frame[1] / 1e9)
+
+    load_bot_module(args.bot, args.bot_args.split(), clock=clock)
+    api = ReplayAPI(clock)
+    params = dict(parse_param(param) for param in args.params)
+    mmaker = build_market_maker(args.bot, api, market=args.market, money_asset=args.money_asset, params=params)
+
+    replayer = Replayer(args.captures, clock=clock, speed=args.speed)
+    start = time.perf_counter()
+    replayer.run(mmaker.callback, limit=args.limit)
+    elapsed = time.perf_counter() - start
+
+    print("Replayed %d frames in %.2fs (%.0f frames/s, %.2fs in callbacks)" %
+          (replayer.frames, elapsed, replayer.frames / elapsed if elapsed else 0, replayer.callback_seconds))
+    for source, count in sorted(replayer.frames_by_source.items()):
+        print("  %-12s %d" % (source, count))
+    print("Captured %d operations in %d batches" % (len(api.operations_log), len(api.batches)))
+
+    if (args.output):
+        with open(args.output, "w") as f:
+            for timestamp, operation in api.operations_log:
+                f.write(json.dumps({"time": timestamp, "operation": operation}, default=str) + "\n")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,447 @@
+# -*- coding: utf-8 -*-
+"""Account-wide risk aggregation
+
+Every MarketMaker limits its own position through the available limits of
+its sides; RiskEngine watches the whole account across markets. It is fed
+the position, balance, trade and mark price updates of every market and
+keeps the account totals incrementally (each update replaces the market's
+previous contribution), so one event costs O(1):
+
+    gross notional   sum of |position| * mark price
+    margin usage     sum of position margin / account equity
+    PnL              realized (average cost) - fees + unrealized
+
+Each total is compared with its limit in config.json's "risk" section and
+the worst ratio selects a throttle level that is pushed to every registered
+MarketMaker:
+
+    NORMAL   quote as configured
+    REDUCE   ladder depth (max_liquidity) scaled by reduce_size_factor
+    WIDEN    reduced and spread scaled by widen_spread_factor
+    PULL     cancel every order and stop quoting
+
+A level is left only once the ratio falls `hysteresis` below its threshold.
+The limits are optional, an absent one is not checked:
+
+    "risk": {
+        "max_notional": "500000",
+        "max_margin_usage": "0.5",
+        "max_loss": "2000",
+        "reduce_at": "0.7", "widen_at": "0.85", "pull_at": "1.0"
+    }
+
+In multi-market mode the engine runs inside bot2. Separate bot processes
+share one engine through its unix socket with RiskClient; the wire protocol
+is JSON lines:
+
+    client -> server    {"call": "update_mark", "args": ["BTC", "64000.5"]}
+    server -> client    {"level": "REDUCE", "ratio": "0.74",
+                         "size_factor": "0.5", "spread_multiplier": "1", "pull": false}
+
+The server sends the throttle of the level, so the factors of its "risk"
+section apply to every client.
+
+Example:
+    To run a shared risk engine for several bot2 processes::
+
+        $ python3 risk.py --socket /tmp/tickspread-risk.sock
+        $ python3 bot2.py --market BTC --risk_socket /tmp/tickspread-risk.sock
+
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+from decimal import Decimal
+from enum import Enum
+
+
+class RiskLevel(Enum):
+    NORMAL = 0
+    REDUCE = 1
+    WIDEN = 2
+    PULL = 3
+
+
+class Throttle:
+    def __init__(self, size_factor=Decimal(1), spread_multiplier=Decimal(1), pull=False):
+        self.size_factor = Decimal(size_factor)
+        self.spread_multiplier = Decimal(spread_multiplier)
+        self.pull = pull
+
+    def __repr__(self):
+        return "Throttle(size_factor=%s, spread_multiplier=%s, pull=%s)" % (
+            self.size_factor, self.spread_multiplier, self.pull)
+
+
+def optional_decimal(value):
+    return None if value is None else Decimal(str(value))
+
+
+class RiskLimits:
+    def __init__(self, *, max_notional=None, max_margin_usage=None, max_loss=None,
+                 reduce_at="0.7", widen_at="0.85", pull_at="1.0", hysteresis="0.05",
+                 reduce_size_factor="0.5", widen_spread_factor="2.0"):
+        """
+        Args:
+            max_notional: Account gross notional limit, in the money asset.
+            max_margin_usage: Limit of position margin / equity, e.g. 0.5.
+            max_loss: Limit of the loss since start, in the money asset.
+            reduce_at, widen_at, pull_at: Fractions of a limit where the levels start.
+        """
+        self.max_notional = optional_decimal(max_notional)
+        self.max_margin_usage = optional_decimal(max_margin_usage)
+        self.max_loss = optional_decimal(max_loss)
+        self.thresholds = [(RiskLevel.PULL, Decimal(str(pull_at))),
+                           (RiskLevel.WIDEN, Decimal(str(widen_at))),
+                           (RiskLevel.REDUCE, Decimal(str(reduce_at)))]
+        self.hysteresis = Decimal(str(hysteresis))
+        if (not (0 < self.thresholds[2][1] <= self.thresholds[1][1] <= self.thresholds[0][1])):
+            raise ValueError("risk thresholds must satisfy 0 < reduce_at <= widen_at <= pull_at")
+
+        reduce_size_factor = Decimal(str(reduce_size_factor))
+        self.throttles = {
+            RiskLevel.NORMAL: Throttle(),
+            RiskLevel.REDUCE: Throttle(reduce_size_factor),
+            RiskLevel.WIDEN: Throttle(reduce_size_factor, Decimal(str(widen_spread_factor))),
+            RiskLevel.PULL: Throttle(0, 1, pull=True),
+        }
+
+    @classmethod
+    def from_config(cls, risk_config):
+        """Builds the limits from config.json's "risk" section; raises ValueError if it is invalid."""
+        try:
+            return cls(**risk_config)
+        except (TypeError, ArithmeticError) as e:
+            raise ValueError("invalid risk settings (%s)" % e)
+
+    def level_for(self, ratio, current):
+        for level, threshold in self.thresholds:
+            if (ratio >= threshold):
+                break
+            # Stay at the current level until the ratio is clearly below it
+            if (level == current and ratio >= threshold - self.hysteresis):
+                break
+        else:
+            return RiskLevel.NORMAL
+        return level
+
+
+class MarketExposure:
+    def __init__(self):
+        self.amount = Decimal(0)
+        self.entry_price = Decimal(0)
+        self.mark_price = None
+        self.total_margin = Decimal(0)
+        # Contributions to the account totals
+        self.notional = Decimal(0)
+        self.unrealized_pnl = Decimal(0)
+
+    def contributions(self):
+        if (self.mark_price is None):
+            return Decimal(0), Decimal(0)
+        return abs(self.amount) * self.mark_price, self.amount * (self.mark_price - self.entry_price)
+
+
+class RiskEngine:
+    def __init__(self, limits, logger=logging.getLogger()):
+        self.limits = limits
+        self.logger = logger
+        self.exposures = {}		# market -> MarketExposure
+        self.listeners = []		# callback(level, throttle)
+
+        self.gross_notional = Decimal(0)
+        self.margin_used = Decimal(0)
+        self.unrealized_pnl = Decimal(0)
+        self.realized_pnl = Decimal(0)
+        self.fees_paid = Decimal(0)
+        self.balance = None
+
+        self.level = RiskLevel.NORMAL
+        self.ratio = Decimal(0)
+
+    def add_listener(self, callback):
+        """Registers `callback(level, throttle)`; it is called now with the current level and on every change."""
+        self.listeners.append(callback)
+        callback(self.level, self.limits.throttles[self.level])
+
+    def exposure(self, market):
+        exposure = self.exposures.get(market)
+        if (exposure is None):
+            exposure = self.exposures[market] = MarketExposure()
+        return exposure
+
+    def refresh(self, exposure):
+        notional, unrealized_pnl = exposure.contributions()
+        self.gross_notional += notional - exposure.notional
+        self.unrealized_pnl += unrealized_pnl - exposure.unrealized_pnl
+        exposure.notional = notional
+        exposure.unrealized_pnl = unrealized_pnl
+        self.evaluate()
+
+    # Updates, O(1) each
+
+    def update_position(self, market, amount, entry_price, total_margin=None):
+        exposure = self.exposure(market)
+        exposure.amount = Decimal(amount)
+        exposure.entry_price = Decimal(entry_price)
+        if (total_margin is not None):
+            total_margin = Decimal(total_margin)
+            self.margin_used += total_margin - exposure.total_margin
+            exposure.total_margin = total_margin
+        self.refresh(exposure)
+
+    def update_mark(self, market, price):
+        exposure = self.exposure(market)
+        exposure.mark_price = Decimal(price)
+        self.refresh(exposure)
+
+    def update_balance(self, available, frozen):
+        self.balance = Decimal(available) + Decimal(frozen)
+        self.evaluate()
+
+    def record_trade(self, market, side, amount, price, fee=None):
+        """Books a fill with average-cost accounting, ahead of the exchange's position update."""
+        exposure = self.exposure(market)
+        amount = Decimal(amount)
+        price = Decimal(price)
+        position = exposure.amount
+        signed_amount = amount if side == "bid" else -amount
+        new_position = position + signed_amount
+
+        if (position == 0 or (position > 0) == (signed_amount > 0)):
+            exposure.entry_price = (abs(position) * exposure.entry_price + amount * price) / abs(new_position)
+        else:
+            closed = min(amount, abs(position))
+            direction = 1 if position > 0 else -1
+            self.realized_pnl += closed * (price - exposure.entry_price) * direction
+            if (new_position == 0):
+                exposure.entry_price = Decimal(0)
+            elif ((new_position > 0) != (position > 0)):
+                exposure.entry_price = price
+        exposure.amount = new_position
+        if (fee is not None):
+            self.fees_paid += Decimal(fee)
+        self.refresh(exposure)
+
+    # Levels
+
+    def equity(self):
+        if (self.balance is None):
+            return None
+        return self.balance + self.unrealized_pnl
+
+    def ratios(self):
+        limits = self.limits
+        ratios = {}
+        if (limits.max_notional):
+            ratios["notional"] = self.gross_notional / limits.max_notional
+        equity = self.equity()
+        if (limits.max_margin_usage and equity is not None):
+            if (equity > 0):
+                ratios["margin"] = self.margin_used / equity / limits.max_margin_usage
+            else:
+                ratios["margin"] = limits.thresholds[0][1]
+        if (limits.max_loss):
+            loss = self.fees_paid - self.realized_pnl - self.unrealized_pnl
+            ratios["loss"] = loss / limits.max_loss
+        return ratios
+
+    def evaluate(self):
+        ratios = self.ratios()
+        self.ratio = max(ratios.values()) if ratios else Decimal(0)
+        level = self.limits.level_for(self.ratio, self.level)
+        if (level != self.level):
+            self.logger.warning("Risk level %s -> %s (%s)", self.level.name, level.name,
+                                ", ".join("%s=%.3f" % item for item in ratios.items()))
+            self.level = level
+            throttle = self.limits.throttles[level]
+            for callback in self.listeners:
+                callback(level, throttle)
+        return self.level
+
+    def stats(self):
+        return {
+            "level": self.level.name,
+            "ratio": str(self.ratio),
+            "gross_notional": str(self.gross_notional),
+            "margin_used": str(self.margin_used),
+            "equity": None if self.balance is None else str(self.equity()),
+            "realized_pnl": str(self.realized_pnl),
+            "unrealized_pnl": str(self.unrealized_pnl),
+            "fees_paid": str(self.fees_paid),
+            "markets": {market: str(exposure.amount) for market, exposure in self.exposures.items()},
+        }
+
+    # Unix socket server for other processes
+
+    REMOTE_CALLS = ("update_position", "update_mark", "update_balance", "record_trade")
+
+    async def start_server(self, path):
+        if (os.path.exists(path)):
+            os.unlink(path)
+        self.writers = set()
+        self.listeners.append(self.broadcast)
+        self.server = await asyncio.start_unix_server(self.handle_client, path=path)
+        self.logger.info("Risk engine listening on %s", path)
+
+    def level_message(self):
+        throttle = self.limits.throttles[self.level]
+        return (json.dumps({"level": self.level.name, "ratio": str(self.ratio),
+                            "size_factor": str(throttle.size_factor),
+                            "spread_multiplier": str(throttle.spread_multiplier),
+                            "pull": throttle.pull}) + "\n").encode()
+
+    def broadcast(self, level, throttle):
+        message = self.level_message()
+        for writer in self.writers:
+            writer.write(message)
+
+    async def handle_client(self, reader, writer):
+        self.writers.add(writer)
+        writer.write(self.level_message())
+        try:
+            while True:
+                line = await reader.readline()
+                if (not line):
+                    break
+                try:
+                    request = json.loads(line)
+                    call = request["call"]
+                    if (call not in self.REMOTE_CALLS):
+                        raise ValueError("unknown call %r" % call)
+                    getattr(self, call)(*request["args"])
+                except (ValueError, KeyError, TypeError, ArithmeticError) as e:
+                    self.logger.warning("Invalid risk request %r: %s", line[:200], e)
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            self.logger.info("Risk client disconnected: %s", e)
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+
+    async def log_stats(self, interval=10.0):
+        while True:
+            await asyncio.sleep(interval)
+            self.logger.info("Risk: %s", self.stats())
+
+
+class RiskClient:
+    """
+    Reports to a RiskEngine running in another process.
+
+    Has the same update and add_listener interface as RiskEngine. Updates
+    made while disconnected are dropped, except the latest position of each
+    market, which is resent on reconnect.
+    """
+
+    def __init__(self, path, logger=logging.getLogger()):
+        self.path = path
+        self.logger = logger
+        self.listeners = []
+        self.positions = {}		# market -> last update_position args
+        self.writer = None
+        self.connects = 0
+
+        self.level = RiskLevel.NORMAL
+        # Replaced by the server's throttles as they arrive, defaults until then
+        self.throttles = RiskLimits().throttles
+
+    def add_listener(self, callback):
+        self.listeners.append(callback)
+        callback(self.level, self.throttles[self.level])
+
+    def send(self, call, *args):
+        if (self.writer is None):
+            return
+        line = json.dumps({"call": call, "args": [None if arg is None else str(arg) for arg in args]}) + "\n"
+        self.writer.write(line.encode())
+
+    def update_position(self, market, amount, entry_price, total_margin=None):
+        self.positions[market] = (market, amount, entry_price, total_margin)
+        self.send("update_position", market, amount, entry_price, total_margin)
+
+    def update_mark(self, market, price):
+        self.send("update_mark", market, price)
+
+    def update_balance(self, available, frozen):
+        self.send("update_balance", available, frozen)
+
+    def record_trade(self, market, side, amount, price, fee=None):
+        self.send("record_trade", market, side, amount, price, fee)
+
+    def set_level(self, level, throttle=None):
+        if (throttle is not None):
+            current = self.throttles[level]
+            changed = (throttle.size_factor != current.size_factor or
+                       throttle.spread_multiplier != current.spread_multiplier or throttle.pull != current.pull)
+            self.throttles[level] = throttle
+        else:
+            changed = False
+        if (level != self.level or changed):
+            self.level = level
+            for callback in self.listeners:
+                callback(level, self.throttles[level])
+
+    @staticmethod
+    def parse_level(line):
+        """Returns (level, throttle) of a level message; throttle is None from servers that do not send it."""
+        message = json.loads(line)
+        level = RiskLevel[message["level"]]
+        if ("size_factor" not in message):
+            return level, None
+        return level, Throttle(Decimal(message["size_factor"]), Decimal(message["spread_multiplier"]),
+                               pull=bool(message["pull"]))
+
+    async def connect(self):
+        asyncio.get_event_loop().create_task(self.loop())
+
+    async def loop(self):
+        while True:
+            try:
+                reader, self.writer = await asyncio.open_unix_connection(self.path)
+                self.connects += 1
+                for args in self.positions.values():
+                    self.send("update_position", *args)
+                while True:
+                    line = await reader.readline()
+                    if (not line):
+                        break
+                    self.set_level(*self.parse_level(line))
+            except (OSError, ValueError, KeyError, ArithmeticError) as e:
+                self.logger.warning("Risk engine connection failed: %s", e)
+            self.writer = None
+            await asyncio.sleep(1.0)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Aggregate the risk of every bot process of an account.')
+    parser.add_argument('--socket', dest='socket', default="/tmp/tickspread-risk.sock",
+                        help='unix socket to serve on (default: /tmp/tickspread-risk.sock)')
+    parser.add_argument('--config', dest='config', default="config.json",
+                        help='config file with a "risk" section (default: config.json)')
+    parser.add_argument('--stats_interval', dest='stats_interval', type=float, default=10.0,
+                        help='seconds between stats log lines (default: 10)')
+    return parser.parse_args()
+
+
+async def main():
+    args = parse_arguments()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)-8s %(message)s')
+
+    with open(args.config) as f:
+        config = json.load(f)
+    engine = RiskEngine(RiskLimits.from_config(config.get('risk', {})))
+    await engine.start_server(args.socket)
+    await engine.log_stats(args.stats_interval)
+
+if __name__ == "__main__":
+    try:
+        loop = asyncio.get_event_loop()
+        loop.create_task(main())
+        loop.run_forever()
+    except (Exception, KeyboardInterrupt) as e:
+        print('ERROR', str(e))
+        exit()
@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+"""Multi-process supervisor for bot2
+
+Runs a fleet of bot2 workers on one host:
+
+    - one feed-ingest process opens every external price feed once (through
+      FeedHub) and publishes the ticks on a shared-memory price bus
+      (price_bus.py)
+    - one bot2 worker process per market or market group reads its prices
+      from the bus by polling memory and trades through its own TickSpread
+      connection
+    - every process is pinned to a core: the feed ingest to the first one,
+      the workers round-robin over the rest
+    - a process that exits is restarted with exponential backoff; the
+      backoff resets once the process has stayed up for `--stable_seconds`
+
+Workers run bot2's own `main()` with `--config <file> --markets <group>
+--price_bus <name>` plus `--bot_args`, so configuration and login are the
+same as a standalone bot2 and the bus slots match the workers' config.
+
+Example:
+    To run ETH and SOL together, BTC alone, on cores 2-5::
+
+        $ python3 supervisor.py --group ETH,SOL --group BTC --cores 2-5
+
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import time
+
+from feed_hub import PRICE_SOURCES
+
+
+# Process entry points, run in the spawned children
+
+def pin_to_core(core):
+    if (core is not None and hasattr(os, "sched_setaffinity")):
+        os.sched_setaffinity(0, {core})
+
+
+def run_feed_ingest(bus_name, slots, capacity, core, record_dir):
+    pin_to_core(core)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)-8s feed %(message)s')
+
+    from feed_hub import FeedHub
+    from feed_recorder import FeedRecorder
+    from price_bus import PriceBusWriter
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    async def start():
+        writer = PriceBusWriter(bus_name, slots, capacity=capacity, create=False)
+        hub = FeedHub()
+        if record_dir:
+            hub.on_message(FeedRecorder(record_dir, prefix="feeds").callback)
+        for venue, symbol in slots:
+            hub.subscribe(venue, symbol, writer.callback_for(venue, symbol), name="price_bus")
+        await hub.log_stats(60.0)
+
+    loop.run_until_complete(start())
+
+
+def run_worker(markets, bus_name, core, bot_args, config_path="config.json"):
+    pin_to_core(core)
+    sys.argv = (["bot2.py", "--config", config_path, "--markets", ",".join(markets), "--price_bus", bus_name] +
+                list(bot_args))
+
+    import bot2
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    task = loop.create_task(bot2.main())
+    # bot2.main never returns while the bot is healthy
+    task.add_done_callback(lambda task: loop.stop())
+    loop.run_forever()
+    # Only reached once bot2 gave up, always restart it
+    if (task.done() and not task.cancelled() and task.exception()):
+        print("ERROR", task.exception())
+    sys.exit(1)
+
+
+# Supervisor
+
+class ManagedProcess:
+    def __init__(self, name, target, args, *, core, min_backoff, max_backoff, stable_seconds):
+        self.name = name
+        self.target = target
+        self.args = args
+        self.core = core
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.stable_seconds = stable_seconds
+
+        self.process = None
+        self.started_at = 0.0
+        self.next_start = 0.0
+        self.backoff = 0.0
+        self.restarts = 0
+
+    def start(self, context):
+        self.process = context.Process(target=self.target, args=self.args, name=self.name, daemon=False)
+        self.process.start()
+        self.started_at = time.monotonic()
+        self.next_start = None
+
+    def check(self, context, logger):
+        """Schedules a restart of an exited process and starts it when its backoff has elapsed."""
+        now = time.monotonic()
+        if (self.process is not None and self.process.is_alive()):
+            return
+        if (self.next_start is None):
+            exitcode = self.process.exitcode if self.process else None
+            if (now - self.started_at >= self.stable_seconds):
+                self.backoff = self.min_backoff
+            else:
+                self.backoff = min(max(self.backoff * 2, self.min_backoff), self.max_backoff)
+            self.next_start = now + self.backoff
+            logger.warning("%s exited with %s, restarting in %.1fs", self.name, exitcode, self.backoff)
+            return
+        if (now >= self.next_start):
+            self.restarts += 1
+            logger.info("Restarting %s (restart %d)", self.name, self.restarts)
+            self.start(context)
+
+    def stop(self, timeout=5.0):
+        if (self.process is None or not self.process.is_alive()):
+            return
+        self.process.terminate()
+        self.process.join(timeout)
+        if (self.process.is_alive()):
+            self.process.kill()
+            self.process.join()
+
+
+class Supervisor:
+    def __init__(self, groups, config, *, config_path="config.json", cores=None, bot_args=(), bus_name=None,
+                 capacity=4096, record_dir=None, min_backoff=1.0, max_backoff=60.0, stable_seconds=60.0,
+                 logger=logging.getLogger()):
+        """
+        Args:
+            groups (list): Lists of markets, one worker process per group.
+            config (dict): Parsed config.json.
+            config_path (str): Where `config` was read from, the workers load it too.
+            cores (list, optional): Cores to pin to; None disables pinning.
+            bot_args (list): Extra command line for every bot2 worker.
+        """
+        self.groups = groups
+        self.config = config
+        self.logger = logger
+        self.context = multiprocessing.get_context("spawn")
+        self.bus_name = bus_name or "tickspread-prices-%d" % os.getpid()
+        self.capacity = capacity
+        self.slots = price_slots(config, [market for group in groups for market in group])
+        self.bus = None
+
+        def core(index):
+            if (not cores):
+                return None
+            if (index == 0 or len(cores) == 1):
+                return cores[0]
+            return cores[1 + (index - 1) % (len(cores) - 1)]
+
+        backoff = {'min_backoff': min_backoff, 'max_backoff': max_backoff, 'stable_seconds': stable_seconds}
+        self.processes = [ManagedProcess("feed-ingest", run_feed_ingest,
+                                         (self.bus_name, self.slots, capacity, core(0), record_dir),
+                                         core=core(0), **backoff)]
+        for index, group in enumerate(groups):
+            self.processes.append(ManagedProcess("bot2[%s]" % ",".join(group), run_worker,
+                                                 (group, self.bus_name, core(index + 1), list(bot_args),
+                                                  config_path),
+                                                 core=core(index + 1), **backoff))
+        self.stopping = False
+
+    def start(self):
+        from price_bus import PriceBusWriter
+
+        # The supervisor owns the bus, so it survives feed-ingest restarts
+        self.bus = PriceBusWriter(self.bus_name, self.slots, capacity=self.capacity, create=True)
+        for process in self.processes:
+            self.logger.info("Starting %s on core %s", process.name, process.core)
+            process.start(self.context)
+
+    def run(self, interval=0.5):
+        self.start()
+        try:
+            while not self.stopping:
+                for process in self.processes:
+                    process.check(self.context, self.logger)
+                time.sleep(interval)
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        for process in reversed(self.processes):
+            process.stop()
+        if (self.bus):
+            self.bus.close(unlink=True)
+            self.bus = None
+        self.logger.info("Supervisor stopped")
+
+
+def price_slots(config, markets):
+    """The distinct (venue, symbol) external feeds of `markets`, in a stable order."""
+    slots = []
+    for market in markets:
+        market_settings = config.get('market_settings', {}).get(market)
+        if (not market_settings):
+            raise KeyError("Market settings for '%s' not found in config.json" % market)
+        slot = (PRICE_SOURCES[market_settings['price_source']], market_settings['external_market'])
+        if (slot not in slots):
+            slots.append(slot)
+    return slots
+
+
+def parse_cores(text):
+    """Parses '0-3,6' into [0, 1, 2, 3, 6]."""
+    cores = []
+    for part in text.split(","):
+        if ("-" in part):
+            first, last = part.split("-", 1)
+            cores.extend(range(int(first), int(last) + 1))
+        elif (part.strip()):
+            cores.append(int(part))
+    return cores
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Run one bot2 worker process per market group with a shared price bus.')
+    parser.add_argument('--group', dest='groups', action='append', default=[],
+                        help='comma separated markets run by one worker, e.g. ETH,SOL (repeatable)')
+    parser.add_argument('--markets', dest='markets', default=None,
+                        help='comma separated markets or "all", one worker each (used without --group)')
+    parser.add_argument('--config', dest='config', default="config.json",
+                        help='config file (default: config.json)')
+    parser.add_argument('--cores', dest='cores', default=None,
+                        help='cores to pin to, e.g. 2-7 (default: the cores this process may run on)')
+    parser.add_argument('--no_pin', dest='no_pin', action='store_true',
+                        help='do not pin processes to cores')
+    parser.add_argument('--bot_args', dest='bot_args', default="",
+                        help='extra command line for every bot2 worker, e.g. "--env dev"')
+    parser.add_argument('--record_dir', dest='record_dir', default=None,
+                        help='record the raw external feeds of the feed-ingest process into this directory')
+    parser.add_argument('--max_backoff', dest='max_backoff', type=float, default=60.0,
+                        help='maximum seconds between restarts of a crashing process (default: 60)')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)-8s %(message)s')
+
+    with open(args.config) as f:
+        config = json.load(f)
+
+    if args.groups:
+        groups = [[market.strip() for market in group.split(",") if market.strip()] for group in args.groups]
+    else:
+        if (not args.markets or args.markets == "all"):
+            markets = list(config.get('market_settings', {}).keys())
+        else:
+            markets = [market.strip() for market in args.markets.split(",") if market.strip()]
+        groups = [[market] for market in markets]
+
+    if args.no_pin:
+        cores = None
+    elif args.cores:
+        cores = parse_cores(args.cores)
+    elif hasattr(os, "sched_getaffinity"):
+        cores = sorted(os.sched_getaffinity(0))
+    else:
+        cores = None
+
+    supervisor = Supervisor(groups, config, config_path=args.config, cores=cores, bot_args=args.bot_args.split(),
+                            record_dir=args.record_dir, max_backoff=args.max_backoff)
+
+    def stop(signum, frame):
+        supervisor.stopping = True
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    supervisor.run()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
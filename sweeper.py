@@ -35,9 +35,12 @@ import logging.handlers
 from decimal import Decimal
 from tickspread_api import TickSpreadAPI
 
-from Secrets import Secrets
-
-from outside_api import FTXAPI
+try:
+    from outside_api import FTXAPI
+except ImportError:
+    # FTX is gone from outside_api; Sweeper still runs against another
+    # ftx_api (e.g. benchmark.py passes None), only main() needs it
+    FTXAPI = None
 #from outside_api import ByBitAPI, FTXAPI, BinanceAPI, BitMEXAPI, HuobiAPI
 
 parser = argparse.ArgumentParser(
@@ -840,6 +843,12 @@ class Sweeper:
         return rc
 
 async def main():
+    # Needs web3, only for the FTX credentials
+    from Secrets import Secrets
+
+    if (FTXAPI is None):
+        print("outside_api has no FTXAPI, the sweeper cannot hedge")
+        return 1
     api = TickSpreadAPI(id_multiple=1000, env=env)
     ftx_api = FTXAPI(auth=Secrets())
     sweeper = Sweeper(api, ftx_api=ftx_api)
@@ -6,6 +6,7 @@ from requests.exceptions import HTTPError
 
 import json
 import asyncio
+import collections
 import websockets
 import logging
 import aiohttp
@@ -14,18 +15,111 @@ import time
 import sys
 
 from datetime import datetime
+from enum import Enum
 import time
 
+from metrics import REGISTRY
+
 
 MAX_RETRIES = 5
+MAX_BATCH_SIZE = 100
+# Backoff between the attempts of an order request, doubling from the base
+RETRY_BASE_DELAY = 0.1
+RETRY_MAX_DELAY = 1.0
+# Order requests failing in a row, after their retries, before the API is reported down
+MAX_CONSECUTIVE_FAILURES = 3
+# Cancelled by probe(); client_order_ids are time based, so no order ever has it
+PROBE_CLORDID = 0
+BATCH_SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+TRANSIENT_STATUS = {408, 425, 429}
+FATAL_STATUS = {401, 403}
+
+
+class ErrorClass(Enum):
+    TRANSIENT = 1	# timeouts, connection errors, overload: retry
+    REJECTED = 2	# the exchange refused the request, retrying does not help
+    FATAL = 3		# no order request can succeed, e.g. the token was refused
+
+
+def classify_error(exception=None, status_code=None):
+    """Returns the ErrorClass of a failed request, or None if `status_code` is a success."""
+    if (exception is not None):
+        if (isinstance(exception, (requests.exceptions.URLRequired, requests.exceptions.MissingSchema,
+                                   requests.exceptions.InvalidSchema, requests.exceptions.InvalidURL,
+                                   requests.exceptions.InvalidHeader))):
+            # The request itself is malformed
+            return ErrorClass.FATAL
+        if (isinstance(exception, requests.exceptions.RequestException)):
+            # Timeouts, connection resets, broken chunked responses, ...
+            return ErrorClass.TRANSIENT
+        return ErrorClass.FATAL
+    if (status_code in FATAL_STATUS):
+        return ErrorClass.FATAL
+    if (status_code in TRANSIENT_STATUS or status_code >= 500):
+        return ErrorClass.TRANSIENT
+    if (status_code >= 400):
+        return ErrorClass.REJECTED
+    return None
+
 
 class TickSpreadAPI:
-    def __init__(self, logger=logging.getLogger(), id_multiple=100, env="staging"):
+    def __init__(self, logger=logging.getLogger(), id_multiple=100, env="staging", pool_size=16,
+                 flush_window=None, max_batch_size=MAX_BATCH_SIZE, rate_limiter=None, auction_cadence=None,
+                 split_topics=False):
+        """
+        Args:
+            flush_window (float, optional): Seconds dispatch_batch waits to merge the operations of
+                every market into one request; 0 merges everything queued in the current event loop
+                iteration, None sends each dispatch_batch right away.
+            max_batch_size (int): Operations per /v2/orders/batch request, larger flushes are split.
+            rate_limiter (RateLimiter, optional): Budget of order operations and requests,
+                see rate_limiter.py; None sends without limits.
+            auction_cadence (AuctionCadence, optional): Holds the queued operations until just
+                before the next auction once its period is known, instead of flush_window.
+            split_topics (bool): Opens one websocket for user_data and one for market_data, and
+                processes the user_data frames that are waiting before any market_data frame.
+        """
         self.next_id = int(time.time()*id_multiple)
         self.logger = logger
         self.callbacks = []
+        self.batch_callbacks = []
+        self.split_topics = split_topics
+        self.websockets = {}		# topic -> websocket, with split_topics
+        self.inbox = {"user_data": collections.deque(), "market_data": collections.deque()}
+        self.inbox_ready = None
+        self.state_callbacks = []
+        self.event_loop = None
+
+        # Keep-alive connections shared by every request, including the
+        # executor threads and every market sharing this API
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
 
         self.operations = []
+        self.flush_window = flush_window
+        self.max_batch_size = max_batch_size
+        self.flush_handle = None
+        self.rate_limiter = rate_limiter
+        self.auction_cadence = auction_cadence
+        self.operations_netted = 0
+        self.batches_sent = 0
+        self.operations_sent = 0
+        self.operations_failed = 0
+        self.http_failures = 0
+        self.retries = 0
+        self.consecutive_failures = 0
+        self.down = False
+
+        # Hot path metrics, see metrics.py
+        self.request_seconds = REGISTRY.histogram("http_request_seconds", "Latency of order requests, per attempt",
+                                                  ("endpoint",))
+        self.request_seconds_by_url = {}	# url -> Histogram
+        self.batch_operations = REGISTRY.histogram("batch_operations", "Operations per batch request",
+                                                   bounds=BATCH_SIZE_BUCKETS).labels()
+        self.websocket_connects = REGISTRY.counter("websocket_connects_total", "TickSpread websocket connections",
+                                                   ("topic",))
         #self.host = 'api.tickspread.com'
         
         if env == "dev":
@@ -45,7 +139,7 @@ class TickSpreadAPI:
         print(url, payload)
         
         try:
-            r = requests.post(url, json=payload, timeout=5.0)
+            r = self.session.post(url, json=payload, timeout=5.0)
         except requests.exceptions.ReadTimeout:
             self.logger.error("Login timeout")
             return False
@@ -68,7 +162,7 @@ class TickSpreadAPI:
         url = '%s/v1/accounts' % self.http_host
         
         try:
-            requests.post(url, json=payload, timeout=5.0)
+            self.session.post(url, json=payload, timeout=5.0)
         except requests.exceptions.ReadTimeout:
             self.logger.error("Register timeout")
         except Exception as e:
@@ -86,37 +180,37 @@ class TickSpreadAPI:
     def mount_delete_order(client_order_id, symbol):
         return {"client_order_id": client_order_id, "market": symbol}
 
+    def batch_result_failed(result):
+        return isinstance(result, dict) and result.get("status", "ok") != "ok"
+
     def create_order_sync(self, client_order_id, amount, price, leverage, symbol, side, type, sweeper):
 
         order = TickSpreadAPI.mount_create_order(client_order_id, amount, price, leverage, symbol, side, type, sweeper)
         
         url = '%s/v2/orders' % self.http_host
-        try:
-            self.logger.info(order)
-            print(f'{str(time.process_time())} -> client_order_id = {str(client_order_id)}')
-            r = requests.post(url, headers={"authorization": (
-                "Bearer %s" % self.token), "seq": str(client_order_id)}, json=order, timeout=5.0)
-            print(f'{str(time.process_time())} <- client_order_id = {str(client_order_id)}')
-        except Exception as e:
-            print(e, flush=True)
-            self.logger.error(e)
-            logging.shutdown()
-            sys.exit(1)
-        
+        self.logger.info(order)
+        print(f'{str(time.process_time())} -> client_order_id = {str(client_order_id)}')
+        self.wait_for_endpoint("orders")
+        r = self.send_with_retry("POST", url, "Create %s" % client_order_id, headers={"authorization": (
+            "Bearer %s" % self.token), "seq": str(client_order_id)}, json=order)
+        print(f'{str(time.process_time())} <- client_order_id = {str(client_order_id)}')
+        if (r is None):
+            return None
+
         try:
             text_json = json.loads(r.text)
             client_order_id = text_json["client_order_id"]
             print(text_json)
         except Exception as e:
-            print(r.text)
-            print(e, flush=True)
-            self.logger.error(r.text[:500])
-            logging.shutdown()
-            sys.exit(1)
-        
+            self.logger.error("Create %s: %s", client_order_id, r.text[:500])
+            return None
+
         return client_order_id
 
     def create_order(self, *, client_order_id=0, amount, price, leverage, symbol="ETH", side, type="limit", batch=False, asynchronous=False, sweeper=0):
+        if (self.rate_limiter and not self.rate_limiter.take_create()):
+            # Out of budget, nothing is sent
+            return None
         if (client_order_id == 0):
             client_order_id = self.next_id
             self.next_id += 1
@@ -140,24 +234,21 @@ class TickSpreadAPI:
 
     def delete_order_sync(self, client_order_id, symbol):
         url = '%s/v2/orders' % (self.http_host)
-        counter = 0
-        r = None
         order = TickSpreadAPI.mount_delete_order(client_order_id, symbol)
-        while counter < MAX_RETRIES:
-            try:
-                counter += 1
-                r = requests.delete(url, headers={"authorization": ("Bearer %s" % self.token), "seq": str(client_order_id)}, json=order, timeout=5.0)
-                json_response = json.loads(r.text)
-                if (r.status_code == 200):
-                    break
-            except Exception as e:
-                if (r): self.logger.error(r.text)
-                else: self.logger.error(e)
-                #logging.shutdown()
-                #sys.exit(1)
-        return json_response
+        self.wait_for_endpoint("orders")
+        r = self.send_with_retry("DELETE", url, "Delete %s" % client_order_id, headers={
+            "authorization": ("Bearer %s" % self.token), "seq": str(client_order_id)}, json=order)
+        if (r is None):
+            return None
+        try:
+            return json.loads(r.text)
+        except ValueError:
+            self.logger.error("Delete %s: %s", client_order_id, r.text[:500])
+            return None
 
     def delete_order(self, client_order_id, symbol="ETH", asynchronous=False, batch=False):
+        if (self.rate_limiter):
+            self.rate_limiter.take_cancel()
         if (batch==True):
             order = TickSpreadAPI.mount_delete_order(client_order_id, symbol)
             order["operation"] = "delete"
@@ -173,25 +264,253 @@ class TickSpreadAPI:
             client_order_id,symbol)
             return "OK"
 
+    def create_budget(self):
+        """Creates the rate limiter still accepts right now, None without a limiter."""
+        if (self.rate_limiter is None):
+            return None
+        return self.rate_limiter.create_budget()
+
+    def wait_for_endpoint(self, endpoint):
+        """Blocks the calling executor thread until a request to `endpoint` is within budget."""
+        if (self.rate_limiter is None):
+            return
+        wait = self.rate_limiter.take_request(endpoint)
+        while (wait):
+            time.sleep(wait)
+            wait = self.rate_limiter.take_request(endpoint)
+
     def dispatch_batch(self):
-        if self.operations:
+        """
+        Sends the queued operations, of every market sharing this API.
+
+        With a flush window the send is deferred, so the operations other
+        markets queue meanwhile go out in the same request. With an auction
+        cadence the send waits until just before the next auction.
+        """
+        if (not self.operations):
+            return
+        delay = self.flush_window
+        if (self.auction_cadence is not None):
+            hold = self.auction_cadence.delay()
+            if (hold is not None):
+                delay = hold
+        if (delay is None):
+            self.flush_batch()
+        elif (self.flush_handle is None):
             loop = asyncio.get_event_loop()
-            loop.run_in_executor(None, self.send_batch, self.operations)
-            self.operations = []
+            if (delay > 0):
+                self.flush_handle = loop.call_later(delay, self.flush_batch)
+            else:
+                self.flush_handle = loop.call_soon(self.flush_batch)
+
+    def flush_batch(self):
+        self.flush_handle = None
+        if (not self.operations):
+            return
+        operations, self.operations = self.operations, []
+        operations, netted = self.net_operations(operations)
+        if (netted and self.batch_callbacks):
+            self.deliver_batch_results(netted)
+        if (not operations):
+            return
+        batches = [operations[i:i + self.max_batch_size] for i in range(0, len(operations), self.max_batch_size)]
+        loop = asyncio.get_event_loop()
+        # One executor job, so the requests keep the order of the operations
+        loop.run_in_executor(None, self.send_batches, batches, loop)
+
+    def net_operations(self, operations):
+        """
+        Drops the creates deleted in the same flush, with their deletes, and repeated deletes.
+
+        Returns:
+            tuple: (operations to send, [(operation, {"status": "netted"})] for the dropped pairs).
+        """
+        created = set()
+        deleted = set()
+        deletes = 0
+        for operation in operations:
+            if (operation.get("operation") == "create"):
+                created.add(operation["client_order_id"])
+            elif (operation.get("operation") == "delete"):
+                deleted.add(operation["client_order_id"])
+                deletes += 1
+        both = created & deleted
+        if (not both and len(deleted) == deletes):
+            return operations, []
+
+        kept = []
+        netted = []
+        sent_deletes = set()
+        for operation in operations:
+            client_order_id = operation["client_order_id"]
+            if (client_order_id in both):
+                netted.append((operation, {"client_order_id": client_order_id, "status": "netted"}))
+            elif (operation.get("operation") == "delete"):
+                if (client_order_id not in sent_deletes):
+                    sent_deletes.add(client_order_id)
+                    kept.append(operation)
+            else:
+                kept.append(operation)
+        self.operations_netted += len(operations) - len(kept)
+        return kept, netted
+
+    def send_batches(self, batches, loop):
+        for operations in batches:
+            self.wait_for_endpoint("batch")
+            results = self.send_batch(operations)
+            if (results and self.batch_callbacks):
+                loop.call_soon_threadsafe(self.deliver_batch_results, results)
+
+    def on_batch_result(self, callback):
+        """Registers `callback(operation, result)`, called on the event loop for every batched operation."""
+        self.batch_callbacks.append(callback)
+
+    def deliver_batch_results(self, results):
+        for operation, result in results:
+            for callback in self.batch_callbacks:
+                callback(operation, result)
+
+    def send_with_retry(self, method, url, what, **kwargs):
+        """
+        Sends an order request, retrying transient failures with bounded backoff.
+
+        Retries are safe because every order operation carries its
+        client_order_id (and single requests the same seq header), so an
+        attempt that did reach the exchange makes the next one a duplicate
+        instead of a second order. The outcome is passed to record_outcome,
+        which reports the API down after repeated failures.
+
+        Args:
+            what (str): Description of the request for the logs.
+
+        Returns:
+            requests.Response: The last response, or None if the last attempt raised.
+        """
+        r = None
+        error = None
+        detail = None
+        attempts = 0
+        latency = self.request_seconds_by_url.get(url)
+        if (latency is None):
+            latency = self.request_seconds_by_url[url] = self.request_seconds.labels(url[len(self.http_host):])
+        while (attempts < MAX_RETRIES):
+            if (attempts):
+                self.retries += 1
+                time.sleep(min(RETRY_BASE_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY))
+            attempts += 1
+            start = time.perf_counter()
+            try:
+                r = self.session.request(method, url, timeout=5.0, **kwargs)
+                latency.observe(time.perf_counter() - start)
+                error = classify_error(status_code=r.status_code)
+                detail = "HTTP %d" % r.status_code
+            except Exception as e:
+                latency.observe(time.perf_counter() - start)
+                r = None
+                error = classify_error(exception=e)
+                detail = str(e)
+            if (error != ErrorClass.TRANSIENT):
+                break
+            self.logger.warning("%s failed (%s), attempt %d of %d", what, detail, attempts, MAX_RETRIES)
+        if (r is not None):
+            r.attempts = attempts
+        self.record_outcome(error, what, detail)
+        return r
+
+    def record_outcome(self, error, what, detail):
+        if (error is None or error == ErrorClass.REJECTED):
+            # The exchange answered
+            if (error == ErrorClass.REJECTED):
+                self.http_failures += 1
+            self.consecutive_failures = 0
+            if (self.down):
+                self.down = False
+                self.logger.warning("Order requests succeed again")
+                self.notify_state(False, what)
+            return
+
+        self.http_failures += 1
+        self.consecutive_failures += 1
+        self.logger.error("%s failed: %s", what, detail)
+        if (not self.down and (error == ErrorClass.FATAL or
+                               self.consecutive_failures >= MAX_CONSECUTIVE_FAILURES)):
+            self.down = True
+            self.notify_state(True, "%s: %s" % (what, detail))
+
+    def probe(self, symbol):
+        """
+        Cancels PROBE_CLORDID in the background, to learn whether order requests work again.
+
+        The exchange refusing the cancel is an answer too, so any reply
+        clears `down` through record_outcome.
+        """
+        asyncio.get_event_loop().run_in_executor(None, self.delete_order_sync, PROBE_CLORDID, symbol)
+
+    def on_api_state(self, callback):
+        """Registers `callback(down, reason)`, called on the event loop when order requests stop or resume working."""
+        self.state_callbacks.append(callback)
+
+    def notify_state(self, down, reason):
+        if (self.event_loop is None):
+            return
+        for callback in self.state_callbacks:
+            self.event_loop.call_soon_threadsafe(callback, down, reason)
 
     def send_batch(self, operations):
         url = '%s/v2/orders/batch' % self.http_host
         batch = {"operations": operations}
+        self.logger.info(batch)
+        self.batch_operations.observe(len(operations))
+        r = self.send_with_retry("POST", url, "Batch of %d operations" % len(operations), headers={
+            "authorization": ("Bearer %s" % self.token)}, json=batch)
+        if (r is None):
+            # Whether the operations arrived is unknown, the websocket or
+            # the bots' timeouts tell
+            return []
+        self.batches_sent += 1
+        self.operations_sent += len(operations)
+        return self.parse_batch_response(operations, r)
+
+    def parse_batch_response(self, operations, r):
+        """
+        Pairs every operation with its entry in the response's "results".
+
+        Results are matched by position, or by client_order_id when the
+        counts differ. Operations without a result are left out. After a
+        retry, a create refused as a duplicate client_order_id is the one
+        an earlier attempt placed, and is reported as ok.
+
+        Returns:
+            list: (operation, result) tuples.
+        """
         try:
-            self.logger.info(batch)
-            r = requests.post(url, headers={"authorization": (
-                "Bearer %s" % self.token)}, json=batch, timeout=5.0)
-            #print(f'{str(time.process_time())} <- ')
-        except Exception as e:
-            print(e, flush=True)
-            self.logger.error(e)
-            logging.shutdown()
-            sys.exit(1)
+            data = json.loads(r.text)
+            results = data["results"] if isinstance(data, dict) else data
+        except Exception:
+            self.logger.error("Batch response %d: %s", r.status_code, r.text[:500])
+            return []
+        if (not isinstance(results, list)):
+            return []
+
+        if (len(results) == len(operations)):
+            pairs = list(zip(operations, results))
+        else:
+            by_clordid = {str(result.get("client_order_id")): result for result in results if isinstance(result, dict)}
+            pairs = [(operation, by_clordid[str(operation["client_order_id"])])
+                     for operation in operations if str(operation["client_order_id"]) in by_clordid]
+
+        if (getattr(r, "attempts", 1) > 1):
+            pairs = [(operation, dict(result, status="ok"))
+                     if (operation.get("operation") == "create" and TickSpreadAPI.batch_result_failed(result) and
+                         "duplicate" in str(result.get("reason", "")))
+                     else (operation, result) for operation, result in pairs]
+
+        for operation, result in pairs:
+            if (TickSpreadAPI.batch_result_failed(result)):
+                self.operations_failed += 1
+                self.logger.warning("Batch %s %s %s failed: %s", operation.get("operation"), operation.get("market"),
+                                    operation.get("client_order_id"), result.get("reason", result))
+        return pairs
     
     def update_margin_sync(self, market, amount):
         url = f'{self.http_host}/v3/broker/margin_update_request'
@@ -201,7 +520,7 @@ class TickSpreadAPI:
         }
         
         try:
-            r = requests.post(
+            r = self.session.post(
                 url, 
                 headers={
                     "Authorization": f"Bearer {self.token}",
@@ -262,7 +581,21 @@ class TickSpreadAPI:
             return self.update_margin_sync(market, amount)
     
     async def connect(self):
+        self.event_loop = asyncio.get_event_loop()
+        if (self.split_topics):
+            # Our executions do not queue behind the market data
+            for topic in ("user_data", "market_data"):
+                self.websockets[topic] = await websockets.connect("%s/realtime" % self.ws_host, ping_interval=None)
+                self.websocket_connects.labels(topic).inc()
+            self.websocket = self.websockets["market_data"]
+            self.inbox_ready = asyncio.Event()
+            print("connect (split)")
+            for topic, websocket in self.websockets.items():
+                self.event_loop.create_task(self.read(websocket, self.inbox[topic]))
+            self.event_loop.create_task(self.dispatch_frames())
+            return
         self.websocket = await websockets.connect("%s/realtime" % self.ws_host, ping_interval=None)
+        self.websocket_connects.labels("all").inc()
         print("connect")
         asyncio.get_event_loop().create_task(self.loop(self.websocket))
 
@@ -277,7 +610,7 @@ class TickSpreadAPI:
         print(data)
         
         try:
-            await self.websocket.send(json.dumps(data))
+            await self.websockets.get(topic, self.websocket).send(json.dumps(data))
         except Exception as e:
             self.logger.error(e)
             logging.shutdown()
@@ -301,6 +634,38 @@ class TickSpreadAPI:
                 rc = callback('tickspread', message)
         asyncio.get_event_loop().stop()  #exit the process
 
+    async def read(self, websocket, inbox):
+        while True:
+            try:
+                message = await websocket.recv()
+            except Exception as e:
+                print("ERROR")
+                self.logger.error(e)
+                logging.shutdown()
+                sys.exit(1)
+            inbox.append(message)
+            self.inbox_ready.set()
+
+    async def dispatch_frames(self):
+        """Runs the callbacks on the frames of both sockets, the waiting user_data frames first."""
+        user_data = self.inbox["user_data"]
+        market_data = self.inbox["market_data"]
+        rc = 0
+        while rc == 0:
+            if (not user_data and not market_data):
+                self.inbox_ready.clear()
+                await self.inbox_ready.wait()
+                continue
+            from_market = not user_data
+            message = market_data.popleft() if from_market else user_data.popleft()
+            for callback in self.callbacks:
+                rc = callback('tickspread', message)
+            if (from_market):
+                # Let the readers queue what arrived meanwhile, so an
+                # execution never waits behind a run of market data
+                await asyncio.sleep(0)
+        asyncio.get_event_loop().stop()  #exit the process
+
 async def main():
     logging.basicConfig(level=logging.INFO, filename="test.log")
     
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""Hashed timer wheel
+
+Timers are kept in a ring of `slots` buckets of `tick` seconds each.
+Scheduling and cancelling are O(1), and advance() only looks at the
+buckets of the ticks that elapsed, so the cost per tick does not depend on
+how many timers are pending. Timers further away than one turn of the
+wheel stay in their bucket until their deadline comes around.
+
+The wheel has no thread or task of its own: the owner calls advance(),
+e.g. from its message callbacks and from a periodic task, and the due
+callbacks run right there.
+
+"""
+
+import math
+import time
+
+
+class Timer:
+    __slots__ = ('deadline', 'callback', 'args', 'cancelled')
+
+    def __init__(self, deadline, callback, args):
+        self.deadline = deadline		# in ticks
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerWheel:
+    def __init__(self, tick=0.05, slots=512, clock=time.monotonic):
+        """
+        Args:
+            tick (float): Resolution in seconds; timers fire up to one tick late.
+            slots (int): Buckets in the wheel.
+            clock (callable): Time source in seconds.
+        """
+        self.tick = tick
+        self.slots = [[] for _ in range(slots)]
+        self.clock = clock
+        self.current_tick = int(clock() / tick)
+        self.pending = 0
+        self.fired = 0
+
+    def schedule(self, delay, callback, *args):
+        """Calls `callback(*args)` once `delay` seconds have passed; returns a Timer with cancel()."""
+        deadline = self.current_tick + max(1, math.ceil(delay / self.tick))
+        timer = Timer(deadline, callback, args)
+        self.slots[deadline % len(self.slots)].append(timer)
+        self.pending += 1
+        return timer
+
+    def advance(self, now=None):
+        """Runs the callbacks of every timer due by `now`; returns how many ran."""
+        now_tick = int((self.clock() if now is None else now) / self.tick)
+        if (now_tick <= self.current_tick):
+            return 0
+        if (now_tick - self.current_tick >= len(self.slots)):
+            # Idle for more than a turn, every bucket may hold due timers
+            ticks = range(len(self.slots))
+        else:
+            ticks = range(self.current_tick + 1, now_tick + 1)
+        self.current_tick = now_tick
+
+        due = []
+        for tick in ticks:
+            bucket = self.slots[tick % len(self.slots)]
+            if (not bucket):
+                continue
+            keep = []
+            for timer in bucket:
+                if (timer.cancelled):
+                    self.pending -= 1
+                elif (timer.deadline <= now_tick):
+                    due.append(timer)
+                else:
+                    keep.append(timer)
+            bucket[:] = keep
+
+        due.sort(key=lambda timer: timer.deadline)
+        fired = 0
+        for timer in due:
+            self.pending -= 1
+            if (not timer.cancelled):
+                fired += 1
+                timer.callback(*timer.args)
+        self.fired += fired
+        return fired